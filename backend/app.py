@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, render_template, redirect, url_for, session, send_from_directory, make_response
+from flask import Flask, jsonify, request, render_template, redirect, url_for, session, send_from_directory, make_response, Response, stream_with_context, g
 from flask_cors import CORS
 import boto3
 from config.aws_config import AWS_ACCESS_KEY, AWS_SECRET_KEY, REGION
@@ -7,15 +7,39 @@ import os
 from botocore.exceptions import ClientError
 import logging
 from logging.handlers import RotatingFileHandler
-from functools import lru_cache
 import time
 import sys
 import traceback
 from dotenv import load_dotenv
 from config.config import get_config
 import secrets
+import json
 from urllib.parse import urlparse
 from flask.sessions import SecureCookieSessionInterface
+from werkzeug.middleware.proxy_fix import ProxyFix
+from session_store import create_session_interface
+from cache import MISSING, TTLCache
+from storage import (
+    CapacityTelemetry, UnprocessedKeys, batch_get_items, capacity_settings, client_config, is_throttle_error, scan_pages
+)
+from ratelimit import create_rate_limiter
+from revisions import RevisionLog, RevisionNotFound
+from boto3.dynamodb.conditions import Attr
+from collab import SETTINGS_KEYS, CollabHub, StaleRevision, extract_text, merge_settings, merge_text
+from presence import PresenceHub, UnknownMember
+from pubsub import create_bus
+from changefeed import WATCHED_TABLES, create_change_feed
+from health import HealthMonitor
+from backup import DEFAULT_TABLES, TransferStats, export_lines, gunzip_lines, gzip_chunks, import_lines
+from search import SearchIndex, SearchIndexer
+from render import RenderCache, theme_css
+from tracing import SamplingProfiler, Tracer
+from polling import PollAdvisor
+from lifecycle import Lifecycle
+from otp import create_otp_store
+from payload import PayloadTooLarge, read_json_object
+import hmac
+import atexit
 
 import smtplib
 from email.mime.text import MIMEText
@@ -51,8 +75,31 @@ app.config.update(
     SESSION_COOKIE_DOMAIN='.utrains.selftesthub.com' if os.environ.get('FLASK_ENV') == 'production' else None
 )
 
-# Configure session interface
-app.session_interface = SecureCookieSessionInterface()
+# remote_addr is the client as seen by the nearest trusted proxy, never a header the client wrote
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+
+# Configure session interface (verified-cookie cache or server-side store)
+app.session_interface = create_session_interface(app.config)
+
+# Opt-in request tracing: auth, cache, storage and serialize spans, with a slow-request log
+tracer = Tracer(
+    enabled=app.config['TRACE_ENABLED'],
+    sample_rate=app.config['TRACE_SAMPLE_RATE'],
+    slow_ms=app.config['TRACE_SLOW_MS'],
+    history=app.config['TRACE_SLOW_HISTORY'],
+    logger=app.logger
+)
+if tracer.enabled:
+    tracer.install_session_spans(app.session_interface)
+    app.json_encoder = tracer.json_encoder(app.json_encoder)
+    app.wsgi_app = tracer.wrap_wsgi(app.wsgi_app)
+profiler = SamplingProfiler(app.config['PROFILE_DIR'], logger=app.logger)
+
+# Graceful shutdown: drain in-flight requests, then flush and stop background work (hooks at the end)
+lifecycle = Lifecycle(drain_timeout=app.config['SHUTDOWN_DRAIN_TIMEOUT'], logger=app.logger)
+app.wsgi_app = lifecycle.wrap_wsgi(app.wsgi_app)
+app.extensions['lifecycle'] = lifecycle
 
 # Initialize CORS
 CORS(app, supports_credentials=True, resources={
@@ -66,11 +113,54 @@ CORS(app, supports_credentials=True, resources={
     }
 })
 
-# Initialize DynamoDB
+# Token bucket limits on the save and poll endpoints
+rate_limiter = create_rate_limiter(app.config, logger=app.logger)
+
+# Initialize DynamoDB with adaptive client-side throttling
 dynamodb = boto3.resource('dynamodb',
     aws_access_key_id=AWS_ACCESS_KEY,
     aws_secret_access_key=AWS_SECRET_KEY,
-    region_name=REGION
+    region_name=REGION,
+    config=client_config(app.config['DYNAMODB_RETRY_MODE'], app.config['DYNAMODB_MAX_ATTEMPTS'])
+)
+
+# Export and import move items in the wire format as they are; the resource's client
+# converts to and from Python values, so backups get a plain client of their own
+backup_client = boto3.client('dynamodb',
+    aws_access_key_id=AWS_ACCESS_KEY,
+    aws_secret_access_key=AWS_SECRET_KEY,
+    region_name=REGION,
+    config=client_config(app.config['DYNAMODB_RETRY_MODE'], app.config['DYNAMODB_MAX_ATTEMPTS'])
+)
+
+# Track consumed capacity and throttling for every DynamoDB call
+capacity_telemetry = CapacityTelemetry()
+capacity_telemetry.install(dynamodb.meta.client)
+capacity_telemetry.install(backup_client)
+if tracer.enabled:
+    tracer.install_storage_spans(dynamodb.meta.client)
+
+# Every write to live_notes and users, whichever code path makes it; handlers are registered below
+change_feed = create_change_feed(
+    app.config,
+    dynamodb,
+    WATCHED_TABLES,
+    streams=boto3.client('dynamodbstreams',
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        region_name=REGION,
+        config=client_config(app.config['DYNAMODB_RETRY_MODE'], app.config['DYNAMODB_MAX_ATTEMPTS'])
+    ) if app.config['CHANGE_FEED_BACKEND'] == 'streams' else None,
+    logger=app.logger
+)
+# Restored items must reach the caches like any other write
+change_feed.install(backup_client)
+
+# Table and GSI capacity arguments for the configured billing mode
+table_capacity, index_capacity = capacity_settings(
+    app.config['DYNAMODB_BILLING_MODE'],
+    app.config['DYNAMODB_READ_CAPACITY'],
+    app.config['DYNAMODB_WRITE_CAPACITY']
 )
 
 # Create a new DynamoDB table for users if it doesn't exist
@@ -94,10 +184,7 @@ def create_users_table():
                         'AttributeType': 'S'
                     }
                 ],
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 5,
-                    'WriteCapacityUnits': 5
-                }
+                **table_capacity
             )
             table.meta.client.get_waiter('table_exists').wait(TableName='users')
     return table
@@ -142,16 +229,10 @@ def create_table_if_not_exists():
                         'Projection': {
                             'ProjectionType': 'ALL'
                         },
-                        'ProvisionedThroughput': {
-                            'ReadCapacityUnits': 5,
-                            'WriteCapacityUnits': 5
-                        }
+                        **index_capacity
                     }
                 ],
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 5,
-                    'WriteCapacityUnits': 5
-                }
+                **table_capacity
             )
             table.meta.client.get_waiter('table_exists').wait(TableName='live_notes')
         else:
@@ -161,6 +242,44 @@ def create_table_if_not_exists():
 # Create table on startup
 create_table_if_not_exists()
 
+# Create the revision history table if it doesn't exist
+def create_revisions_table():
+    try:
+        table = dynamodb.Table('note_revisions')
+        table.table_status
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException':
+            table = dynamodb.create_table(
+                TableName='note_revisions',
+                KeySchema=[
+                    {
+                        'AttributeName': 'classroom_id',
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': 'revision',
+                        'KeyType': 'RANGE'
+                    }
+                ],
+                AttributeDefinitions=[
+                    {
+                        'AttributeName': 'classroom_id',
+                        'AttributeType': 'S'
+                    },
+                    {
+                        'AttributeName': 'revision',
+                        'AttributeType': 'N'
+                    }
+                ],
+                **table_capacity
+            )
+            table.meta.client.get_waiter('table_exists').wait(TableName='note_revisions')
+        else:
+            raise e
+    return table
+
+create_revisions_table()
+
 # # Initialize AWS Cognito for authentication
 # cognito = boto3.client('cognito-idp',
 #     aws_access_key_id=AWS_ACCESS_KEY,
@@ -231,8 +350,19 @@ if __name__ != '__main__':
     app.logger.handlers = gunicorn_logger.handlers
     app.logger.setLevel(gunicorn_logger.level)
 
+# Endpoints reading their body incrementally, without the MAX_CONTENT_LENGTH limit
+STREAMED_ENDPOINTS = {'admin_import'}
+
+def payload_too_large():
+    return jsonify({'error': f"Request body exceeds {app.config['MAX_CONTENT_LENGTH']} bytes"}), 413
+
 @app.before_request
 def before_request():
+    # Refuse on the declared length before reading anything; chunked bodies are capped as they are read
+    limit = app.config['MAX_CONTENT_LENGTH']
+    if limit and (request.content_length or 0) > limit and request.endpoint not in STREAMED_ENDPOINTS:
+        return payload_too_large()
+    
     app.logger.info(f"Request path: {request.path}")
     app.logger.info(f"Current session: {session}")
     app.logger.info(f"Request cookies: {request.cookies}")
@@ -240,6 +370,11 @@ def before_request():
 @app.after_request
 def after_request(response):
     app.logger.info(f"Response cookies: {response.headers.get('Set-Cookie')}")
+    classroom_id = (request.view_args or {}).get('classroom_id')
+    if classroom_id and (g.get('throttled') or g.get('shed_scope') == 'classroom'):
+        # DynamoDB throttled or the whole classroom was shed: its viewers poll less for a while.
+        # One client over its own limit says nothing about the classroom.
+        poll_advisor.record_pressure(classroom_id)
     return response
 
 # @app.route('/')
@@ -264,12 +399,9 @@ def login():
         app.logger.info(f"Request cookies: {dict(request.cookies)}")
         
         # Get user data
-        users_table = dynamodb.Table('users')
         try:
-            app.logger.info(f"Attempting to fetch user from DynamoDB: {email}")
-            user = users_table.get_item(
-                Key={'email': email}
-            ).get('Item')
+            app.logger.info(f"Fetching user: {email}")
+            user = get_cached_user(email)
             
             if user:
                 app.logger.info(f"User found in database: {email}")
@@ -322,6 +454,7 @@ def login():
             session.permanent = True
             session['user'] = email
             session['authenticated'] = True
+            session['password_verified'] = True
             
             # Force the session to be saved
             session.modified = True
@@ -354,7 +487,9 @@ def editor():
 
 @app.route('/view/<classroom_id>')
 def viewer(classroom_id):
-    return render_template('viewer.html', classroom_id=classroom_id)
+    # Read-only viewers get server-rendered HTML instead of the editor, unless they ask for it
+    rendered = app.config['RENDER_ENABLED'] and request.args.get('edit') != 'true' and request.args.get('editor') != 'true'
+    return render_template('viewer.html', classroom_id=classroom_id, rendered=rendered)
 
 @app.route('/api/login', methods=['POST'])
 def login_api():
@@ -365,9 +500,13 @@ def login_api():
         
         logger.debug(f"Login attempt for email: {email}")
         
-        # For development, accept any login
-        if email and password:
-            session['user'] = email  # Store user in session
+        user = get_cached_user(email) if email and password else None
+        if user and user.get('verified', False) and check_password_hash(user['password_hash'], password):
+            session.clear()
+            session.permanent = True
+            session['user'] = email
+            session['authenticated'] = True
+            session['password_verified'] = True
             logger.info(f"Successful login for {email}")
             return jsonify({
                 'status': 'success',
@@ -386,22 +525,339 @@ def login_api():
             'message': str(e)
         }), 500
 
-# Add cache with 2 second timeout
-@lru_cache(maxsize=128)
-def get_cached_notes(classroom_id, timestamp):
-    """Cache notes with 2-second granularity"""
+# Notes cache with 2 second timeout; missing classrooms are cached as None
+notes_cache = TTLCache(maxsize=app.config['NOTES_CACHE_SIZE'], ttl=app.config['NOTES_CACHE_TTL'])
+# Longer-lived copies, only served while DynamoDB is throttling reads
+stale_notes_cache = TTLCache(maxsize=app.config['NOTES_CACHE_SIZE'], ttl=app.config['NOTES_STALE_TTL'])
+
+def cache_notes(classroom_id, item):
+    notes_cache.set(classroom_id, item)
+    stale_notes_cache.set(classroom_id, item)
+
+def invalidate_notes(classroom_id):
+    notes_cache.delete(classroom_id)
+    stale_notes_cache.delete(classroom_id)
+
+# Verified user records for the login paths. Unknown and unverified emails are always read
+# from DynamoDB: signup and verification may happen on another worker, and invalidations only
+# reach this one through the bus, after a delay
+users_cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+def get_cached_user(email):
+    """Return the users item (None if there is no such user), cached once verified"""
+    with tracer.span('cache'):
+        user = users_cache.get(email)
+    if user is not MISSING:
+        return user
+    
+    user = dynamodb.Table('users').get_item(Key={'email': email}).get('Item')
+    if user and user.get('verified', False):
+        users_cache.set(email, user)
+    return user
+
+# Signup verification codes; the default keeps them off the users item, so resends cost no write
+otp_store = create_otp_store(app.config, users_table=dynamodb.Table('users'))
+
+# Tells the other app nodes which classrooms changed; handlers are registered below
+bus = create_bus(app.config, logger=app.logger)
+
+# Server-advised poll delays, from each classroom's recent activity and viewer count
+poll_advisor = PollAdvisor(
+    min_delay=app.config['POLL_MIN_DELAY'],
+    max_delay=app.config['POLL_MAX_DELAY'],
+    active_window=app.config['POLL_ACTIVE_WINDOW'],
+    classroom_budget=app.config['POLL_CLASSROOM_BUDGET']
+)
+
+def next_poll_ms(classroom_id, item):
+    viewers = presence_hub.count(classroom_id) if app.config['PRESENCE_ENABLED'] else 0
+    return poll_advisor.delay_ms(classroom_id, item.get('last_updated') if item else None, viewers)
+
+def default_class_name(classroom_id):
+    """Name shown for a classroom nobody named: 'Class 7' for class-7"""
+    parts = classroom_id.split('-')
+    return f'Class {parts[1]}' if len(parts) > 1 else f'Class {classroom_id}'
+
+def get_cached_notes(classroom_id):
+    """Return the cached notes item, reading through to DynamoDB on a miss"""
+    with tracer.span('cache'):
+        item = notes_cache.get(classroom_id)
+    if item is not MISSING:
+        return item
+
     table = dynamodb.Table('live_notes')
-    response = table.get_item(
-        Key={
-            'classroom_id': classroom_id
-        }
+    try:
+        response = table.get_item(
+            Key={
+                'classroom_id': classroom_id
+            }
+        )
+    except ClientError as e:
+        stale = stale_notes_cache.get(classroom_id)
+        if is_throttle_error(e) and stale is not MISSING:
+            app.logger.warning(f"Read throttled, serving stale notes for {classroom_id}")
+            return stale
+        raise
+    
+    item = response.get('Item')
+    cache_notes(classroom_id, item)
+    return item
+
+def get_cached_notes_many(classroom_ids):
+    """Return notes for several classrooms with one BatchGetItem for the cache misses.
+
+    Classrooms DynamoDB did not return, with no stale copy to serve instead, map to MISSING.
+    """
+    found = {}
+    missing = []
+    with tracer.span('cache'):
+        for classroom_id in classroom_ids:
+            item = notes_cache.get(classroom_id)
+            if item is MISSING:
+                missing.append(classroom_id)
+            else:
+                found[classroom_id] = item
+
+    if missing:
+        try:
+            fetched = batch_get_items(dynamodb, 'live_notes', 'classroom_id', missing)
+        except ClientError as e:
+            stale = {classroom_id: stale_notes_cache.get(classroom_id) for classroom_id in missing}
+            if not is_throttle_error(e) or MISSING in stale.values():
+                raise
+            app.logger.warning(f"Batch read throttled, serving stale notes for {len(missing)} classrooms")
+            fetched = stale
+        except UnprocessedKeys as e:
+            for classroom_id, item in e.results.items():
+                cache_notes(classroom_id, item)
+            app.logger.warning(f"{e}, serving stale notes where cached")
+            fetched = dict(e.results)
+            for classroom_id in e.pending:
+                fetched[classroom_id] = stale_notes_cache.get(classroom_id)
+        else:
+            for classroom_id, item in fetched.items():
+                cache_notes(classroom_id, item)
+        found.update(fetched)
+    return found
+
+# Attributes the search index needs from a notes item
+SEARCH_ATTRIBUTES = ['classroom_id', 'user_email', 'class_name', 'content', 'last_updated', 'timestamp']
+
+def scan_notes_for_search():
+    for items, _ in scan_pages(dynamodb.Table('live_notes'), projection=SEARCH_ATTRIBUTES):
+        yield items
+
+# Full-text index over notes, updated in the background as classrooms change
+search_indexer = None
+if app.config['SEARCH_ENABLED']:
+    search_indexer = SearchIndexer(
+        SearchIndex(app.config['SEARCH_INDEX_PATH']),
+        get_cached_notes,
+        scan_notes_for_search,
+        logger=app.logger
     )
+    search_indexer.start()
+
+# Revision history: snapshots every REVISION_SNAPSHOT_INTERVAL saves, deltas in between
+revision_log = RevisionLog(
+    dynamodb.Table('note_revisions'),
+    snapshot_interval=app.config['REVISION_SNAPSHOT_INTERVAL'],
+    retain=app.config['REVISION_RETAIN'],
+    max_snapshots=app.config['REVISION_MAX_SNAPSHOTS'],
+    logger=app.logger
+)
+
+# Attempts at the read-modify-write in save_notes before giving up on a conflict
+SAVE_ATTEMPTS = 3
+
+class NotesAccessDenied(Exception):
+    pass
+
+def write_notes(classroom_id, content, user_email, class_name=None, require_owner=True):
+    """Store notes content, bumping the item's revision and recording it in the history.
+
+    ``content`` may be a callable taking the stored content, re-evaluated if
+    another save bumps the revision between our read and write. Without
+    ``require_owner`` (shared edit links) the original owner is preserved.
+    Returns the new revision and the content written.
+    """
+    table = dynamodb.Table('live_notes')
+    author = user_email
+    for attempt in range(SAVE_ATTEMPTS):
+        # Get existing item first
+        existing_item = table.get_item(
+            Key={
+                'classroom_id': classroom_id
+            }
+        ).get('Item', {})
+        
+        # Check if user owns the note
+        if require_owner and existing_item and existing_item.get('user_email') != user_email:
+            raise NotesAccessDenied(classroom_id)
+        
+        # Preserve original owner when editing through a shared link
+        owner = user_email
+        if not require_owner and 'user_email' in existing_item:
+            owner = existing_item['user_email']
+        
+        new_content = content(existing_item.get('content')) if callable(content) else content
+        previous_revision = existing_item.get('revision')
+        revision = int(previous_revision or 0) + 1
+        if previous_revision is None:
+            condition = Attr('revision').not_exists()
+        else:
+            condition = Attr('revision').eq(previous_revision)
+        
+        item = {
+            'classroom_id': classroom_id,
+            'user_email': owner,
+            'content': new_content,
+            # Keep existing class_name if not provided
+            'class_name': class_name or existing_item.get('class_name') or default_class_name(classroom_id),
+            'revision': revision,
+            'last_updated': datetime.now().isoformat()
+        }
+        try:
+            # The invalidation and indexing below cover this node; the feed only tells the others
+            with change_feed.applied_by_writer():
+                table.put_item(Item=item, ConditionExpression=condition)
+            break
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException' or attempt == SAVE_ATTEMPTS - 1:
+                raise
+    
+    # The change feed is dispatched in the background; the writer must read its own write
+    invalidate_notes(classroom_id)
+    if search_indexer:
+        # Saves the indexer reading the item back
+        search_indexer.update(item)
+    
+    # Record the revision; a failure here must not fail the save itself
+    try:
+        previous_content = existing_item.get('content') if previous_revision is not None else None
+        revision_log.append(classroom_id, revision, previous_content, new_content, author)
+    except Exception as e:
+        app.logger.error(f"Failed to record revision {revision} for {classroom_id}: {str(e)}")
+    
+    return revision, new_content
+
+def load_collab_text(classroom_id):
+    item = get_cached_notes(classroom_id)
+    return extract_text(item.get('content')) if item else None
+
+def persist_collab_text(classroom_id, text):
+    write_notes(classroom_id, lambda content: merge_text(content, text), 'collab', require_owner=False)
+
+# Live collaborative documents, flushed back to live_notes in the background
+collab_hub = CollabHub(
+    load_collab_text,
+    persist_collab_text,
+    history_limit=app.config['COLLAB_HISTORY_LIMIT'],
+    flush_interval=app.config['COLLAB_FLUSH_INTERVAL'],
+    idle_timeout=app.config['COLLAB_IDLE_TIMEOUT'],
+    logger=app.logger
+)
+if app.config['COLLAB_ENABLED']:
+    collab_hub.start()
+
+# Who is viewing each classroom; never stored, published to clients in periodic frames
+presence_hub = PresenceHub(
+    member_ttl=app.config['PRESENCE_MEMBER_TTL'],
+    frame_interval=app.config['PRESENCE_FRAME_INTERVAL'],
+    frame_history=app.config['PRESENCE_FRAME_HISTORY'],
+    max_members=app.config['PRESENCE_MAX_MEMBERS'],
+    logger=app.logger
+)
+if app.config['PRESENCE_ENABLED']:
+    presence_hub.start()
+
+def refresh_collab_document(classroom_id):
+    """Fold text saved elsewhere into this node's live document, if it has one"""
+    if collab_hub.get(classroom_id) is None:
+        return
+    item = get_cached_notes(classroom_id)
+    if item:
+        collab_hub.external_update(classroom_id, extract_text(item.get('content')))
+
+def apply_notes_change(classroom_id, removed):
+    """Bring this node's caches and live state in line with a stored change to a classroom"""
+    invalidate_notes(classroom_id)
+    if removed:
+        collab_hub.discard(classroom_id)
+        presence_hub.discard(classroom_id)
+    else:
+        poll_advisor.record_change(classroom_id)
+        refresh_collab_document(classroom_id)
+    if search_indexer:
+        if removed:
+            search_indexer.remove(classroom_id)
+        else:
+            search_indexer.refresh(classroom_id)
+
+def handle_change(record):
+    """Change feed handler: every write to live_notes, from any route, lands here"""
+    if record['table'] != 'live_notes':
+        return
     
-    if 'Item' in response:
-        return response['Item']
-    return None
+    classroom_id = record['keys']['classroom_id']
+    removed = record['event'] == 'REMOVE'
+    if record.get('applied'):
+        # write_notes has already invalidated, reindexed and updated any live document
+        poll_advisor.record_change(classroom_id)
+    else:
+        apply_notes_change(classroom_id, removed)
+    if not change_feed.shared:
+        # Only this node saw the write; tell the others
+        bus.publish('notes.changed', {'classroom_id': classroom_id, 'removed': removed})
+
+def handle_bus_message(message):
+    """Apply a change made on another node to this node's caches and live documents"""
+    classroom_id = message['data'].get('classroom_id')
+    if message['event'] == 'notes.changed' and classroom_id:
+        apply_notes_change(classroom_id, message['data'].get('removed', False))
+
+def handle_user_change(record):
+    """Change feed handler for users: signup, verification and any other write to a user"""
+    if record['table'] != 'users':
+        return
+    
+    email = record['keys']['email']
+    users_cache.delete(email)
+    if not change_feed.shared:
+        bus.publish('users.changed', {'email': email})
+
+def handle_user_bus_message(message):
+    email = message['data'].get('email')
+    if message['event'] == 'users.changed' and email:
+        users_cache.delete(email)
+
+def resync_notes(reason):
+    # Whatever the missed changes invalidated is unknown, so re-read everything
+    notes_cache.clear()
+    users_cache.clear()
+    for classroom_id in collab_hub.classroom_ids():
+        refresh_collab_document(classroom_id)
+
+change_feed.subscribe(handle_change)
+change_feed.subscribe(handle_user_change)
+change_feed.on_resync(resync_notes)
+change_feed.start()
+
+bus.subscribe(handle_bus_message)
+bus.subscribe(handle_user_bus_message)
+bus.on_resync(resync_notes)
+bus.start()
+
+def throttled_response():
+    """503 telling the client to back off while DynamoDB is over capacity"""
+    g.throttled = True
+    response = jsonify({'error': 'Service busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
 
 @app.route('/api/notes/<classroom_id>', methods=['GET'])
+@rate_limiter.limit('poll')
 def get_notes(classroom_id):
     try:
         # Check if this is a view-only request (from shared link)
@@ -409,18 +865,20 @@ def get_notes(classroom_id):
         allow_edit = request.args.get('edit') == 'true'
         
         # Get cached or fresh data
-        timestamp = int(time.time() / 2)
-        data = get_cached_notes(classroom_id, timestamp)
+        data = get_cached_notes(classroom_id)
         
         if data:
             if is_view_only:
                 # For view-only access, return content without checking authentication
                 return jsonify({
                     'content': data.get('content', ''),
-                    'class_name': data.get('class_name', f'Class {classroom_id.split("-")[1]}'),
+                    'class_name': data.get('class_name') or default_class_name(classroom_id),
                     'last_updated': data.get('last_updated'),
                     'view_only': not allow_edit,
-                    'allow_edit': allow_edit
+                    'allow_edit': allow_edit,
+                    'collab': app.config['COLLAB_ENABLED'],
+                    'presence': app.config['PRESENCE_ENABLED'],
+                    'next_poll_ms': next_poll_ms(classroom_id, data)
                 })
             else:
                 # For editor access, check authentication
@@ -433,23 +891,164 @@ def get_notes(classroom_id):
                 
                 return jsonify({
                     'content': data.get('content', ''),
-                    'class_name': data.get('class_name', f'Class {classroom_id.split("-")[1]}'),
+                    'class_name': data.get('class_name') or default_class_name(classroom_id),
                     'last_updated': data.get('last_updated'),
                     'view_only': False,
-                    'allow_edit': True
+                    'allow_edit': True,
+                    'collab': app.config['COLLAB_ENABLED'],
+                    'presence': app.config['PRESENCE_ENABLED'],
+                    'next_poll_ms': next_poll_ms(classroom_id, data)
                 })
                 
         return jsonify({
             'content': '',
-            'class_name': f'Class {classroom_id.split("-")[1]}',
+            'class_name': default_class_name(classroom_id),
             'view_only': not allow_edit,
-            'allow_edit': allow_edit
+            'allow_edit': allow_edit,
+            'next_poll_ms': next_poll_ms(classroom_id, None)
         })
     except Exception as e:
         print('Error fetching notes:', str(e))
+        if is_throttle_error(e):
+            return throttled_response()
+        return jsonify({'error': str(e)}), 500
+
+# Highlighted HTML per document version for read-only viewers, rendered once in the background
+render_cache = RenderCache(
+    workers=app.config['RENDER_WORKERS'],
+    cache_size=app.config['RENDER_CACHE_SIZE'],
+    max_bytes=app.config['RENDER_MAX_BYTES'],
+    logger=app.logger
+)
+theme_stylesheets = {}
+
+@app.route('/api/notes/<classroom_id>/rendered', methods=['GET'])
+@rate_limiter.limit('poll')
+def get_rendered_notes(classroom_id):
+    """Notes as highlighted HTML. Pass the last_updated value already shown as ``version``
+    to get {"unchanged": true} back; 202 means the render is still running."""
+    if not app.config['RENDER_ENABLED']:
+        return jsonify({'error': 'Rendering is not enabled'}), 404
+
+    is_view_only = request.args.get('view') == 'true'
+    if not is_view_only and 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        item = get_cached_notes(classroom_id) or {}
+        if item and not is_view_only and item.get('user_email') != session['user']:
+            return jsonify({'error': 'Unauthorized access'}), 403
+
+        version = item.get('last_updated')
+        if version is not None and request.args.get('version') == version:
+            return jsonify({'unchanged': True, 'last_updated': version, 'next_poll_ms': next_poll_ms(classroom_id, item)})
+
+        key, html = render_cache.get(item.get('content'), wait=app.config['RENDER_WAIT'])
+        if html is None:
+            response = jsonify({'pending': True})
+            response.status_code = 202
+            response.headers['Retry-After'] = '1'
+            return response
+
+        return jsonify({
+            'key': key,
+            'html': html,
+            'class_name': item.get('class_name') or default_class_name(classroom_id),
+            'last_updated': version,
+            'next_poll_ms': next_poll_ms(classroom_id, item)
+        })
+    except Exception as e:
+        app.logger.error(f"Error rendering notes for {classroom_id}: {str(e)}")
+        if is_throttle_error(e):
+            return throttled_response()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/render/theme.css', methods=['GET'])
+def rendered_theme():
+    theme = 'dark' if request.args.get('theme') == 'dark' else 'light'
+    if theme not in theme_stylesheets:
+        theme_stylesheets[theme] = theme_css(theme)
+    response = Response(theme_stylesheets[theme], mimetype='text/css')
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.route('/api/notes/batch', methods=['POST'])
+@rate_limiter.limit('poll')
+def get_notes_batch():
+    """Return notes for many classrooms at once, skipping those the client already has.
+
+    Expects {"classrooms": [{"classroom_id": ..., "version": ...}, ...]} where
+    version is the last_updated value the client last saw (or omitted).
+    """
+    is_view_only = request.args.get('view') == 'true'
+    allow_edit = request.args.get('edit') == 'true'
+
+    if not is_view_only and 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    data = request.get_json(silent=True) or {}
+    requested = data.get('classrooms')
+    if not isinstance(requested, list) or not requested:
+        return jsonify({'error': 'classrooms must be a non-empty list'}), 400
+    if len(requested) > app.config['NOTES_BATCH_MAX']:
+        return jsonify({'error': f"At most {app.config['NOTES_BATCH_MAX']} classrooms per request"}), 400
+
+    known_versions = {}
+    for entry in requested:
+        if isinstance(entry, str):
+            entry = {'classroom_id': entry}
+        classroom_id = entry.get('classroom_id') if isinstance(entry, dict) else None
+        if not classroom_id or not isinstance(classroom_id, str):
+            return jsonify({'error': 'Each classroom needs a classroom_id string'}), 400
+        known_versions[classroom_id] = entry.get('version')
+
+    try:
+        items = get_cached_notes_many(list(known_versions))
+    except Exception as e:
+        app.logger.error(f"Error batch fetching notes: {str(e)}")
+        if is_throttle_error(e):
+            return throttled_response()
+        return jsonify({'error': str(e)}), 500
+
+    changed = {}
+    unchanged = []
+    errors = {}
+    for classroom_id, known_version in known_versions.items():
+        item = items.get(classroom_id)
+        if item is MISSING:
+            # Unread and not cached: the client keeps what it has and asks again next poll
+            errors[classroom_id] = 'Temporarily unavailable'
+            items[classroom_id] = None
+            continue
+
+        if item and not is_view_only and item.get('user_email') != session['user']:
+            errors[classroom_id] = 'Unauthorized access'
+            continue
+
+        version = item.get('last_updated') if item else None
+        if known_version is not None and known_version == version:
+            unchanged.append(classroom_id)
+            continue
+
+        item = item or {}
+        changed[classroom_id] = {
+            'content': item.get('content', ''),
+            'class_name': item.get('class_name') or default_class_name(classroom_id),
+            'last_updated': version,
+            'view_only': is_view_only and not allow_edit,
+            'allow_edit': allow_edit or not is_view_only
+        }
+
+    return jsonify({
+        'changed': changed,
+        'unchanged': unchanged,
+        'errors': errors,
+        # One poll covers every classroom, so follow the most active of them
+        'next_poll_ms': min(next_poll_ms(classroom_id, items.get(classroom_id)) for classroom_id in known_versions)
+    })
+
 @app.route('/api/notes/<classroom_id>', methods=['POST'])
+@rate_limiter.limit('save')
 def save_notes(classroom_id):
     # Check if it's an edit from view mode
     is_view_edit = request.args.get('view') == 'true' and request.args.get('edit') == 'true'
@@ -459,51 +1058,250 @@ def save_notes(classroom_id):
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
-        data = request.get_json()
-        content = data.get('content', '')
+        # Parsed straight from the stream: no cached copy of the body, and no decoded copy of all of it
+        try:
+            data = read_json_object(request.stream, app.config['MAX_CONTENT_LENGTH'])
+        except PayloadTooLarge:
+            return payload_too_large()
+        except ValueError:
+            return jsonify({'error': 'Invalid JSON body'}), 400
         class_name = data.get('class_name')
+        if 'content' not in data and any(key in data for key in SETTINGS_KEYS):
+            # Settings only, e.g. a language change during a collaborative session: merged onto
+            # the stored text, so edits the session has not flushed yet are not overwritten
+            content = lambda stored: merge_settings(stored, data)
+        elif collab_live(classroom_id):
+            return collab_conflict()
+        else:
+            content = data.get('content', '')
         
         # Get user email (if authenticated) or use 'shared_editor' for view edit mode
         user_email = session.get('user') if 'user' in session else 'shared_editor'
         
-        # Get existing item first
-        table = dynamodb.Table('live_notes')
-        existing_item = table.get_item(
-            Key={
-                'classroom_id': classroom_id
-            }
-        ).get('Item', {})
-        
-        # For regular (non-view) mode, check if user owns the note
-        if not is_view_edit and existing_item and existing_item.get('user_email') != user_email:
+        try:
+            revision, _ = write_notes(classroom_id, content, user_email, class_name, require_owner=not is_view_edit)
+        except NotesAccessDenied:
             return jsonify({'error': 'Unauthorized access'}), 403
         
-        # Keep existing class_name if not provided in request
-        if not class_name:
-            class_name = existing_item.get('class_name', f'Class {classroom_id.split("-")[1]}')
-        
-        # Clear the cache for this classroom
-        get_cached_notes.cache_clear()
-        
-        # Preserve original owner when editing in view mode
-        if is_view_edit and existing_item and 'user_email' in existing_item:
-            user_email = existing_item['user_email']
-        
-        # Update the item
-        response = table.put_item(
-            Item={
-                'classroom_id': classroom_id,
-                'user_email': user_email,
-                'content': content,
-                'class_name': class_name,
-                'last_updated': datetime.now().isoformat()
-            }
-        )
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'revision': revision})
     except Exception as e:
         print('Error saving notes:', str(e))
+        if is_throttle_error(e):
+            return throttled_response()
+        return jsonify({'error': str(e)}), 500
+
+def collab_live(classroom_id):
+    return collab_hub.get(classroom_id) is not None
+
+def collab_conflict():
+    """409 for a whole-text save while editors share the classroom's live document"""
+    return jsonify({'error': 'This class is being edited collaboratively', 'collab': True}), 409
+
+def get_owned_notes(classroom_id):
+    """Return (item, error_response) for a classroom the session user must own"""
+    if 'user' not in session:
+        return None, (jsonify({'error': 'Not authenticated'}), 401)
+    item = get_cached_notes(classroom_id)
+    if not item:
+        return None, (jsonify({'error': 'Class not found'}), 404)
+    if item.get('user_email') != session['user']:
+        return None, (jsonify({'error': 'Unauthorized access'}), 403)
+    return item, None
+
+def revision_metadata(item):
+    return {
+        'revision': int(item['revision']),
+        'kind': item.get('kind'),
+        'user_email': item.get('user_email'),
+        'created_at': item.get('created_at'),
+        'content_length': int(item.get('content_length', 0))
+    }
+
+@app.route('/api/notes/<classroom_id>/revisions', methods=['GET'])
+def list_revisions(classroom_id):
+    _, error = get_owned_notes(classroom_id)
+    if error:
+        return error
+
+    try:
+        limit = min(int(request.args.get('limit', 50)), 200)
+        before = request.args.get('before', type=int)
+        items = revision_log.history(classroom_id, limit=limit, before=before)
+        return jsonify({'revisions': [revision_metadata(item) for item in items]})
+    except Exception as e:
+        app.logger.error(f"Error listing revisions: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notes/<classroom_id>/revisions/<int:revision>', methods=['GET'])
+def get_revision(classroom_id, revision):
+    _, error = get_owned_notes(classroom_id)
+    if error:
+        return error
+
+    try:
+        item, content = revision_log.get(classroom_id, revision)
+        return jsonify({**revision_metadata(item), 'content': content})
+    except RevisionNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        app.logger.error(f"Error fetching revision: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/notes/<classroom_id>/revisions/replay', methods=['GET'])
+def replay_revisions(classroom_id):
+    """Every revision from ?from= to ?to=, reconstructed in one pass"""
+    _, error = get_owned_notes(classroom_id)
+    if error:
+        return error
+
+    start = request.args.get('from', type=int)
+    end = request.args.get('to', type=int)
+    if not start or not end or start > end:
+        return jsonify({'error': 'from and to revisions are required'}), 400
+    if end - start + 1 > app.config['REVISION_REPLAY_MAX']:
+        return jsonify({'error': f"At most {app.config['REVISION_REPLAY_MAX']} revisions per replay"}), 400
+
+    try:
+        revisions = [
+            {**revision_metadata(item), 'content': content}
+            for item, content in revision_log.replay(classroom_id, start, end)
+        ]
+        return jsonify({'revisions': revisions})
+    except RevisionNotFound as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        app.logger.error(f"Error replaying revisions: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def collab_document(classroom_id, write=False):
+    """Return (document, error_response) for the owner or a shared link with the needed rights"""
+    if not app.config['COLLAB_ENABLED']:
+        return None, (jsonify({'error': 'Collaborative editing is disabled'}), 404)
+    
+    is_shared = request.args.get('view') == 'true'
+    if is_shared:
+        if write and request.args.get('edit') != 'true':
+            return None, (jsonify({'error': 'Unauthorized access'}), 403)
+        item = get_cached_notes(classroom_id)
+    else:
+        item, error = get_owned_notes(classroom_id)
+        if error:
+            return None, error
+    
+    if not item:
+        return None, (jsonify({'error': 'Class not found'}), 404)
+    return collab_hub.document(classroom_id), None
+
+@app.route('/api/collab/<classroom_id>/join', methods=['POST'])
+@rate_limiter.limit('poll')
+def collab_join(classroom_id):
+    document, error = collab_document(classroom_id)
+    if error:
+        return error
+    
+    revision, text = document.snapshot()
+    return jsonify({
+        'revision': revision,
+        'epoch': document.epoch,
+        'text': text,
+        'client_id': secrets.token_urlsafe(8)
+    })
+
+@app.route('/api/collab/<classroom_id>/ops', methods=['POST'])
+@rate_limiter.limit('collab')
+def collab_submit(classroom_id):
+    """Merge one client operation; reply with its revision and the operations it was transformed past"""
+    document, error = collab_document(classroom_id, write=True)
+    if error:
+        return error
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        revision, missed = document.receive(
+            data.get('client_id'), int(data.get('revision', -1)), data.get('ops'), data.get('epoch')
+        )
+    except StaleRevision as e:
+        return jsonify({'error': str(e), 'resync': True}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid operation: {str(e)}'}), 400
+    
+    return jsonify({'revision': revision, 'operations': missed})
+
+@app.route('/api/collab/<classroom_id>/ops', methods=['GET'])
+@rate_limiter.limit('poll')
+def collab_poll(classroom_id):
+    """Operations applied after ?since=, or the whole text if the client fell too far behind"""
+    document, error = collab_document(classroom_id)
+    if error:
+        return error
+    
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify({'error': 'since is required'}), 400
+    try:
+        revision, operations = document.operations_since(since, request.args.get('epoch') or None)
+        return jsonify({'revision': revision, 'operations': operations})
+    except StaleRevision:
+        # Typically a client reconnecting after a reload: it rebases its unsent edits on this text
+        revision, text = document.snapshot()
+        return jsonify({'revision': revision, 'epoch': document.epoch, 'resync': True, 'text': text})
+
+@app.route('/api/presence/<classroom_id>/join', methods=['POST'])
+@rate_limiter.limit('poll')
+def presence_join(classroom_id):
+    """Announce a viewer or the owner; access is checked here, heartbeats only need the client_id"""
+    if not app.config['PRESENCE_ENABLED']:
+        return jsonify({'error': 'Presence is disabled'}), 404
+    
+    try:
+        if request.args.get('view') == 'true':
+            item = get_cached_notes(classroom_id)
+            role = 'editor' if request.args.get('edit') == 'true' else 'viewer'
+        else:
+            item, error = get_owned_notes(classroom_id)
+            if error:
+                return error
+            role = 'owner'
+        if not item:
+            return jsonify({'error': 'Class not found'}), 404
+        
+        data = request.get_json(silent=True) or {}
+        client_id = secrets.token_urlsafe(8)
+        name = session.get('user') or f'Viewer {client_id[:4]}'
+        state = presence_hub.join(classroom_id, client_id, name, role, data.get('cursor'))
+        return jsonify(dict(state, client_id=client_id))
+    except OverflowError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        app.logger.error(f"Error joining presence: {str(e)}")
+        if is_throttle_error(e):
+            return throttled_response()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/presence/<classroom_id>/heartbeat', methods=['POST'])
+@rate_limiter.limit('poll')
+def presence_heartbeat(classroom_id):
+    """Keep a member alive, update its cursor and return the presence frames after ``seq``"""
+    if not app.config['PRESENCE_ENABLED']:
+        return jsonify({'error': 'Presence is disabled'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(presence_hub.heartbeat(
+            classroom_id, data.get('client_id'), int(data.get('seq', 0)), data.get('cursor')
+        ))
+    except UnknownMember:
+        return jsonify({'error': 'Not joined', 'rejoin': True}), 410
+    except (TypeError, ValueError):
+        return jsonify({'error': 'seq must be an integer'}), 400
+
+@app.route('/api/presence/<classroom_id>/leave', methods=['POST'])
+def presence_leave(classroom_id):
+    # Sent with navigator.sendBeacon, which cannot set a JSON content type
+    data = request.get_json(force=True, silent=True) or {}
+    presence_hub.leave(classroom_id, data.get('client_id'))
+    return '', 204
+
 @app.route('/api/classes', methods=['GET'])
 def get_classes():
     if 'user' not in session:
@@ -551,22 +1349,56 @@ def debug():
     }
     return jsonify(debug_info)
 
+def admin_allowed():
+    """Admin endpoints are for ADMIN_EMAILS signed in with their password, in every environment.
+
+    The development login accepts any password, so its sessions never count;
+    with ADMIN_EMAILS unset nobody is an admin.
+    """
+    return bool(session.get('authenticated') and session.get('password_verified')
+                and session.get('user') in app.config['ADMIN_EMAILS'])
+
+# Metadata only; document bodies are never listed
+NOTES_LISTING_ATTRIBUTES = ['classroom_id', 'class_name', 'user_email', 'last_updated', 'revision']
+
+def notes_listing_row(item):
+    row = {name: item.get(name) for name in NOTES_LISTING_ATTRIBUTES}
+    if row['revision'] is not None:
+        row['revision'] = int(row['revision'])
+    return row
+
 @app.route('/api/debug/dynamodb', methods=['GET'])
 def debug_dynamodb():
+    """Page through live_notes metadata.
+
+    Returns one page of at most ADMIN_PAGE_SIZE items and a ``cursor`` for the
+    next one; ``?format=ndjson`` streams every item instead, one page at a time.
+    """
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    table = dynamodb.Table('live_notes')
+    page_size = min(request.args.get('limit', app.config['ADMIN_PAGE_SIZE'], type=int), app.config['ADMIN_PAGE_SIZE'])
+    cursor = request.args.get('cursor')
+    start_key = {'classroom_id': cursor} if cursor else None
+    
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            for items, _ in scan_pages(table, page_size, NOTES_LISTING_ATTRIBUTES, start_key):
+                for item in items:
+                    yield json.dumps(notes_listing_row(item)) + '\n'
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    
     try:
-        table = dynamodb.Table('live_notes')
-        response = table.scan()
-        items = response.get('Items', [])
-        
-        debug_info = {
+        items, last_key = next(scan_pages(table, page_size, NOTES_LISTING_ATTRIBUTES, start_key))
+        return jsonify({
             'table_name': 'live_notes',
-            'item_count': len(items),
-            'items': items,
+            'count': len(items),
+            'items': [notes_listing_row(item) for item in items],
+            'cursor': last_key['classroom_id'] if last_key else None,
             'aws_region': REGION,
             'environment': os.getenv('FLASK_ENV', 'development')
-        }
-        
-        return jsonify(debug_info)
+        })
     except Exception as e:
         return jsonify({
             'error': str(e),
@@ -575,6 +1407,157 @@ def debug_dynamodb():
         }), 500
 
 
+def backup_tables():
+    tables = [name.strip() for name in request.args.get('tables', '').split(',') if name.strip()]
+    return tables or DEFAULT_TABLES
+
+@app.route('/api/admin/export', methods=['GET'])
+def admin_export():
+    """Stream the tables as NDJSON (``?gzip=true`` to compress), scanning ``segments`` in parallel"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    tables = backup_tables()
+    unknown = set(tables) - set(DEFAULT_TABLES)
+    if unknown:
+        return jsonify({'error': f"Unknown tables: {', '.join(sorted(unknown))}"}), 400
+    segments = max(1, min(request.args.get('segments', 4, type=int), 16))
+    stats = TransferStats()
+    
+    def generate():
+        yield from export_lines(backup_client, tables, segments, stats=stats)
+        app.logger.info(f"Export finished: {stats.summary()}")
+    
+    filename = f"livecode-{datetime.now().strftime('%Y%m%d-%H%M%S')}.ndjson"
+    if request.args.get('gzip') == 'true':
+        body, mimetype, filename = gzip_chunks(generate()), 'application/gzip', filename + '.gz'
+    else:
+        body, mimetype = generate(), 'application/x-ndjson'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/api/admin/import', methods=['POST'])
+def admin_import():
+    """Restore an export from the request body, read and written incrementally"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    if request.headers.get('Content-Encoding') == 'gzip' or request.args.get('gzip') == 'true':
+        lines = gunzip_lines(iter(lambda: request.stream.read(64 * 1024), b''))
+    else:
+        lines = (line.decode('utf-8') for line in request.stream)
+    
+    try:
+        stats = import_lines(backup_client, lines, tables=backup_tables())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Import failed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    app.logger.info(f"Import finished: {stats.summary()}")
+    return jsonify(stats.summary())
+
+@app.route('/api/search', methods=['GET'])
+def search_notes():
+    """Search the session user's classrooms; returns matches with the lines they matched on"""
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not search_indexer:
+        return jsonify({'error': 'Search is not enabled'}), 404
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'q is required'}), 400
+    try:
+        limit = min(int(request.args.get('limit', app.config['SEARCH_RESULTS_MAX'])), app.config['SEARCH_RESULTS_MAX'])
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    try:
+        started = time.monotonic()
+        results = search_indexer.index.search(session['user'], query, limit=max(1, limit))
+        return jsonify({
+            'query': query,
+            'results': results,
+            'took_ms': round((time.monotonic() - started) * 1000, 2)
+        })
+    except Exception as e:
+        app.logger.error(f"Error searching notes: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/search', methods=['GET', 'POST'])
+def admin_search_index():
+    """Index statistics; POST rebuilds the index from the live_notes table in the background"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    if not search_indexer:
+        return jsonify({'error': 'Search is not enabled'}), 404
+
+    if request.method == 'POST':
+        search_indexer.request_rebuild()
+        return jsonify(dict(search_indexer.stats(), status='rebuilding')), 202
+    return jsonify(search_indexer.stats())
+
+@app.route('/api/admin/sessions/revoke', methods=['POST'])
+def admin_revoke_sessions():
+    """End every session of the user in the body's ``email``, e.g. after an account is compromised"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    email = (request.get_json(silent=True) or {}).get('email')
+    if not isinstance(email, str) or not email:
+        return jsonify({'error': 'email is required'}), 400
+    revoked = app.session_interface.revoke_user(email)
+    if revoked is None:
+        return jsonify({'error': 'Signed-cookie sessions cannot be revoked; run with SESSION_BACKEND=server'}), 409
+    app.logger.info(f"Revoked {revoked} sessions of {email}")
+    return jsonify({'email': email, 'revoked': revoked})
+
+@app.route('/api/admin/traces', methods=['GET'])
+def admin_traces():
+    """Tracing settings and this worker's recent slow requests with their span breakdowns"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+    return jsonify(tracer.stats())
+
+@app.route('/api/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """POST samples this worker's threads for ``seconds`` in the background; GET lists the results"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+
+    if request.method == 'GET':
+        return jsonify({'running': profiler.running, 'profiles': profiler.profiles()})
+
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({'error': 'seconds and interval must be numbers'}), 400
+    if not 0 < seconds <= app.config['PROFILE_MAX_SECONDS'] or not 0.001 <= interval <= 1:
+        return jsonify({'error': f"seconds must be in (0, {app.config['PROFILE_MAX_SECONDS']}] and interval in [0.001, 1]"}), 400
+
+    name = profiler.start(seconds, interval, include_idle=request.args.get('idle') == 'true')
+    if name is None:
+        return jsonify({'error': 'A profile is already running on this worker', 'running': profiler.running}), 409
+    app.logger.info(f"Profiling worker {os.getpid()} for {seconds}s into {name}")
+    return jsonify({'profile': name, 'pid': os.getpid(), 'seconds': seconds}), 202
+
+@app.route('/api/admin/profile/<name>', methods=['GET'])
+def admin_profile_result(name):
+    """A finished profile as JSON, or ``?format=collapsed`` for flamegraph tools"""
+    if not admin_allowed():
+        return jsonify({'error': 'Admin access required'}), 403
+
+    result = profiler.load(name)
+    if result is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if request.args.get('format') == 'collapsed':
+        return Response(result['collapsed'] + '\n', mimetype='text/plain')
+    return jsonify(result)
+
 @app.route('/api/classes/<classroom_id>', methods=['PUT'])
 def update_class(classroom_id):
     if 'user' not in session:
@@ -603,6 +1586,7 @@ def update_class(classroom_id):
         item['class_name'] = class_name
         
         table.put_item(Item=item)
+        invalidate_notes(classroom_id)
         
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -625,35 +1609,47 @@ def delete_class(classroom_id):
                 return jsonify({'error': 'Unauthorized access'}), 403
         
         table.delete_item(Key={'classroom_id': classroom_id})
+        invalidate_notes(classroom_id)
+        revision_log.delete_all(classroom_id)
         return jsonify({'status': 'success'})
     except Exception as e:
         print('Error deleting class:', str(e))
         return jsonify({'error': str(e)}), 500
     
 @app.route('/api/update_notes', methods=['POST'])
+@rate_limiter.limit('save')
 def update_notes():
+    if 'user' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
     try:
         data = request.json
-        content = data.get('content', '')
+        text = data.get('content', '')
         language = data.get('language', 'plaintext')
         classroom_id = data.get('classroom_id')
 
         if not classroom_id:
             return jsonify({'error': 'Missing classroom_id'}), 400
+        if collab_live(classroom_id):
+            return collab_conflict()
 
-        table = dynamodb.Table('live_notes')
-        table.put_item(
-            Item={
-                'classroom_id': classroom_id,
-                'content': content,
-                'language': language,  # Store the language
-                'timestamp': int(time.time())
-            }
-        )
+        def legacy_content(stored):
+            # Plain text and a language, stored in the editor's content format
+            content = json.loads(merge_text(stored, text))
+            content['language'] = language
+            return json.dumps(content)
+
+        # Through write_notes, so the save gets a revision and a history entry like any other
+        try:
+            revision, _ = write_notes(classroom_id, legacy_content, session['user'])
+        except NotesAccessDenied:
+            return jsonify({'error': 'Unauthorized access'}), 403
         
-        return jsonify({'status': 'success'})
+        return jsonify({'status': 'success', 'revision': revision})
     except Exception as e:
         logger.error(f"Error updating notes: {str(e)}")
+        if is_throttle_error(e):
+            return throttled_response()
         return jsonify({'error': str(e)}), 500
 
 def send_verification_email(email, otp):
@@ -711,30 +1707,32 @@ def signup():
             return jsonify({'success': False, 'error': 'All fields are required'}), 400
 
         # Check if user already exists
-        users_table = dynamodb.Table('users')
-        existing_user = users_table.get_item(
-            Key={'email': email}
-        ).get('Item')
+        existing_user = get_cached_user(email)
 
         if existing_user:
             return jsonify({'success': False, 'error': 'Email already registered'}), 400
 
-        # Generate OTP and expiration time
+        # Store user data with verification status; the condition catches a signup the cache has not seen yet
+        users_table = dynamodb.Table('users')
+        try:
+            users_table.put_item(
+                Item={
+                    'email': email,
+                    'name': name,
+                    'password_hash': generate_password_hash(password),
+                    'verified': False,
+                    'created_at': datetime.now().isoformat()
+                },
+                ConditionExpression=Attr('email').not_exists()
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return jsonify({'success': False, 'error': 'Email already registered'}), 400
+            raise
+
+        # Generate OTP, valid for OTP_TTL seconds
         otp = generate_otp()
-        otp_expiry = (datetime.now() + timedelta(minutes=10)).isoformat()
-
-        # Store user data with verification status
-        users_table.put_item(
-            Item={
-                'email': email,
-                'name': name,
-                'password_hash': generate_password_hash(password),
-                'verified': False,
-                'otp': otp,
-                'otp_expiry': otp_expiry,
-                'created_at': datetime.now().isoformat()
-            }
-        )
+        otp_store.set(email, otp, app.config['OTP_TTL'])
 
         # Send verification email
         if send_verification_email(email, otp):
@@ -757,29 +1755,32 @@ def verify():
             return jsonify({'success': False, 'error': 'Email and OTP are required'}), 400
 
         # Get user data
-        users_table = dynamodb.Table('users')
-        user = users_table.get_item(
-            Key={'email': email}
-        ).get('Item')
+        user = get_cached_user(email)
 
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
 
+        # Codes issued before they moved to the OTP store are still on the users item
+        expected = otp_store.get(email)
+        if expected is None and user.get('otp') and datetime.now() <= datetime.fromisoformat(user['otp_expiry']):
+            expected = user['otp']
+        
         # Check if OTP is expired
-        otp_expiry = datetime.fromisoformat(user['otp_expiry'])
-        if datetime.now() > otp_expiry:
+        if expected is None:
             return jsonify({'success': False, 'error': 'OTP has expired'}), 400
 
         # Verify OTP
-        if user['otp'] != otp:
+        if not hmac.compare_digest(str(expected), str(otp)):
             return jsonify({'success': False, 'error': 'Invalid OTP'}), 400
 
         # Update user verification status
+        users_table = dynamodb.Table('users')
         users_table.update_item(
             Key={'email': email},
-            UpdateExpression='SET verified = :val',
+            UpdateExpression='SET verified = :val REMOVE otp, otp_expiry',
             ExpressionAttributeValues={':val': True}
         )
+        otp_store.delete(email)
 
         return jsonify({'success': True})
 
@@ -797,27 +1798,14 @@ def resend_otp():
             return jsonify({'success': False, 'error': 'Email is required'}), 400
 
         # Get user data
-        users_table = dynamodb.Table('users')
-        user = users_table.get_item(
-            Key={'email': email}
-        ).get('Item')
+        user = get_cached_user(email)
 
         if not user:
             return jsonify({'success': False, 'error': 'User not found'}), 404
 
-        # Generate new OTP and expiration time
+        # Generate new OTP, replacing any earlier one
         new_otp = generate_otp()
-        new_otp_expiry = (datetime.now() + timedelta(minutes=10)).isoformat()
-
-        # Update user with new OTP
-        users_table.update_item(
-            Key={'email': email},
-            UpdateExpression='SET otp = :otp, otp_expiry = :expiry',
-            ExpressionAttributeValues={
-                ':otp': new_otp,
-                ':expiry': new_otp_expiry
-            }
-        )
+        otp_store.set(email, new_otp, app.config['OTP_TTL'])
 
         # Send new verification email
         if send_verification_email(email, new_otp):
@@ -830,6 +1818,17 @@ def resend_otp():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/logout', methods=['POST'])
+def logout():
+    user_email = session.get('user')
+    # Clearing the session also drops it from the server-side store, if enabled
+    session.clear()
+    if user_email and request.args.get('everywhere') == 'true':
+        # The user's sessions on other devices too, where the backend can recall them
+        app.session_interface.revoke_user(user_email)
+    app.logger.info(f"User {user_email} logged out")
+    return jsonify({'success': True, 'redirect': '/login'})
+
 @app.route('/api/check-session')
 def check_session():
     app.logger.info(f"Check session called. Session: {session}")
@@ -849,31 +1848,70 @@ def check_session():
 def handle_error(error):
     print("Error occurred:", str(error))
     print("Traceback:", traceback.format_exc())
+    if is_throttle_error(error):
+        return throttled_response()
     return jsonify({
         'error': str(error),
         'traceback': traceback.format_exc()
     }), 500
 
+def check_dynamodb():
+    # DescribeTable is a control-plane call: no read capacity, no table scan
+    status = dynamodb.meta.client.describe_table(TableName='live_notes')['Table']['TableStatus']
+    if status != 'ACTIVE':
+        raise RuntimeError(f'live_notes is {status}')
+
+health_monitor = HealthMonitor(interval=app.config['HEALTH_CHECK_INTERVAL'], logger=app.logger)
+health_monitor.register('dynamodb', check_dynamodb)
+health_monitor.register('pubsub', lambda: bus.connected, critical=False)
+health_monitor.start()
+
+# Shutdown order: leave the rotation and stop live state first, then flush buffered
+# writes while the change feed and bus can still carry them to other nodes
+lifecycle.register('health checks', health_monitor.stop)
+if app.config['PRESENCE_ENABLED']:
+    lifecycle.register('presence', presence_hub.stop)
+if app.config['COLLAB_ENABLED']:
+    lifecycle.register('collab documents', collab_hub.stop)
+lifecycle.register('change feed', change_feed.stop)
+lifecycle.register('pubsub', bus.stop)
+if search_indexer:
+    lifecycle.register('search index', search_indexer.stop)
+lifecycle.register('render pool', render_cache.stop)
+lifecycle.register('revision compaction', revision_log.stop)
+# gunicorn's worker_exit hook calls this too (see gunicorn.conf.py); it only runs once
+atexit.register(lifecycle.shutdown, 'process exit')
+
+@app.route('/health/live')
+def health_live():
+    """Liveness: the worker answers requests; dependencies are not consulted"""
+    return jsonify(health_monitor.liveness())
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness from the cached background checks, 503 until every critical one passes or while draining"""
+    if lifecycle.draining:
+        return jsonify({'status': lifecycle.state}), 503
+    ready, report = health_monitor.readiness()
+    return jsonify(report), 200 if ready else 503
+
 @app.route('/health')
 def health_check():
-    try:
-        # Test DynamoDB connection
-        table = dynamodb.Table('live_notes')
-        table.scan(Limit=1)
-        
-        return jsonify({
-            'status': 'healthy',
-            'environment': os.getenv('FLASK_ENV', 'development'),
-            'aws_region': REGION,
-            'has_aws_credentials': bool(AWS_ACCESS_KEY and AWS_SECRET_KEY)
-        })
-    except Exception as e:
-        print("Health check failed:", str(e))
-        return jsonify({
-            'status': 'unhealthy',
-            'error': str(e),
-            'environment': os.getenv('FLASK_ENV', 'development')
-        }), 500
+    """Readiness with deployment details: 503, not 500, while checks are pending or failing"""
+    ready, report = health_monitor.readiness()
+    if ready:
+        status = 'healthy'
+    elif any(check['status'] == 'pending' for check in report['checks'].values() if check.get('critical')):
+        status = 'starting'
+    else:
+        status = 'unhealthy'
+    return jsonify({
+        'status': status,
+        'checks': report['checks'],
+        'environment': os.getenv('FLASK_ENV', 'development'),
+        'aws_region': REGION,
+        'has_aws_credentials': bool(AWS_ACCESS_KEY and AWS_SECRET_KEY)
+    }), 200 if ready else 503
 
 # Add favicon route with correct path
 @app.route('/favicon.ico')
@@ -906,7 +1944,8 @@ def debug_session():
             'session_cookie_samesite': app.config.get('SESSION_COOKIE_SAMESITE'),
             'permanent_session_lifetime': str(app.config.get('PERMANENT_SESSION_LIFETIME')),
             'secret_key_configured': bool(app.config.get('SECRET_KEY')),
-            'flask_env': os.environ.get('FLASK_ENV')
+            'flask_env': os.environ.get('FLASK_ENV'),
+            'session_interface': app.session_interface.stats()
         }
         return jsonify(session_info)
     else:
@@ -931,6 +1970,44 @@ def get_secure_session_cookie(app, session_dict):
     serializer = session_interface.get_signing_serializer(app)
     return serializer.dumps(session_dict)
 
+@app.route('/debug/rate-limits', methods=['GET'])
+def debug_rate_limits():
+    """Debug endpoint reporting admitted and shed requests"""
+    if os.environ.get('FLASK_ENV') != 'production':
+        return jsonify({
+            'enabled': rate_limiter.enabled,
+            'backend': app.config.get('RATE_LIMIT_BACKEND'),
+            'rules': app.config.get('RATE_LIMIT_RULES'),
+            'counters': rate_limiter.stats()
+        })
+    else:
+        return jsonify({'error': 'Debug endpoints disabled in production'}), 403
+
+@app.route('/debug/pubsub', methods=['GET'])
+def debug_pubsub():
+    """Debug endpoint showing this node's pub/sub sequence numbers, peers and gaps, and its change feed"""
+    if os.environ.get('FLASK_ENV') != 'production':
+        return jsonify(dict(bus.stats(), change_feed=change_feed.stats()))
+    else:
+        return jsonify({'error': 'Debug endpoints disabled in production'}), 403
+
+@app.route('/debug/dynamodb-capacity', methods=['GET'])
+def debug_dynamodb_capacity():
+    """Debug endpoint reporting consumed capacity and throttling per operation"""
+    if os.environ.get('FLASK_ENV') != 'production':
+        return jsonify({
+            'billing_mode': app.config.get('DYNAMODB_BILLING_MODE'),
+            'retry_mode': app.config.get('DYNAMODB_RETRY_MODE'),
+            'operations': capacity_telemetry.stats(),
+            'collab': collab_hub.stats(),
+            'presence': presence_hub.stats(),
+            'notes_cache': notes_cache.stats(),
+            'stale_notes_cache': stale_notes_cache.stats(),
+            'users_cache': users_cache.stats()
+        })
+    else:
+        return jsonify({'error': 'Debug endpoints disabled in production'}), 403
+
 @app.route('/debug/login', methods=['GET'])
 def debug_login():
     """Debug endpoint to check login-related settings"""
@@ -988,10 +2065,7 @@ def debug_login_status():
         user_data = None
         if is_authenticated:
             try:
-                users_table = dynamodb.Table('users')
-                user = users_table.get_item(
-                    Key={'email': session['user']}
-                ).get('Item')
+                user = get_cached_user(session['user'])
                 
                 if user:
                     # Remove sensitive data
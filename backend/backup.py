@@ -0,0 +1,295 @@
+"""Streaming NDJSON export and import of the DynamoDB tables.
+
+Each line is {"table": <name>, "item": <item in DynamoDB JSON>}, the same
+typed format the low-level API uses, so numbers and binary values survive
+a round trip unchanged (binary is base64 encoded). Memory use is bounded
+by a few Scan pages and one write batch, whatever the table size.
+
+Run from the backend directory:
+
+    python backup.py export --out backup.ndjson.gz
+    python backup.py import --in backup.ndjson.gz
+"""
+import argparse
+import base64
+import gzip
+import json
+import queue
+import sys
+import threading
+import time
+import zlib
+
+from storage import backoff_delay
+
+DEFAULT_TABLES = ['live_notes', 'users']
+
+# DynamoDB rejects BatchWriteItem requests with more than 25 items
+BATCH_WRITE_LIMIT = 25
+
+_DONE = object()
+
+
+def _encode_binary(value):
+    """Make a low-level attribute value JSON-safe by base64-encoding binary members"""
+    (kind, inner), = value.items()
+    if kind == 'B':
+        return {'B': base64.b64encode(inner).decode('ascii')}
+    if kind == 'BS':
+        return {'BS': [base64.b64encode(member).decode('ascii') for member in inner]}
+    if kind == 'M':
+        return {'M': {key: _encode_binary(member) for key, member in inner.items()}}
+    if kind == 'L':
+        return {'L': [_encode_binary(member) for member in inner]}
+    return value
+
+
+def _decode_binary(value):
+    (kind, inner), = value.items()
+    if kind == 'B':
+        return {'B': base64.b64decode(inner)}
+    if kind == 'BS':
+        return {'BS': [base64.b64decode(member) for member in inner]}
+    if kind == 'M':
+        return {'M': {key: _decode_binary(member) for key, member in inner.items()}}
+    if kind == 'L':
+        return {'L': [_decode_binary(member) for member in inner]}
+    return value
+
+
+class TransferStats:
+    """Item counts and throughput, reported every ``report_every`` seconds through ``report``"""
+
+    def __init__(self, report=None, report_every=5):
+        self.items = 0
+        self.per_table = {}
+        self.retries = 0
+        self.started = time.monotonic()
+        self.report = report
+        self.report_every = report_every
+        self._last_report = self.started
+
+    def add(self, table, count=1):
+        self.items += count
+        self.per_table[table] = self.per_table.get(table, 0) + count
+        now = time.monotonic()
+        if self.report and now - self._last_report >= self.report_every:
+            self._last_report = now
+            self.report(self.summary())
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'items': self.items,
+            'tables': dict(self.per_table),
+            'retries': self.retries,
+            'elapsed_seconds': round(elapsed, 2),
+            'items_per_second': round(self.items / elapsed, 1) if elapsed else 0.0
+        }
+
+
+def scan_table(client, table_name, segments=4, page_size=500, stop=None):
+    """Yield every item of ``table_name`` in low-level format, scanning ``segments`` in parallel.
+
+    Pages pass through a queue holding at most two per segment, so slow
+    consumers hold back the scanners instead of buffering the table.
+    """
+    stop = stop or threading.Event()
+    pages = queue.Queue(maxsize=segments * 2)
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                pages.put(entry, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def scan_segment(segment):
+        kwargs = {'TableName': table_name, 'Limit': page_size, 'Segment': segment, 'TotalSegments': segments}
+        try:
+            while not stop.is_set():
+                response = client.scan(**kwargs)
+                if not put(response.get('Items', [])):
+                    return
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    threads = [
+        threading.Thread(target=scan_segment, args=(segment,), name=f'export-{table_name}-{segment}', daemon=True)
+        for segment in range(segments)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        remaining = segments
+        while remaining:
+            entry = pages.get()
+            if entry is _DONE:
+                remaining -= 1
+            elif isinstance(entry, Exception):
+                raise entry
+            else:
+                yield from entry
+    finally:
+        # Also reached when the consumer stops early, e.g. a client disconnects
+        stop.set()
+
+
+def export_lines(client, tables=None, segments=4, page_size=500, stats=None):
+    """Yield one NDJSON line per item of each table"""
+    for table_name in tables or DEFAULT_TABLES:
+        for item in scan_table(client, table_name, segments, page_size):
+            yield json.dumps(
+                {'table': table_name, 'item': {name: _encode_binary(value) for name, value in item.items()}},
+                separators=(',', ':')
+            ) + '\n'
+            if stats:
+                stats.add(table_name)
+
+
+def gzip_chunks(lines, chunk_size=64 * 1024):
+    """Gzip a stream of text lines incrementally, yielding compressed chunks"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line.encode('utf-8'))
+        size += len(buffer[-1])
+        if size >= chunk_size:
+            chunk = compressor.compress(b''.join(buffer))
+            buffer, size = [], 0
+            if chunk:
+                yield chunk
+    yield compressor.compress(b''.join(buffer)) + compressor.flush()
+
+
+def gunzip_lines(chunks):
+    """Text lines from a stream of gzip-compressed chunks"""
+    decompressor = zlib.decompressobj(31)
+    pending = b''
+    for chunk in chunks:
+        pending += decompressor.decompress(chunk)
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8')
+    pending += decompressor.flush()
+    if pending:
+        yield pending.decode('utf-8')
+
+
+def write_batch(client, table_name, requests, stats=None, max_retries=8):
+    """BatchWriteItem ``requests``, retrying unprocessed items with backoff"""
+    request_items = {table_name: requests}
+    attempt = 0
+    while request_items:
+        response = client.batch_write_item(RequestItems=request_items)
+        request_items = response.get('UnprocessedItems') or {}
+        if request_items:
+            if attempt >= max_retries:
+                pending = sum(len(pending) for pending in request_items.values())
+                raise RuntimeError(f"BatchWriteItem left {pending} items unprocessed after {max_retries} retries")
+            if stats:
+                stats.retries += 1
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+def import_lines(client, lines, tables=None, stats=None, max_retries=8):
+    """Write the items of an export back, 25 per BatchWriteItem; only one batch per table is held"""
+    stats = stats or TransferStats()
+    batches = {}
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            table_name = record['table']
+            item = {name: _decode_binary(value) for name, value in record['item'].items()}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise ValueError(f'Line {number} is not a valid export record: {str(e)}')
+        if tables and table_name not in tables:
+            continue
+
+        batch = batches.setdefault(table_name, [])
+        batch.append({'PutRequest': {'Item': item}})
+        if len(batch) == BATCH_WRITE_LIMIT:
+            write_batch(client, table_name, batch, stats, max_retries)
+            stats.add(table_name, len(batch))
+            batches[table_name] = []
+
+    for table_name, batch in batches.items():
+        if batch:
+            write_batch(client, table_name, batch, stats, max_retries)
+            stats.add(table_name, len(batch))
+    return stats
+
+
+def _open_output(path):
+    if path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8')
+    return open(path, 'w', encoding='utf-8')
+
+
+def _open_input(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+
+def main():
+    import contextlib
+
+    import boto3
+    from storage import client_config
+    # aws_config prints an environment summary; keep stdout clean for the export itself
+    with contextlib.redirect_stdout(sys.stderr):
+        from config.aws_config import AWS_ACCESS_KEY, AWS_SECRET_KEY, REGION
+
+    parser = argparse.ArgumentParser(description='Export or import the DynamoDB tables as NDJSON')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('--out', default='-', help="file to write, '-' for stdout; .gz is compressed")
+    export_parser.add_argument('--segments', type=int, default=4, help='parallel Scan segments per table')
+    export_parser.add_argument('--page-size', type=int, default=500)
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('--in', dest='path', default='-', help="file to read, '-' for stdin; .gz is decompressed")
+    for command in (export_parser, import_parser):
+        command.add_argument('--tables', nargs='+', default=None, help=f"default: {' '.join(DEFAULT_TABLES)}")
+    args = parser.parse_args()
+
+    client = boto3.client(
+        'dynamodb',
+        aws_access_key_id=AWS_ACCESS_KEY,
+        aws_secret_access_key=AWS_SECRET_KEY,
+        region_name=REGION,
+        config=client_config()
+    )
+    report = lambda summary: print(json.dumps(summary), file=sys.stderr)
+    stats = TransferStats(report=report)
+
+    if args.command == 'export':
+        with _open_output(args.out) as out:
+            for line in export_lines(client, args.tables, args.segments, args.page_size, stats):
+                out.write(line)
+    else:
+        with _open_input(args.path) as lines:
+            import_lines(client, lines, args.tables, stats)
+
+    report(stats.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+import queue
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+
+from metrics import Counters
+from storage import backoff_delay, is_throttle_error
+
+_deserializer = TypeDeserializer()
+
+# Tables whose writes the app follows, with their key attribute names
+WATCHED_TABLES = {'live_notes': ('classroom_id',), 'users': ('email',)}
+
+# update_table errors raised while another process is enabling the stream, or once it has
+STREAM_UPDATE_RACES = ('ResourceInUseException', 'ValidationException')
+
+
+def _plain(value):
+    """Python value of a DynamoDB wire-format attribute ({'S': 'x'}), passing plain values through"""
+    if isinstance(value, dict) and len(value) == 1:
+        try:
+            return _deserializer.deserialize(value)
+        except (TypeError, ValueError):
+            pass
+    return value
+
+
+def _extract_keys(attributes, key_names):
+    if not attributes or any(name not in attributes for name in key_names):
+        return None
+    return {name: _plain(attributes[name]) for name in key_names}
+
+
+class ChangeFeed:
+    """Ordered feed of item-level changes to the watched tables.
+
+    ``tables`` maps each watched table to its key attribute names. Handlers
+    get records shaped like DynamoDB Streams records, reduced to what cache
+    invalidation needs: {'table', 'event' (INSERT, MODIFY or REMOVE), 'keys',
+    'sequence', 'applied'}. Handlers run on the feed's own thread; errors are
+    logged and counted as ``handler_errors``.
+
+    ``applied`` is True when the writer has already brought this node's caches
+    in line with the change itself (see ``applied_by_writer``), so handlers
+    only need to tell the other nodes.
+
+    ``shared`` tells whether every app node sees every change (a stream
+    read by all nodes) or only its own writes, in which case changes have
+    to be forwarded to the other nodes.
+    """
+
+    shared = False
+
+    def __init__(self, tables, logger=None):
+        self.tables = tables
+        self.logger = logger
+        self.counters = Counters()
+        self._handlers = []
+        self._resync_handlers = []
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    @contextmanager
+    def applied_by_writer(self):
+        """Mark writes made in this block as already applied to this node's caches.
+
+        Only a feed that sees the writing call can tell which record is whose;
+        elsewhere the records arrive unmarked and handlers apply them again.
+        """
+        yield
+
+    def on_resync(self, handler):
+        """Call ``handler(reason)`` when changes may have been skipped"""
+        self._resync_handlers.append(handler)
+
+    def _resync(self, reason):
+        self.counters.incr('resyncs')
+        if self.logger:
+            self.logger.warning(f"Change feed resync: {reason}")
+        for handler in self._resync_handlers:
+            try:
+                handler(reason)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Change feed resync handler failed: {str(e)}")
+
+    def _dispatch(self, record):
+        self.counters.incr(f"{record['table']}.{record['event']}")
+        for handler in self._handlers:
+            try:
+                handler(record)
+            except Exception as e:
+                self.counters.incr('handler_errors')
+                if self.logger:
+                    self.logger.error(f"Change feed handler failed for {record['table']} {record['keys']}: {str(e)}")
+
+    def install(self, client):
+        """Watch writes made through ``client``; a feed read from streams sees every writer already"""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self):
+        return {'backend': type(self).__name__, 'shared': self.shared, 'counters': self.counters.snapshot()}
+
+
+class LocalChangeFeed(ChangeFeed):
+    """Change feed built from this process's own successful DynamoDB writes.
+
+    Installed as botocore event hooks on the client, so PutItem,
+    UpdateItem, DeleteItem and BatchWriteItem calls are captured whichever
+    code path makes them. Records are queued as soon as DynamoDB
+    acknowledges the write, and the last ``history`` records are kept so
+    tests and late subscribers can replay them. Handlers run on a
+    background thread, in order, so they add nothing to the write's
+    latency and cannot fail it; records written before ``start`` wait in
+    the queue.
+
+    The request alone does not say whether a put created the item, so
+    puts and updates are reported as MODIFY.
+    """
+
+    WRITE_OPERATIONS = ('PutItem', 'UpdateItem', 'DeleteItem', 'BatchWriteItem')
+
+    def __init__(self, tables, history=1000, logger=None):
+        super().__init__(tables, logger=logger)
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history)
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._thread = None
+
+    @contextmanager
+    def applied_by_writer(self):
+        # Writes are recorded in the writing thread, so a thread-local flag marks exactly these
+        self._local.applied = True
+        try:
+            yield
+        finally:
+            self._local.applied = False
+
+    def install(self, client):
+        events = client.meta.events
+        for operation in self.WRITE_OPERATIONS:
+            events.register(f'before-parameter-build.dynamodb.{operation}', self._remember_request)
+            events.register(f'after-call.dynamodb.{operation}', self._record_write)
+
+    def _remember_request(self, params, model, context, **kwargs):
+        # Runs after boto3 has serialized resource-level values to wire format
+        context['change_feed_params'] = params
+
+    def _record_write(self, parsed, model, context, **kwargs):
+        params = context.get('change_feed_params')
+        if params is None or parsed.get('Error'):
+            return
+
+        # Runs inside the botocore call: whatever goes wrong here must not fail a write that succeeded
+        try:
+            applied = getattr(self._local, 'applied', False)
+            for table, event, keys in self._changes(model.name, params, parsed):
+                with self._lock:
+                    self._sequence += 1
+                    record = {'table': table, 'event': event, 'keys': keys, 'sequence': self._sequence, 'applied': applied}
+                    self._history.append(record)
+                self._queue.put(record)
+        except Exception as e:
+            self.counters.incr('errors')
+            if self.logger:
+                self.logger.error(f"Change feed could not record a {model.name}: {str(e)}")
+            self._resync(f'unrecorded {model.name}')
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='change-feed-dispatch', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Dispatch the records already queued, then stop"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            self._dispatch(record)
+
+    def stats(self):
+        return dict(super().stats(), queued=self._queue.qsize())
+
+    def _changes(self, operation, params, parsed):
+        if operation == 'BatchWriteItem':
+            unprocessed = parsed.get('UnprocessedItems') or {}
+            for table, requests in (params.get('RequestItems') or {}).items():
+                key_names = self.tables.get(table)
+                if not key_names:
+                    continue
+                for request in requests:
+                    if request in unprocessed.get(table, []):
+                        continue
+                    if 'PutRequest' in request:
+                        keys = _extract_keys(request['PutRequest'].get('Item'), key_names)
+                        event = 'MODIFY'
+                    else:
+                        keys = _extract_keys(request.get('DeleteRequest', {}).get('Key'), key_names)
+                        event = 'REMOVE'
+                    if keys:
+                        yield table, event, keys
+            return
+
+        table = params.get('TableName')
+        key_names = self.tables.get(table)
+        if not key_names:
+            return
+        if operation == 'PutItem':
+            keys = _extract_keys(params.get('Item'), key_names)
+        else:
+            keys = _extract_keys(params.get('Key'), key_names)
+        if keys:
+            yield table, 'REMOVE' if operation == 'DeleteItem' else 'MODIFY', keys
+
+    def replay(self, after_sequence=0):
+        """Records newer than ``after_sequence`` still held in the history"""
+        with self._lock:
+            return [record for record in self._history if record['sequence'] > after_sequence]
+
+
+class StreamsChangeFeed(ChangeFeed):
+    """Change feed read from the DynamoDB Streams of the watched tables.
+
+    Every node reads the streams itself, so writes made by any node or by
+    tools outside the app are seen everywhere. Streams are enabled
+    (KEYS_ONLY) on tables that lack one. Reading starts at the latest
+    record of the shards open at start-up; shards that appear later are
+    read from their beginning so no change between them is lost.
+
+    DynamoDB throttles more than two readers per shard, so with many
+    workers expect some throttled polls; they back off and retry.
+    """
+
+    shared = True
+
+    def __init__(self, dynamodb, streams, tables, poll_interval=1.0, shard_refresh_interval=60, logger=None):
+        super().__init__(tables, logger=logger)
+        self.dynamodb = dynamodb
+        self.streams = streams
+        self.poll_interval = poll_interval
+        self.shard_refresh_interval = shard_refresh_interval
+        self._stream_arns = {}
+        # shard id -> (table, iterator); finished shards map to None
+        self._shards = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable_stream(self, table_name):
+        return enable_stream(self.dynamodb, table_name)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        for table_name in self.tables:
+            self._stream_arns[table_name] = self.enable_stream(table_name)
+        self._refresh_shards(initial=True)
+        self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_shards(self, initial=False):
+        for table_name, stream_arn in self._stream_arns.items():
+            kwargs = {'StreamArn': stream_arn}
+            while True:
+                description = self.streams.describe_stream(**kwargs)['StreamDescription']
+                for shard in description['Shards']:
+                    shard_id = shard['ShardId']
+                    if shard_id in self._shards:
+                        continue
+                    closed = 'EndingSequenceNumber' in shard['SequenceNumberRange']
+                    if initial and closed:
+                        # Already-finished history from before start-up
+                        self._shards[shard_id] = None
+                        continue
+                    iterator = self.streams.get_shard_iterator(
+                        StreamArn=stream_arn,
+                        ShardId=shard_id,
+                        ShardIteratorType='LATEST' if initial else 'TRIM_HORIZON'
+                    )['ShardIterator']
+                    self._shards[shard_id] = (table_name, iterator)
+                    self.counters.incr('shards')
+                if not description.get('LastEvaluatedShardId'):
+                    break
+                kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def _poll_shard(self, shard_id, table_name, iterator):
+        response = self.streams.get_records(ShardIterator=iterator, Limit=1000)
+        key_names = self.tables[table_name]
+        for stream_record in response.get('Records', []):
+            keys = _extract_keys(stream_record['dynamodb'].get('Keys'), key_names)
+            if keys:
+                self._dispatch({
+                    'table': table_name,
+                    'event': stream_record['eventName'],
+                    'keys': keys,
+                    'sequence': stream_record['dynamodb'].get('SequenceNumber'),
+                    'applied': False
+                })
+        next_iterator = response.get('NextShardIterator')
+        # A closed shard has no next iterator once fully read; its children carry on
+        self._shards[shard_id] = (table_name, next_iterator) if next_iterator else None
+        return bool(response.get('Records'))
+
+    def _run(self):
+        attempt = 0
+        last_refresh = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                finished_shard = False
+                for shard_id, entry in list(self._shards.items()):
+                    if entry is None:
+                        continue
+                    self._poll_shard(shard_id, *entry)
+                    finished_shard = finished_shard or self._shards[shard_id] is None
+                if finished_shard or time.monotonic() - last_refresh > self.shard_refresh_interval:
+                    self._refresh_shards()
+                    last_refresh = time.monotonic()
+                attempt = 0
+                delay = self.poll_interval
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                if code == 'ExpiredIteratorException' or code == 'TrimmedDataAccessException':
+                    # Iterators last 15 minutes; start the shards over from their latest record
+                    self._shards.clear()
+                    self._refresh_shards(initial=True)
+                    self._resync(code)
+                    delay = 0
+                else:
+                    self.counters.incr('throttled' if is_throttle_error(e) or code == 'LimitExceededException' else 'errors')
+                    delay = backoff_delay(attempt, base=self.poll_interval, cap=30)
+                    attempt += 1
+                    if self.logger:
+                        self.logger.warning(f"Change feed poll failed: {str(e)}")
+            except Exception as e:
+                self.counters.incr('errors')
+                delay = backoff_delay(attempt, base=self.poll_interval, cap=30)
+                attempt += 1
+                if self.logger:
+                    self.logger.error(f"Change feed poll failed: {str(e)}")
+            self._stop.wait(delay)
+
+
+def enable_stream(dynamodb, table_name):
+    """Stream ARN of ``table_name``, enabling a KEYS_ONLY stream if it has none.
+
+    Meant to run once per deployment (gunicorn's ``when_ready``), but safe
+    when several processes race to enable the same stream.
+    """
+    table = dynamodb.Table(table_name)
+    table.reload()
+    if not (table.stream_specification or {}).get('StreamEnabled'):
+        try:
+            table.meta.client.update_table(
+                TableName=table_name,
+                StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'KEYS_ONLY'}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] not in STREAM_UPDATE_RACES:
+                raise
+        table.meta.client.get_waiter('table_exists').wait(TableName=table_name)
+        table.reload()
+    if not table.latest_stream_arn:
+        raise RuntimeError(f'Could not enable a stream on {table_name}')
+    return table.latest_stream_arn
+
+
+def create_change_feed(config, dynamodb, tables, streams=None, logger=None):
+    """Build the change feed selected by ``CHANGE_FEED_BACKEND``; 'streams' needs a dynamodbstreams client"""
+    if config['CHANGE_FEED_BACKEND'] == 'streams':
+        return StreamsChangeFeed(
+            dynamodb, streams, tables, poll_interval=config['CHANGE_FEED_POLL_INTERVAL'], logger=logger
+        )
+    feed = LocalChangeFeed(tables, logger=logger)
+    feed.install(dynamodb.meta.client)
+    return feed
@@ -0,0 +1,252 @@
+import json
+import secrets
+import threading
+import time
+from collections import deque
+
+import ot
+
+
+class StaleRevision(Exception):
+    """The client is too far behind the retained operation history and must resync"""
+
+
+def extract_text(content):
+    """Editor text from a stored notes content string"""
+    if not content:
+        return ''
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content
+    if isinstance(data, dict):
+        return data.get('text', '')
+    return content
+
+
+def merge_text(content, text):
+    """Stored content string with its editor text replaced, keeping language and format options"""
+    try:
+        data = json.loads(content) if content else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    data['text'] = text
+    data['timestamp'] = int(time.time() * 1000)
+    return json.dumps(data)
+
+
+# Content keys a settings-only save may change; the text belongs to the collaborative session
+SETTINGS_KEYS = ('language', 'formatOptions')
+
+
+def merge_settings(content, settings):
+    """Stored content string with the given settings replaced, keeping its text"""
+    try:
+        data = json.loads(content) if content else {}
+    except ValueError:
+        data = {'text': content}
+    if not isinstance(data, dict):
+        data = {'text': content}
+    data.update((key, settings[key]) for key in SETTINGS_KEYS if key in settings)
+    data['timestamp'] = int(time.time() * 1000)
+    return json.dumps(data)
+
+
+class CollabDocument:
+    """Server copy of one classroom's text and its recent operation history.
+
+    Clients send an operation together with the revision it was based on;
+    it is transformed past everything applied since, applied, and given the
+    next revision. Only the last ``history_limit`` operations are kept.
+
+    Revisions restart at 0 whenever a document is loaded, e.g. by the worker
+    replacing one that was shut down, so each load gets a new ``epoch``.
+    Clients send back the epoch they joined; a revision from another epoch
+    is refused as stale and the client resyncs instead of being merged
+    against the wrong history.
+    """
+
+    def __init__(self, classroom_id, text, history_limit=1000):
+        self.classroom_id = classroom_id
+        self.text = text
+        self.epoch = secrets.token_urlsafe(6)
+        self.revision = 0
+        self.persisted_revision = 0
+        # Last text written to or read from storage, to recognise our own writes coming back
+        self.persisted_text = text
+        self.history = deque(maxlen=history_limit)
+        self.lock = threading.Lock()
+        self.last_active = time.monotonic()
+
+    def _since(self, revision, epoch=None):
+        if epoch is not None and epoch != self.epoch:
+            raise StaleRevision('The document was reloaded since the client joined')
+        if revision > self.revision:
+            raise StaleRevision(f'Revision {revision} is ahead of the document')
+        missing = self.revision - revision
+        if missing > len(self.history):
+            raise StaleRevision(f'Revision {revision} is older than the retained history')
+        return [self.history[i] for i in range(len(self.history) - missing, len(self.history))]
+
+    def receive(self, client_id, base_revision, op, epoch=None):
+        """Merge ``op``; return its revision and the operations the client had not yet seen"""
+        op = ot.normalize(op)
+        with self.lock:
+            self.last_active = time.monotonic()
+            concurrent = self._since(base_revision, epoch)
+            for entry in concurrent:
+                op, _ = ot.transform(op, entry['ops'])
+            self.text = ot.apply(self.text, op)
+            self.revision += 1
+            self.history.append({'revision': self.revision, 'client_id': client_id, 'ops': op})
+            return self.revision, concurrent
+
+    def operations_since(self, revision, epoch=None):
+        with self.lock:
+            self.last_active = time.monotonic()
+            return self.revision, self._since(revision, epoch)
+
+    def snapshot(self):
+        with self.lock:
+            self.last_active = time.monotonic()
+            return self.revision, self.text
+
+    @property
+    def dirty(self):
+        return self.revision > self.persisted_revision
+
+
+class CollabHub:
+    """Live collaborative documents for the classrooms being edited in this process.
+
+    ``load(classroom_id)`` returns the stored text (or None if the classroom
+    does not exist) and ``persist(classroom_id, text)`` writes it back. Dirty
+    documents are flushed every ``flush_interval`` seconds, so storage sees
+    one compacted write per interval instead of one per keystroke; documents
+    idle for ``idle_timeout`` seconds are flushed and dropped.
+
+    State lives in process memory, so every editor of a classroom must reach
+    the same worker.
+    """
+
+    def __init__(self, load, persist, history_limit=1000, flush_interval=5, idle_timeout=600, logger=None):
+        self.load = load
+        self.persist = persist
+        self.history_limit = history_limit
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def document(self, classroom_id):
+        """Live document for ``classroom_id``, loading it from storage if needed"""
+        with self._lock:
+            document = self._documents.get(classroom_id)
+        if document is not None:
+            return document
+
+        text = self.load(classroom_id)
+        if text is None:
+            return None
+        with self._lock:
+            # Another request may have loaded it meanwhile; keep the first copy
+            return self._documents.setdefault(
+                classroom_id, CollabDocument(classroom_id, text, self.history_limit)
+            )
+
+    def get(self, classroom_id):
+        with self._lock:
+            return self._documents.get(classroom_id)
+
+    def replace_text(self, classroom_id, text, client_id='server'):
+        """Fold a whole-document save into a live document as an ordinary operation.
+
+        The caller has already stored ``text``, so the document is not marked dirty.
+        """
+        document = self.get(classroom_id)
+        if document is None:
+            return None
+        with document.lock:
+            op = ot.diff(document.text, text)
+            if not any(ot.is_insert(c) or ot.is_delete(c) for c in op):
+                return document.revision
+            document.text = ot.apply(document.text, op)
+            document.revision += 1
+            document.history.append({'revision': document.revision, 'client_id': client_id, 'ops': op})
+            # Storage now holds exactly this text
+            document.persisted_revision = document.revision
+            document.persisted_text = text
+            return document.revision
+
+    def external_update(self, classroom_id, text):
+        """Fold text that storage reports for ``classroom_id`` into its live document.
+
+        Ignored when it is the text this hub itself last flushed, so a
+        change feed echoing our own write cannot roll back newer edits.
+        """
+        document = self.get(classroom_id)
+        if document is None:
+            return None
+        with document.lock:
+            if text == document.persisted_text:
+                return document.revision
+        return self.replace_text(classroom_id, text)
+
+    def classroom_ids(self):
+        with self._lock:
+            return list(self._documents)
+
+    def discard(self, classroom_id):
+        with self._lock:
+            self._documents.pop(classroom_id, None)
+
+    def flush(self, evict_idle=True):
+        """Persist every dirty document and drop idle ones"""
+        with self._lock:
+            documents = list(self._documents.values())
+
+        now = time.monotonic()
+        for document in documents:
+            if document.dirty:
+                with document.lock:
+                    revision, text = document.revision, document.text
+                    document.persisted_text = text
+                try:
+                    self.persist(document.classroom_id, text)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Failed to persist collaborative document {document.classroom_id}: {str(e)}")
+                    continue
+                with document.lock:
+                    document.persisted_revision = max(document.persisted_revision, revision)
+            elif evict_idle and now - document.last_active > self.idle_timeout:
+                with self._lock:
+                    if not document.dirty:
+                        self._documents.pop(document.classroom_id, None)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='collab-flush', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush(evict_idle=False)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            documents = list(self._documents.values())
+        return {
+            'documents': len(documents),
+            'dirty': sum(1 for document in documents if document.dirty),
+            'revisions': {document.classroom_id: document.revision for document in documents}
+        }
@@ -8,6 +8,140 @@ class Config:
     STATIC_FOLDER = os.path.join(BASE_DIR, 'frontend', 'static')
     TEMPLATE_FOLDER = os.path.join(BASE_DIR, 'frontend', 'templates')
 
+    # Worker processes serving the app; gunicorn.conf.py sets it, other servers run one process
+    WORKER_PROCESSES = int(os.getenv('WORKER_PROCESSES', '1'))
+
+    # Session handling: 'cookie' keeps the signed cookie, 'server' keeps a session id only.
+    # The server store is in process memory, so 'server' needs a single worker process
+    SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie')
+    SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '4096'))
+    SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '60'))
+    SESSION_REFRESH_INTERVAL = int(os.getenv('SESSION_REFRESH_INTERVAL', '300'))
+
+    # Notes read cache and batch read limits
+    NOTES_CACHE_SIZE = int(os.getenv('NOTES_CACHE_SIZE', '128'))
+    NOTES_CACHE_TTL = float(os.getenv('NOTES_CACHE_TTL', '2'))
+    NOTES_BATCH_MAX = int(os.getenv('NOTES_BATCH_MAX', '100'))
+    # How long a notes item may still be served while DynamoDB is throttling reads
+    NOTES_STALE_TTL = float(os.getenv('NOTES_STALE_TTL', '300'))
+
+    # Request bodies declaring more than this many bytes are refused with 413, and saves stop reading
+    # once past it; /api/admin/import streams its upload line by line and is exempt
+    MAX_CONTENT_LENGTH = int(os.getenv('MAX_CONTENT_LENGTH', str(1024 * 1024)))
+
+    # Verified user records read by login; unknown and unverified emails are not cached
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '4096'))
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', '300'))
+
+    # Signup verification codes: 'sqlite' is shared by the workers on one host and needs every
+    # request on that host (as deploy.sh runs it); behind a balancer spreading requests over
+    # several hosts use 'dynamodb', which keeps codes on the users item. 'memory' suits a single worker
+    OTP_BACKEND = os.getenv('OTP_BACKEND', 'sqlite')
+    OTP_SQLITE_PATH = os.getenv('OTP_SQLITE_PATH', os.path.join(BASE_DIR, 'logs', 'otp.db'))
+    OTP_TTL = int(os.getenv('OTP_TTL', '600'))
+
+    # DynamoDB capacity: PROVISIONED uses the read/write units below, PAY_PER_REQUEST ignores them
+    DYNAMODB_BILLING_MODE = os.getenv('DYNAMODB_BILLING_MODE', 'PROVISIONED')
+    DYNAMODB_READ_CAPACITY = int(os.getenv('DYNAMODB_READ_CAPACITY', '5'))
+    DYNAMODB_WRITE_CAPACITY = int(os.getenv('DYNAMODB_WRITE_CAPACITY', '5'))
+    DYNAMODB_RETRY_MODE = os.getenv('DYNAMODB_RETRY_MODE', 'adaptive')
+    DYNAMODB_MAX_ATTEMPTS = int(os.getenv('DYNAMODB_MAX_ATTEMPTS', '5'))
+
+    # Revision history: full snapshot every N saves, deltas kept for the last RETAIN revisions
+    REVISION_SNAPSHOT_INTERVAL = int(os.getenv('REVISION_SNAPSHOT_INTERVAL', '50'))
+    REVISION_RETAIN = int(os.getenv('REVISION_RETAIN', '500'))
+    REVISION_MAX_SNAPSHOTS = int(os.getenv('REVISION_MAX_SNAPSHOTS', '100'))
+    REVISION_REPLAY_MAX = int(os.getenv('REVISION_REPLAY_MAX', '100'))
+
+    # Operational-transform editing. Off by default: documents live in one process, so enabling it
+    # runs gunicorn as a single threaded worker (gunicorn.conf.py); other servers need sticky routing
+    COLLAB_ENABLED = os.getenv('COLLAB_ENABLED', 'false').lower() == 'true'
+    COLLAB_HISTORY_LIMIT = int(os.getenv('COLLAB_HISTORY_LIMIT', '1000'))
+    COLLAB_FLUSH_INTERVAL = float(os.getenv('COLLAB_FLUSH_INTERVAL', '5'))
+    COLLAB_IDLE_TIMEOUT = float(os.getenv('COLLAB_IDLE_TIMEOUT', '600'))
+
+    # Viewer presence and cursors, kept in process memory like collaborative documents and off by default
+    PRESENCE_ENABLED = os.getenv('PRESENCE_ENABLED', 'false').lower() == 'true'
+    PRESENCE_MEMBER_TTL = float(os.getenv('PRESENCE_MEMBER_TTL', '30'))
+    PRESENCE_FRAME_INTERVAL = float(os.getenv('PRESENCE_FRAME_INTERVAL', '1'))
+    PRESENCE_FRAME_HISTORY = int(os.getenv('PRESENCE_FRAME_HISTORY', '30'))
+    PRESENCE_MAX_MEMBERS = int(os.getenv('PRESENCE_MAX_MEMBERS', '500'))
+
+    # Classroom change events between app nodes: 'local' (this process only) or 'socket' (TCP broker)
+    PUBSUB_BACKEND = os.getenv('PUBSUB_BACKEND', 'local')
+    PUBSUB_BROKER = os.getenv('PUBSUB_BROKER', '127.0.0.1:7600')
+    NODE_ID = os.getenv('NODE_ID')
+
+    # Source of item-level changes driving cache invalidation: 'local' (this process's writes) or 'streams'
+    CHANGE_FEED_BACKEND = os.getenv('CHANGE_FEED_BACKEND', 'local')
+    CHANGE_FEED_POLL_INTERVAL = float(os.getenv('CHANGE_FEED_POLL_INTERVAL', '1'))
+
+    # Full-text search over each instructor's notes, indexed into a SQLite file shared by the workers
+    SEARCH_ENABLED = os.getenv('SEARCH_ENABLED', 'false').lower() == 'true'
+    SEARCH_INDEX_PATH = os.getenv('SEARCH_INDEX_PATH', os.path.join(BASE_DIR, 'logs', 'search.db'))
+    SEARCH_RESULTS_MAX = int(os.getenv('SEARCH_RESULTS_MAX', '20'))
+
+    # Poll delays advised to clients: MIN while a classroom is being edited, growing with idle time up to MAX
+    POLL_MIN_DELAY = float(os.getenv('POLL_MIN_DELAY', '1'))
+    POLL_MAX_DELAY = float(os.getenv('POLL_MAX_DELAY', '30'))
+    POLL_ACTIVE_WINDOW = float(os.getenv('POLL_ACTIVE_WINDOW', '30'))
+    # Polls per second a classroom's viewers share between them, when presence counts the viewers
+    POLL_CLASSROOM_BUDGET = float(os.getenv('POLL_CLASSROOM_BUDGET', '25'))
+    # Largest class the 'poll' limits must admit with every viewer polling at POLL_MIN_DELAY,
+    # which is what they do when presence is off and the viewers are not counted
+    POLL_MAX_VIEWERS = int(os.getenv('POLL_MAX_VIEWERS', '300'))
+
+    # Server-side highlighting for read-only viewers; documents above RENDER_MAX_BYTES are escaped only
+    RENDER_ENABLED = os.getenv('RENDER_ENABLED', 'false').lower() == 'true'
+    RENDER_WORKERS = int(os.getenv('RENDER_WORKERS', '2'))
+    RENDER_CACHE_SIZE = int(os.getenv('RENDER_CACHE_SIZE', '256'))
+    RENDER_MAX_BYTES = int(os.getenv('RENDER_MAX_BYTES', str(512 * 1024)))
+    # Seconds a request waits for a fresh render before answering 202
+    RENDER_WAIT = float(os.getenv('RENDER_WAIT', '0.5'))
+
+    # Per-request span tracing; requests slower than TRACE_SLOW_MS are logged with their breakdown
+    TRACE_ENABLED = os.getenv('TRACE_ENABLED', 'false').lower() == 'true'
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '1'))
+    TRACE_SLOW_MS = float(os.getenv('TRACE_SLOW_MS', '500'))
+    TRACE_SLOW_HISTORY = int(os.getenv('TRACE_SLOW_HISTORY', '100'))
+    # On-demand sampling profiles, written as JSON files shared by the workers
+    PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'logs', 'profiles'))
+    PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+
+    # Dependency checks behind /health/ready run in the background every interval
+    HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', '15'))
+
+    # On shutdown or reload, seconds to wait for in-flight requests before flushing and stopping;
+    # keep it below gunicorn's graceful_timeout
+    SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv('SHUTDOWN_DRAIN_TIMEOUT', '20'))
+
+    # Admin endpoints (export, import, listing, traces, profiles) are limited to these users, signed in
+    # with their password; unset, they are closed to everyone
+    ADMIN_EMAILS = [email.strip() for email in os.getenv('ADMIN_EMAILS', '').split(',') if email.strip()]
+    ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '100'))
+
+    # Token bucket rate limits as (requests per second, burst), per classroom and per client;
+    # anonymous viewers are clients by address and tab id, and also share a generous bucket per
+    # network address. The memory backend keeps buckets per worker, so each worker admits the
+    # full rate; use the sqlite backend for limits shared across workers.
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', os.path.join(BASE_DIR, 'logs', 'ratelimit.db'))
+    RATE_LIMIT_RULES = {
+        'save': {'classroom': (5, 20), 'network': (20, 60), 'client': (2, 6)},
+        # A whole class may sit behind one address, so the network bucket is sized like the classroom's
+        'poll': {
+            'classroom': (POLL_MAX_VIEWERS / POLL_MIN_DELAY, 2 * POLL_MAX_VIEWERS),
+            'network': (POLL_MAX_VIEWERS / POLL_MIN_DELAY, 2 * POLL_MAX_VIEWERS),
+            'client': (3, 10)
+        },
+        'collab': {'classroom': (100, 200), 'network': (300, 900), 'client': (10, 30)}
+    }
+
+    # Reverse proxies in front of the app (nginx in deploy.sh); their X-Forwarded-For entries are
+    # trusted to give the client address. Set to 0 when clients connect directly.
+    TRUSTED_PROXIES = int(os.getenv('TRUSTED_PROXIES', '1'))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     ENV = 'development'
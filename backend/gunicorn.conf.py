@@ -0,0 +1,55 @@
+# gunicorn settings for production (scripts/deploy.sh). This file is read again
+# on SIGHUP (systemctl reload livecode), which starts workers with the new code
+# and config and then shuts the old ones down gracefully, so a deploy never
+# closes the listening socket.
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Settings below read the same .env as the app (deploy.sh writes it to the app directory);
+# the app only loads it once the workers import it, after this file has been read
+load_dotenv(Path(__file__).resolve().parent.parent / '.env')
+
+bind = os.getenv('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.getenv('GUNICORN_WORKERS', '3'))
+
+# Collaborative documents and presence live in process memory, and nginx does not route
+# a classroom to the same worker twice: with either enabled, every classroom is pinned to
+# one worker by running a single process, with threads in place of the other workers
+if any(os.getenv(flag, 'false').lower() == 'true' for flag in ('COLLAB_ENABLED', 'PRESENCE_ENABLED')):
+    threads = int(os.getenv('GUNICORN_THREADS', str(max(4, workers * 2))))
+    workers = 1
+
+# The app refuses per-process stores that would split state between several workers
+os.environ['WORKER_PROCESSES'] = str(workers)
+
+# Time a stopping worker gets to finish its requests and run the app's shutdown hooks
+# (drain, flush collaborative documents, stop background threads); above SHUTDOWN_DRAIN_TIMEOUT
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+
+
+def worker_exit(server, worker):
+    """Runs in the worker once it has stopped taking requests"""
+    app = getattr(worker, 'wsgi', None)
+    lifecycle = getattr(app, 'extensions', {}).get('lifecycle')
+    if lifecycle is not None:
+        lifecycle.shutdown('worker exit')
+
+
+def when_ready(server):
+    """Runs once in the master, before the first workers start"""
+    if os.getenv('CHANGE_FEED_BACKEND', 'local') != 'streams':
+        return
+    # Enabling a stream updates the table: do it here once rather than from every worker at import.
+    # Workers that still find a stream missing enable it themselves.
+    import boto3
+    from changefeed import WATCHED_TABLES, enable_stream
+    from config.aws_config import AWS_ACCESS_KEY, AWS_SECRET_KEY, REGION
+    dynamodb = boto3.resource('dynamodb', aws_access_key_id=AWS_ACCESS_KEY,
+                              aws_secret_access_key=AWS_SECRET_KEY, region_name=REGION)
+    for table_name in WATCHED_TABLES:
+        try:
+            enable_stream(dynamodb, table_name)
+        except Exception as e:
+            server.log.error(f"Could not enable the stream on {table_name}: {str(e)}")
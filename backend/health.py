@@ -0,0 +1,99 @@
+import threading
+import time
+from datetime import datetime
+
+
+class HealthMonitor:
+    """Dependency checks run in the background, so probes only read cached results.
+
+    Each registered check is a callable that raises (or returns False) when
+    the dependency is unusable. Checks run every ``interval`` seconds; a
+    result older than ``stale_after`` counts as failed, so a stuck checker
+    cannot keep reporting ready. Only ``critical`` checks affect readiness.
+    """
+
+    def __init__(self, interval=15, stale_after=None, logger=None):
+        self.interval = interval
+        self.stale_after = stale_after or interval * 3
+        self.logger = logger
+        self.started_at = time.monotonic()
+        self._checks = {}
+        self._results = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, name, check, critical=True):
+        self._checks[name] = (check, critical)
+
+    def run_checks(self):
+        for name, (check, critical) in list(self._checks.items()):
+            started = time.monotonic()
+            try:
+                ok = check() is not False
+                error = None if ok else 'check failed'
+            except Exception as e:
+                ok = False
+                error = str(e)
+            result = {
+                'status': 'ok' if ok else 'fail',
+                'critical': critical,
+                'latency_ms': round((time.monotonic() - started) * 1000, 1),
+                'checked_at': datetime.now().isoformat(),
+                'error': error,
+                '_at': time.monotonic()
+            }
+            if not ok and self.logger:
+                self.logger.warning(f"Health check {name} failed: {error}")
+            with self._lock:
+                self._results[name] = result
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='health-checks', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        # First round straight away so readiness does not wait a whole interval
+        while True:
+            try:
+                self.run_checks()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Health checks failed to run: {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def liveness(self):
+        """The process is up and serving requests; never touches dependencies"""
+        return {
+            'status': 'alive',
+            'uptime_seconds': round(time.monotonic() - self.started_at, 1)
+        }
+
+    def readiness(self):
+        """(ready, report) from the cached results of every check"""
+        now = time.monotonic()
+        with self._lock:
+            results = dict(self._results)
+
+        checks = {}
+        ready = True
+        for name, (_, critical) in self._checks.items():
+            result = results.get(name)
+            if result is None:
+                report = {'status': 'pending', 'critical': critical}
+            else:
+                report = {key: value for key, value in result.items() if key != '_at'}
+                age = now - result['_at']
+                report['age_seconds'] = round(age, 1)
+                if age > self.stale_after:
+                    report['status'] = 'stale'
+            if critical and report['status'] != 'ok':
+                ready = False
+            checks[name] = report
+
+        return ready, {'status': 'ready' if ready else 'not_ready', 'checks': checks}
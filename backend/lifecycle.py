@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+RUNNING = 'running'
+DRAINING = 'draining'
+STOPPING = 'stopping'
+STOPPED = 'stopped'
+
+
+class Lifecycle:
+    """Coordinated shutdown of one worker process.
+
+    ``wrap_wsgi`` counts requests in and out; a streamed response counts
+    until the server closes it. ``shutdown`` first marks the worker
+    draining, so readiness fails and a balancer stops routing to it, and
+    waits up to ``drain_timeout`` seconds for in-flight requests to finish.
+    It then runs the registered hooks in registration order: register
+    whatever flushes buffered writes before the change feed and bus that
+    carry those writes to other nodes.
+
+    Shutdown happens once; later calls return the first report. Requests
+    arriving once the hooks have started get a 503 with Retry-After, which
+    every client already retries, so they land on a replacement worker.
+    """
+
+    def __init__(self, drain_timeout=20, logger=None):
+        self.drain_timeout = drain_timeout
+        self.logger = logger
+        self.state = RUNNING
+        self.report = None
+        self._hooks = []
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def draining(self):
+        return self.state != RUNNING
+
+    def register(self, name, hook):
+        self._hooks.append((name, hook))
+
+    def wrap_wsgi(self, wsgi_app):
+        """WSGI middleware tracking in-flight requests and refusing new ones once stopping"""
+        def lifecycle_app(environ, start_response):
+            if self.state in (STOPPING, STOPPED):
+                return self._unavailable(start_response)
+            with self._condition:
+                self._in_flight += 1
+            try:
+                iterable = wsgi_app(environ, start_response)
+            except BaseException:
+                self._finished()
+                raise
+            return ClosingIterator(iterable, self._finished)
+        return lifecycle_app
+
+    def _finished(self):
+        with self._condition:
+            self._in_flight -= 1
+            if self._in_flight <= 0:
+                self._condition.notify_all()
+
+    @staticmethod
+    def _unavailable(start_response):
+        body = json.dumps({'error': 'Server is restarting, please retry'}).encode('utf-8')
+        start_response('503 SERVICE UNAVAILABLE', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', '1')
+        ])
+        return [body]
+
+    def shutdown(self, reason='shutdown'):
+        """Drain requests, then run every hook; returns {hook: {'ms', 'error'}}"""
+        with self._condition:
+            if self.state != RUNNING:
+                return self.report
+            self.state = DRAINING
+            started = time.monotonic()
+            if self.logger:
+                self.logger.info(f"Draining for {reason}: {self._in_flight} requests in flight")
+            deadline = started + self.drain_timeout
+            while self._in_flight > 0 and time.monotonic() < deadline:
+                self._condition.wait(deadline - time.monotonic())
+            abandoned = self._in_flight
+            self.state = STOPPING
+
+        if abandoned and self.logger:
+            self.logger.warning(f"Drain timed out with {abandoned} requests still in flight")
+
+        report = {}
+        for name, hook in self._hooks:
+            hook_started = time.monotonic()
+            error = None
+            try:
+                hook()
+            except Exception as e:
+                error = str(e)
+                if self.logger:
+                    self.logger.error(f"Shutdown hook {name} failed: {error}")
+            report[name] = {'ms': round((time.monotonic() - hook_started) * 1000, 1), 'error': error}
+
+        self.report = report
+        self.state = STOPPED
+        if self.logger:
+            self.logger.info(f"Shutdown complete in {time.monotonic() - started:.2f}s: {json.dumps(report)}")
+        return report
+
+    def stats(self):
+        with self._condition:
+            in_flight = self._in_flight
+        return {
+            'state': self.state,
+            'in_flight': in_flight,
+            'hooks': [name for name, _ in self._hooks],
+            'report': self.report
+        }
@@ -0,0 +1,26 @@
+import threading
+from collections import defaultdict
+
+
+class Counters:
+    """Thread-safe named counters, reported as a flat dict"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = defaultdict(int)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self._values[name] += amount
+
+    def get(self, name):
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {name: round(value, 4) for name, value in sorted(self._values.items())}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
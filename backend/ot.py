@@ -0,0 +1,150 @@
+# Operational transformation for plain text. Operations use the ot.js wire
+# format so the browser and server share it: a list whose items are a
+# positive int (retain that many characters), a negative int (delete that
+# many) or a string (insert it). Lengths count UTF-16 code units, matching
+# the offsets Monaco reports.
+
+
+def u16len(text):
+    return len(text.encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def is_retain(component):
+    return isinstance(component, int) and component > 0
+
+
+def is_delete(component):
+    return isinstance(component, int) and component < 0
+
+
+def is_insert(component):
+    return isinstance(component, str)
+
+
+def _append(op, component):
+    """Add ``component`` to ``op``, merging neighbours and keeping inserts before deletes"""
+    if component == 0 or component == '':
+        return
+    if op:
+        last = op[-1]
+        if is_insert(component):
+            if is_insert(last):
+                op[-1] = last + component
+                return
+            if is_delete(last):
+                if len(op) > 1 and is_insert(op[-2]):
+                    op[-2] += component
+                else:
+                    op.insert(len(op) - 1, component)
+                return
+        elif not is_insert(last) and (last > 0) == (component > 0):
+            op[-1] = last + component
+            return
+    op.append(component)
+
+
+def normalize(op):
+    if not isinstance(op, list):
+        raise ValueError('Operation must be a list')
+    result = []
+    for component in op:
+        if isinstance(component, bool) or not isinstance(component, (int, str)):
+            raise ValueError(f'Invalid operation component: {component!r}')
+        _append(result, component)
+    return result
+
+
+def base_length(op):
+    return sum(c if is_retain(c) else -c for c in op if not is_insert(c))
+
+
+def target_length(op):
+    return sum(c if is_retain(c) else u16len(c) for c in op if not is_delete(c))
+
+
+def apply(text, op):
+    """Apply ``op`` to ``text``; raises ValueError if it was built for a different length"""
+    data = text.encode('utf-16-le', 'surrogatepass')
+    if base_length(op) * 2 != len(data):
+        raise ValueError('Operation base length does not match the document')
+    parts = []
+    position = 0
+    for component in op:
+        if is_retain(component):
+            parts.append(data[position:position + component * 2])
+            position += component * 2
+        elif is_delete(component):
+            position -= component * 2
+        else:
+            parts.append(component.encode('utf-16-le', 'surrogatepass'))
+    return b''.join(parts).decode('utf-16-le', errors='surrogatepass')
+
+
+def transform(a, b):
+    """Return (a', b') such that apply(apply(s, a), b') == apply(apply(s, b), a').
+
+    When both sides insert at the same position, ``a``'s insert goes first.
+    """
+    if base_length(a) != base_length(b):
+        raise ValueError('Concurrent operations must share a base length')
+    a_prime, b_prime = [], []
+    ia, ib = iter(a), iter(b)
+    op1, op2 = next(ia, None), next(ib, None)
+
+    while op1 is not None or op2 is not None:
+        if op1 is not None and is_insert(op1):
+            _append(a_prime, op1)
+            _append(b_prime, u16len(op1))
+            op1 = next(ia, None)
+            continue
+        if op2 is not None and is_insert(op2):
+            _append(a_prime, u16len(op2))
+            _append(b_prime, op2)
+            op2 = next(ib, None)
+            continue
+        if op1 is None or op2 is None:
+            raise ValueError('Operations are not compatible')
+
+        if is_retain(op1) and is_retain(op2):
+            length = min(op1, op2)
+            _append(a_prime, length)
+            _append(b_prime, length)
+        elif is_delete(op1) and is_delete(op2):
+            length = min(-op1, -op2)
+        elif is_delete(op1):
+            length = min(-op1, op2)
+            _append(a_prime, -length)
+        else:
+            length = min(op1, -op2)
+            _append(b_prime, -length)
+
+        op1 = _consume(op1, length, ia)
+        op2 = _consume(op2, length, ib)
+
+    return a_prime, b_prime
+
+
+def _consume(component, length, rest):
+    """Shorten a retain or delete by ``length``, moving to the next component once used up"""
+    remaining = abs(component) - length
+    if remaining:
+        return remaining if component > 0 else -remaining
+    return next(rest, None)
+
+
+def diff(old, new):
+    """Single-region operation turning ``old`` into ``new`` (common prefix and suffix kept)"""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+
+    op = []
+    _append(op, u16len(old[:prefix]))
+    _append(op, new[prefix:len(new) - suffix])
+    _append(op, -u16len(old[prefix:len(old) - suffix]))
+    _append(op, u16len(old[len(old) - suffix:]))
+    return op
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from boto3.dynamodb.conditions import Attr
+
+from cache import MISSING, TTLCache
+
+
+class MemoryOtpStore:
+    """Verification codes held in this process; only for a single worker"""
+
+    def __init__(self, maxsize=10000):
+        self._codes = TTLCache(maxsize=maxsize, ttl=600)
+
+    def set(self, email, code, ttl):
+        self._codes.set(email, code, ttl=ttl)
+
+    def get(self, email):
+        """The live code for ``email``, or None if there is none or it expired"""
+        code = self._codes.get(email)
+        return None if code is MISSING else code
+
+    def delete(self, email):
+        self._codes.delete(email)
+
+
+class SQLiteOtpStore:
+    """Verification codes in a SQLite file, shared by every worker process on the host.
+
+    Other hosts cannot see the file: with more than one app host, a code sent
+    by one of them can only be checked on the same host, so use
+    ``DynamoDbOtpStore`` there instead.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS codes (email TEXT PRIMARY KEY, code TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def set(self, email, code, ttl):
+        # Wall clock rather than monotonic, since other processes share the rows
+        now = time.time()
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO codes (email, code, expires_at) VALUES (?, ?, ?)', (email, code, now + ttl))
+        # Codes nobody used; the table only ever holds the last few minutes of signups
+        conn.execute('DELETE FROM codes WHERE expires_at <= ?', (now,))
+
+    def get(self, email):
+        row = self._connect().execute(
+            'SELECT code FROM codes WHERE email = ? AND expires_at > ?', (email, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete(self, email):
+        self._connect().execute('DELETE FROM codes WHERE email = ?', (email,))
+
+
+class DynamoDbOtpStore:
+    """Verification codes on the users item (``otp``, ``otp_expiry``), visible to every host.
+
+    Costs a write per code sent, which the local stores avoid.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def set(self, email, code, ttl):
+        # Same attributes and expiry format as codes written before the local stores existed
+        self.table.update_item(
+            Key={'email': email},
+            UpdateExpression='SET otp = :code, otp_expiry = :expiry',
+            ConditionExpression=Attr('email').exists(),
+            ExpressionAttributeValues={':code': code, ':expiry': (datetime.now() + timedelta(seconds=ttl)).isoformat()}
+        )
+
+    def get(self, email):
+        user = self.table.get_item(Key={'email': email}, ConsistentRead=True).get('Item') or {}
+        if not user.get('otp') or datetime.now() > datetime.fromisoformat(user['otp_expiry']):
+            return None
+        return user['otp']
+
+    def delete(self, email):
+        self.table.update_item(Key={'email': email}, UpdateExpression='REMOVE otp, otp_expiry')
+
+
+def create_otp_store(config, users_table=None):
+    """Build the verification code store selected by ``OTP_BACKEND``; 'dynamodb' needs the users table"""
+    if config['OTP_BACKEND'] == 'memory':
+        return MemoryOtpStore()
+    if config['OTP_BACKEND'] == 'dynamodb':
+        return DynamoDbOtpStore(users_table)
+    return SQLiteOtpStore(config['OTP_SQLITE_PATH'])
@@ -0,0 +1,159 @@
+"""Incremental parsing of JSON request bodies.
+
+``request.get_json()`` buffers the whole body, decodes it to a string and
+parses that, and Flask keeps the raw bytes cached for the rest of the
+request: three copies of a large document alive at once. A save body is
+one object of short fields and one big string, so ``read_json_object``
+reads the stream in chunks and decodes each string as its chunks arrive.
+The body itself is never held: parsing peaks at one chunk plus the
+decoded string twice over, while its pieces are joined.
+"""
+import codecs
+import json
+import re
+from json.decoder import scanstring
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_decoder = json.JSONDecoder()
+
+
+class PayloadTooLarge(Exception):
+    """The body is longer than the allowed number of bytes"""
+
+    def __init__(self, limit):
+        super().__init__(f'Request body exceeds {limit} bytes')
+        self.limit = limit
+
+
+def _complete_end(text, start):
+    """End of the longest prefix of ``text[start:]`` that does not cut an escape in two"""
+    end = len(text)
+    # An escape is at most six characters, so only the last backslash among them can be cut off
+    backslash = text.rfind('\\', max(start, end - 6), end)
+    if backslash == -1:
+        return end
+    run = backslash
+    while run > start and text[run - 1] == '\\':
+        run -= 1
+    if (backslash - run) % 2:
+        # The second half of an escaped backslash, which is complete
+        return end
+    length = 6 if text[backslash + 1:backslash + 2] == 'u' else 2
+    return backslash if backslash + length > end else end
+
+
+def _append_text(pieces, text):
+    # A surrogate pair escape split between two chunks decodes to two lone halves; rejoin them
+    if pieces and text and '\ud800' <= pieces[-1][-1:] <= '\udbff' and '\udc00' <= text[0] <= '\udfff':
+        high = pieces[-1][-1]
+        pieces[-1] = pieces[-1][:-1]
+        text = chr(0x10000 + ((ord(high) - 0xd800) << 10) + (ord(text[0]) - 0xdc00)) + text[1:]
+    pieces.append(text)
+
+
+class _ObjectReader:
+    def __init__(self, stream, limit, chunk_size):
+        self.stream = stream
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.received = 0
+        self.finished = False
+
+    def fill(self):
+        """Append the next chunk to the unconsumed text; False once the stream is exhausted"""
+        if self.finished:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.received += len(chunk)
+        if self.limit is not None and self.received > self.limit:
+            raise PayloadTooLarge(self.limit)
+        if not chunk:
+            self.finished = True
+        self.buffer = self.buffer[self.position:] + self.decoder.decode(chunk, final=self.finished)
+        self.position = 0
+        return True
+
+    def peek(self):
+        """The next non-whitespace character, or '' at the end of the body"""
+        while True:
+            self.position = WHITESPACE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                return ''
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(f"Expected '{character}' in request body")
+        self.position += 1
+
+    def string(self):
+        """Decode the string starting at the current quote, a chunk at a time"""
+        self.expect('"')
+        pieces = []
+        while True:
+            try:
+                text, self.position = scanstring(self.buffer, self.position)
+                _append_text(pieces, text)
+                return ''.join(pieces)
+            except ValueError:
+                # Unterminated so far, or cut off mid-escape; at the end of the body it is an error
+                if self.finished:
+                    raise
+            end = _complete_end(self.buffer, self.position)
+            if end > self.position:
+                # Raises for malformed escapes and control characters, as the whole string would
+                _append_text(pieces, scanstring(self.buffer[self.position:end] + '"', 0)[0])
+                self.position = end
+            self.fill()
+
+    def value(self):
+        if self.peek() == '"':
+            return self.string()
+        # Numbers, literals and nested values: small in a save body, so wait until one parses
+        # and is followed by a delimiter (a number cut off at the chunk boundary would parse short)
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+                if self.finished or (end < len(self.buffer) and self.buffer[end] in ' \t\n\r,}'):
+                    self.position = end
+                    return value
+            except ValueError:
+                if self.finished:
+                    raise
+            self.fill()
+
+    def object(self):
+        self.expect('{')
+        result = {}
+        if self.peek() == '}':
+            self.position += 1
+        else:
+            while True:
+                key = self.string()
+                self.expect(':')
+                result[key] = self.value()
+                if self.peek() == ',':
+                    self.position += 1
+                    continue
+                self.expect('}')
+                break
+        if self.peek():
+            raise ValueError('Unexpected data after the JSON object')
+        return result
+
+
+def read_json_object(stream, limit=None, chunk_size=CHUNK_SIZE):
+    """Parse a JSON object from a binary stream of UTF-8.
+
+    Raises PayloadTooLarge as soon as more than ``limit`` bytes have been
+    read, whatever the Content-Length said, and ValueError if the body is
+    not a JSON object.
+    """
+    return _ObjectReader(stream, limit, chunk_size).object()
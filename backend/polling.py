@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+
+class PollAdvisor:
+    """Advises clients how long to wait before polling a classroom again.
+
+    The delay follows the classroom's activity, so the aggregate request rate
+    tracks editing rather than the number of open tabs:
+
+    * changes seen by this node in the last ``window`` seconds, or a
+      ``last_updated`` within ``active_window``, give ``min_delay``;
+    * past that the delay grows in proportion to how long the document has
+      been idle, up to ``max_delay``;
+    * many viewers stretch it so they share ``classroom_budget`` polls per
+      second between them;
+    * DynamoDB throttling or classroom-wide load shedding of the classroom's
+      requests in the last ``window`` seconds doubles it.
+
+    Delays get ±10% jitter so tabs opened together do not poll in lockstep.
+    """
+
+    def __init__(self, min_delay=1, max_delay=30, active_window=30, classroom_budget=25,
+                 window=60, max_classrooms=10000):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.active_window = active_window
+        self.classroom_budget = classroom_budget
+        self.window = window
+        self.max_classrooms = max_classrooms
+        self._changes = OrderedDict()
+        self._pressure = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record_change(self, classroom_id):
+        now = time.monotonic()
+        with self._lock:
+            changes = self._changes.pop(classroom_id, None) or deque(maxlen=32)
+            changes.append(now)
+            self._changes[classroom_id] = changes
+            while len(self._changes) > self.max_classrooms:
+                self._changes.popitem(last=False)
+
+    def record_pressure(self, classroom_id):
+        """Note that a request for ``classroom_id`` was throttled or shed"""
+        with self._lock:
+            self._pressure.pop(classroom_id, None)
+            self._pressure[classroom_id] = time.monotonic()
+            while len(self._pressure) > self.max_classrooms:
+                self._pressure.popitem(last=False)
+
+    def _recent_changes(self, classroom_id, now):
+        with self._lock:
+            changes = self._changes.get(classroom_id)
+            return sum(1 for at in changes if now - at <= self.window) if changes else 0
+
+    def _under_pressure(self, classroom_id, now):
+        with self._lock:
+            at = self._pressure.get(classroom_id)
+        return at is not None and now - at <= self.window
+
+    def delay(self, classroom_id, last_updated=None, viewers=0):
+        """Seconds until the next poll of ``classroom_id``"""
+        now = time.monotonic()
+        if self._recent_changes(classroom_id, now):
+            delay = self.min_delay
+        else:
+            idle = self._idle_seconds(last_updated)
+            if idle is None or idle <= self.active_window:
+                delay = self.min_delay
+            else:
+                delay = self.min_delay * idle / self.active_window
+
+        delay = max(delay, viewers / self.classroom_budget)
+        if self._under_pressure(classroom_id, now):
+            delay *= 2
+        delay = min(delay, self.max_delay)
+        return delay * random.uniform(0.9, 1.1)
+
+    def delay_ms(self, classroom_id, last_updated=None, viewers=0):
+        return int(self.delay(classroom_id, last_updated, viewers) * 1000)
+
+    @staticmethod
+    def _idle_seconds(last_updated):
+        # last_updated is written with datetime.now().isoformat(), i.e. server local time
+        if not last_updated:
+            return None
+        try:
+            return max(0.0, (datetime.now() - datetime.fromisoformat(str(last_updated))).total_seconds())
+        except ValueError:
+            return None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            active = sum(1 for changes in self._changes.values() if changes and now - changes[-1] <= self.window)
+            pressured = sum(1 for at in self._pressure.values() if now - at <= self.window)
+        return {'active_classrooms': active, 'classrooms_under_pressure': pressured}
@@ -0,0 +1,185 @@
+import threading
+import time
+from collections import deque
+
+
+class UnknownMember(Exception):
+    """The client has not joined the room, or was expired for missing heartbeats"""
+
+
+class PresenceRoom:
+    """Who is looking at one classroom, and where their cursors are.
+
+    Updates are not sent to anyone as they happen. They are coalesced per
+    member into ``pending`` and published as one frame per tick, so a
+    member moving its cursor ten times between ticks costs one entry, and
+    each subscriber reads one frame per tick however many members changed.
+    """
+
+    def __init__(self, classroom_id, frame_history=30):
+        self.classroom_id = classroom_id
+        self.members = {}
+        self.last_seen = {}
+        self.pending = {}
+        self.seq = 0
+        self.frames = deque(maxlen=frame_history)
+        self.lock = threading.Lock()
+
+    def state(self):
+        return {'seq': self.seq, 'members': [dict(member) for member in self.members.values()]}
+
+    def frames_since(self, seq):
+        """Frames after ``seq``, or None when some were already dropped"""
+        if seq >= self.seq:
+            return []
+        if not self.frames or self.frames[0]['seq'] > seq + 1:
+            return None
+        return [frame for frame in self.frames if frame['seq'] > seq]
+
+    def publish(self):
+        if not self.pending:
+            return None
+        self.seq += 1
+        frame = {
+            'seq': self.seq,
+            'changes': [
+                {'client_id': client_id, 'member': dict(member) if member else None}
+                for client_id, member in self.pending.items()
+            ],
+            'count': len(self.members)
+        }
+        self.frames.append(frame)
+        self.pending = {}
+        return frame
+
+
+class PresenceHub:
+    """Ephemeral per-classroom presence kept in process memory only.
+
+    Members join, then send heartbeats (optionally carrying a cursor) at
+    least every ``member_ttl`` seconds or they are dropped. Every
+    ``frame_interval`` seconds the background thread publishes one frame
+    per room with the coalesced changes; clients ask for the frames after
+    the last ``seq`` they saw and get a full state instead when they have
+    fallen further behind than ``frame_history`` frames.
+    """
+
+    def __init__(self, member_ttl=30, frame_interval=1.0, frame_history=30, max_members=500, logger=None):
+        self.member_ttl = member_ttl
+        self.frame_interval = frame_interval
+        self.frame_history = frame_history
+        self.max_members = max_members
+        self.logger = logger
+        self._rooms = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _room(self, classroom_id):
+        with self._lock:
+            return self._rooms.get(classroom_id)
+
+    def join(self, classroom_id, client_id, name, role, cursor=None):
+        # Holding the hub lock keeps tick() from dropping the room as we join it
+        with self._lock:
+            room = self._rooms.get(classroom_id)
+            if room is None:
+                room = self._rooms[classroom_id] = PresenceRoom(classroom_id, self.frame_history)
+            with room.lock:
+                if client_id not in room.members and len(room.members) >= self.max_members:
+                    raise OverflowError('Classroom presence is full')
+                member = {'client_id': client_id, 'name': name, 'role': role, 'cursor': cursor}
+                room.members[client_id] = member
+                room.last_seen[client_id] = time.monotonic()
+                room.pending[client_id] = member
+                return room.state()
+
+    def heartbeat(self, classroom_id, client_id, seq, cursor=None):
+        """Refresh a member and return what changed since ``seq``.
+
+        Returns {'seq', 'frames'} normally, or {'seq', 'members', 'resync': True}
+        when frames after ``seq`` are no longer kept.
+        """
+        room = self._room(classroom_id)
+        if room is None:
+            raise UnknownMember(client_id)
+        with room.lock:
+            member = room.members.get(client_id)
+            if member is None:
+                raise UnknownMember(client_id)
+            room.last_seen[client_id] = time.monotonic()
+            if cursor != member['cursor']:
+                member['cursor'] = cursor
+                room.pending[client_id] = member
+            frames = room.frames_since(seq)
+            if frames is None:
+                return dict(room.state(), resync=True)
+            return {'seq': room.seq, 'frames': frames}
+
+    def leave(self, classroom_id, client_id):
+        room = self._room(classroom_id)
+        if room is None:
+            return
+        with room.lock:
+            if room.members.pop(client_id, None) is not None:
+                room.last_seen.pop(client_id, None)
+                room.pending[client_id] = None
+
+    def count(self, classroom_id):
+        room = self._room(classroom_id)
+        if room is None:
+            return 0
+        with room.lock:
+            return len(room.members)
+
+    def discard(self, classroom_id):
+        with self._lock:
+            self._rooms.pop(classroom_id, None)
+
+    def tick(self):
+        """Expire silent members and publish one frame per room with pending changes"""
+        with self._lock:
+            rooms = list(self._rooms.values())
+
+        deadline = time.monotonic() - self.member_ttl
+        published = 0
+        for room in rooms:
+            with room.lock:
+                for client_id, seen in list(room.last_seen.items()):
+                    if seen < deadline:
+                        del room.members[client_id]
+                        del room.last_seen[client_id]
+                        room.pending[client_id] = None
+                if room.publish() is not None:
+                    published += 1
+                empty = not room.members
+            if empty:
+                # Rooms are recreated on the next join; frames only matter to members
+                with self._lock, room.lock:
+                    if not room.members and self._rooms.get(room.classroom_id) is room:
+                        del self._rooms[room.classroom_id]
+        return published
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='presence-frames', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.frame_interval):
+            try:
+                self.tick()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Presence tick failed: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            rooms = list(self._rooms.values())
+        return {
+            'rooms': len(rooms),
+            'members': sum(len(room.members) for room in rooms)
+        }
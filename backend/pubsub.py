@@ -0,0 +1,347 @@
+import argparse
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+import time
+
+from metrics import Counters
+from storage import backoff_delay
+
+
+class Bus:
+    """Classroom change events shared between app nodes.
+
+    Every node numbers the messages it publishes 1, 2, 3, ... Receivers
+    track the last number seen per origin node: a duplicate is dropped and
+    a jump means messages were lost, in which case the resync handlers run
+    so the node can drop whatever state the missed messages would have
+    corrected. Losing the connection to the transport triggers a resync
+    too. A node never receives its own messages.
+
+    Subclasses provide the transport through ``_send`` and feed incoming
+    messages to ``_receive``.
+    """
+
+    def __init__(self, node_id=None, logger=None):
+        self.node_id = node_id or f'{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(2)}'
+        self.logger = logger
+        self.counters = Counters()
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        self._last_seen = {}
+        self._receive_lock = threading.Lock()
+        self._handlers = []
+        self._resync_handlers = []
+
+    def subscribe(self, handler):
+        """Call ``handler(message)`` for every message from another node"""
+        self._handlers.append(handler)
+
+    def on_resync(self, handler):
+        """Call ``handler(reason)`` whenever messages may have been missed"""
+        self._resync_handlers.append(handler)
+
+    def publish(self, event, data):
+        with self._seq_lock:
+            self._seq += 1
+            message = {
+                'origin': self.node_id,
+                'seq': self._seq,
+                'event': event,
+                'data': data,
+                'sent_at': time.time()
+            }
+            # Sent under the lock so messages leave in sequence order
+            sent = self._send(message)
+        self.counters.incr('published' if sent else 'dropped')
+        return message
+
+    def _send(self, message):
+        raise NotImplementedError
+
+    def _receive(self, message):
+        origin = message.get('origin')
+        seq = message.get('seq')
+        if origin == self.node_id or not isinstance(seq, int):
+            return
+
+        with self._receive_lock:
+            last = self._last_seen.get(origin)
+            if last is not None and seq <= last:
+                self.counters.incr('duplicates')
+                return
+            self._last_seen[origin] = seq
+            # The first message seen from a node only sets the baseline
+            gap = last is not None and seq > last + 1
+
+        if gap:
+            self.counters.incr('gaps')
+            self.counters.incr('missed', seq - last - 1)
+            self._resync(f'missed {seq - last - 1} messages from {origin}')
+
+        self.counters.incr('received')
+        for handler in self._handlers:
+            try:
+                handler(message)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Pub/sub handler failed for {message.get('event')}: {str(e)}")
+
+    def _resync(self, reason):
+        self.counters.incr('resyncs')
+        if self.logger:
+            self.logger.warning(f"Pub/sub resync: {reason}")
+        for handler in self._resync_handlers:
+            try:
+                handler(reason)
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Pub/sub resync handler failed: {str(e)}")
+
+    @property
+    def connected(self):
+        return True
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def stats(self):
+        with self._receive_lock:
+            peers = dict(self._last_seen)
+        return {
+            'node_id': self.node_id,
+            'backend': type(self).__name__,
+            'connected': self.connected,
+            'published_seq': self._seq,
+            'peers': peers,
+            'counters': self.counters.snapshot()
+        }
+
+
+class LocalBroker:
+    """In-process fan-out between LocalBus instances"""
+
+    def __init__(self):
+        self._buses = []
+        self._lock = threading.Lock()
+
+    def attach(self, bus):
+        with self._lock:
+            self._buses.append(bus)
+
+    def detach(self, bus):
+        with self._lock:
+            if bus in self._buses:
+                self._buses.remove(bus)
+
+    def deliver(self, message):
+        with self._lock:
+            buses = list(self._buses)
+        for bus in buses:
+            bus._receive(message)
+
+
+class LocalBus(Bus):
+    """Loopback bus: nodes sharing a LocalBroker see each other's messages.
+
+    With its own broker (the default) a node has no peers, which is the
+    right behaviour for a single-process deployment.
+    """
+
+    def __init__(self, broker=None, node_id=None, logger=None):
+        super().__init__(node_id=node_id, logger=logger)
+        self.broker = broker or LocalBroker()
+        self.broker.attach(self)
+
+    def _send(self, message):
+        self.broker.deliver(message)
+        return True
+
+    def stop(self):
+        self.broker.detach(self)
+
+
+class SocketBus(Bus):
+    """Bus connected to a line-delimited JSON broker over TCP (see ``Broker``).
+
+    Messages published while disconnected are dropped; peers see the jump
+    in sequence numbers and resync. After reconnecting this node resyncs
+    itself, since it may have missed messages meanwhile.
+    """
+
+    def __init__(self, host, port, node_id=None, logger=None, connect_timeout=5):
+        super().__init__(node_id=node_id, logger=logger)
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self._sock = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._connected = threading.Event()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='pubsub-socket', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    @property
+    def connected(self):
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout=None):
+        return self._connected.wait(timeout)
+
+    def _send(self, message):
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            sock.sendall(json.dumps(message, separators=(',', ':')).encode('utf-8') + b'\n')
+            return True
+        except OSError:
+            return False
+
+    def _run(self):
+        attempt = 0
+        connected_before = False
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+            except OSError as e:
+                if self.logger and attempt == 0:
+                    self.logger.warning(f"Pub/sub broker {self.host}:{self.port} unreachable: {str(e)}")
+                self._stop.wait(backoff_delay(attempt, base=0.5, cap=10))
+                attempt += 1
+                continue
+
+            sock.settimeout(None)
+            self._sock = sock
+            self._connected.set()
+            attempt = 0
+            if connected_before:
+                self.counters.incr('reconnects')
+                self._resync('reconnected to broker')
+            connected_before = True
+
+            try:
+                for line in sock.makefile('rb'):
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        self.counters.incr('malformed')
+                        continue
+                    self._receive(message)
+            except OSError:
+                pass
+            finally:
+                self._connected.clear()
+                self._sock = None
+                sock.close()
+
+
+class Broker:
+    """Minimal TCP fan-out broker: every line a client sends goes to all other clients.
+
+    A stand-in for Redis or SNS/SQS when testing several nodes locally:
+    ``python pubsub.py --port 7600``. Clients whose connection fails are dropped.
+    """
+
+    def __init__(self, host='127.0.0.1', port=7600):
+        broker = self
+        self._clients = set()
+        self._lock = threading.Lock()
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                broker._add(self.request)
+                try:
+                    for line in self.rfile:
+                        broker._fan_out(self.request, line)
+                except OSError:
+                    pass
+                finally:
+                    broker._remove(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.address = self.server.server_address
+        self._thread = None
+
+    def _add(self, client):
+        with self._lock:
+            self._clients.add(client)
+
+    def _remove(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def _fan_out(self, sender, line):
+        with self._lock:
+            clients = [client for client in self._clients if client is not sender]
+            for client in clients:
+                try:
+                    client.sendall(line)
+                except OSError:
+                    self._clients.discard(client)
+                    try:
+                        client.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='pubsub-broker', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self._lock:
+            for client in self._clients:
+                try:
+                    client.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._clients.clear()
+
+
+def create_bus(config, logger=None):
+    """Build the bus selected by ``PUBSUB_BACKEND``"""
+    # Every worker on a host reads the same NODE_ID; each must still be its own node, or
+    # workers would drop each other's messages as their own echoes and share sequence numbers
+    node_id = f"{config['NODE_ID']}-{os.getpid()}" if config.get('NODE_ID') else None
+    if config['PUBSUB_BACKEND'] == 'socket':
+        host, _, port = config['PUBSUB_BROKER'].rpartition(':')
+        return SocketBus(host, int(port), node_id=node_id, logger=logger)
+    if config.get('WORKER_PROCESSES', 1) > 1 and logger:
+        logger.warning(
+            f"PUBSUB_BACKEND is 'local' with {config['WORKER_PROCESSES']} worker processes: workers will not "
+            "see each other's changes and may serve stale notes until their caches expire. "
+            "Use PUBSUB_BACKEND=socket (or a single worker)."
+        )
+    return LocalBus(node_id=node_id, logger=logger)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the pub/sub broker stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7600)
+    args = parser.parse_args()
+    print(f'Pub/sub broker listening on {args.host}:{args.port}')
+    Broker(args.host, args.port).server.serve_forever()
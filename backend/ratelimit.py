@@ -0,0 +1,195 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, jsonify, request, session
+
+from metrics import Counters
+
+# Ids the pollers send in X-Client-Id; anything else keys the client on its address alone
+CLIENT_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+def _shortfall(buckets, levels, cost):
+    """(wait, index) for the first bucket holding fewer than ``cost`` tokens, or (0, None)"""
+    for index, ((_, rate, _), tokens) in enumerate(zip(buckets, levels)):
+        if tokens < cost:
+            return (cost - tokens) / rate, index
+    return 0, None
+
+
+class MemoryRateLimitBackend:
+    """Token buckets held in this process, evicting the least recently used keys"""
+
+    def __init__(self, max_keys=10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst, cost=1):
+        """Spend ``cost`` tokens from ``key``'s bucket; return seconds to wait, 0 if allowed"""
+        return self.take_all([(key, rate, burst)], cost)[0]
+
+    def take_all(self, buckets, cost=1):
+        """Spend ``cost`` from every ``(key, rate, burst)`` bucket, or from none of them.
+
+        Returns ``(wait, index)``: seconds until the first short bucket can pay and
+        its position in ``buckets``, or ``(0, None)`` when the tokens were spent.
+        """
+        now = time.monotonic()
+        with self._lock:
+            levels = []
+            for key, rate, burst in buckets:
+                tokens, updated_at = self._buckets.get(key, (burst, now))
+                levels.append(min(burst, tokens + (now - updated_at) * rate))
+            wait, index = _shortfall(buckets, levels, cost)
+            for (key, _, _), tokens in zip(buckets, levels):
+                self._buckets[key] = (tokens if wait else tokens - cost, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait, index
+
+
+class SQLiteRateLimitBackend:
+    """Token buckets in a SQLite file, shared by every worker process on the host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS buckets ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, cost=1):
+        return self.take_all([(key, rate, burst)], cost)[0]
+
+    def take_all(self, buckets, cost=1):
+        # Wall clock rather than monotonic, since other processes share the rows
+        now = time.time()
+        conn = self._connect()
+        # A failure here (database locked) leaves no transaction to roll back
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            for key, rate, burst in buckets:
+                row = conn.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated_at = row if row else (burst, now)
+                levels.append(min(burst, tokens + max(0, now - updated_at) * rate))
+            wait, index = _shortfall(buckets, levels, cost)
+            conn.executemany(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                [(key, tokens if wait else tokens - cost, now) for (key, _, _), tokens in zip(buckets, levels)]
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return wait, index
+
+
+class RateLimiter:
+    """Per-classroom and per-client token bucket limits for API endpoints.
+
+    ``rules`` maps an endpoint group (e.g. 'save') to ``{'classroom': (rate, burst),
+    'network': (rate, burst), 'client': (rate, burst)}``, with rates in requests
+    per second. A client is the signed-in user or, for anonymous viewers, the
+    network address and the per-tab id the pollers send; anonymous requests also
+    share a bucket per network address, so inventing ids does not escape the
+    limit, while a class behind one NAT still gets a bucket each. A request is
+    admitted only if every bucket has a token, and is shed with 429 without
+    spending any otherwise; the scope that shed it is left in ``g.shed_scope``.
+    """
+
+    def __init__(self, backend, rules, enabled=True, logger=None):
+        self.backend = backend
+        self.rules = rules
+        self.enabled = enabled
+        self.logger = logger
+        self.counters = Counters()
+
+    def client_key(self):
+        """The signed-in user, or the network address plus the tab's X-Client-Id for anonymous viewers.
+
+        Anonymous viewers are not given a session: writing one would send a cookie
+        and, with server-side sessions, store a record for every viewer.
+        """
+        if 'user' in session:
+            return f"user:{session['user']}"
+        client_id = request.headers.get('X-Client-Id', '')
+        if CLIENT_ID_PATTERN.fullmatch(client_id):
+            return f"anon:{request.remote_addr}:{client_id}"
+        return f"anon:{request.remote_addr}"
+
+    def check(self, group, classroom_id=None):
+        """Return seconds until the request may proceed, or 0 if it is admitted"""
+        rule = self.rules.get(group, {})
+        scopes = []
+        if classroom_id and 'classroom' in rule:
+            scopes.append(('classroom', f'{group}:classroom:{classroom_id}', rule['classroom']))
+        if 'user' not in session and 'network' in rule:
+            # remote_addr is the client as nginx saw it (ProxyFix), not a forwardable header
+            scopes.append(('network', f'{group}:network:{request.remote_addr}', rule['network']))
+        if 'client' in rule:
+            scopes.append(('client', f'{group}:client:{self.client_key()}', rule['client']))
+        if not scopes:
+            return 0
+
+        wait, index = self.backend.take_all([(key, rate, burst) for _, key, (rate, burst) in scopes])
+        if wait:
+            g.shed_scope = scopes[index][0]
+            self.counters.incr(f'{group}.shed')
+            self.counters.incr(f'{group}.shed.{g.shed_scope}')
+            return wait
+        self.counters.incr(f'{group}.admitted')
+        return 0
+
+    def limit(self, group):
+        """Decorator applying the ``group`` rule to a view taking ``classroom_id``"""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if self.enabled:
+                    wait = self.check(group, kwargs.get('classroom_id'))
+                    if wait:
+                        retry_after = max(1, math.ceil(wait))
+                        if self.logger:
+                            self.logger.warning(f"Rate limited {group} request to {request.path}, retry in {retry_after}s")
+                        response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+                        response.status_code = 429
+                        response.headers['Retry-After'] = str(retry_after)
+                        return response
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stats(self):
+        return self.counters.snapshot()
+
+
+def create_rate_limiter(config, logger=None):
+    """Build the rate limiter selected by ``RATE_LIMIT_BACKEND``"""
+    if config['RATE_LIMIT_BACKEND'] == 'sqlite':
+        backend = SQLiteRateLimitBackend(config['RATE_LIMIT_SQLITE_PATH'])
+    else:
+        backend = MemoryRateLimitBackend()
+    return RateLimiter(backend, config['RATE_LIMIT_RULES'], enabled=config['RATE_LIMIT_ENABLED'], logger=logger)
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import TextLexer, get_lexer_by_name
+from pygments.util import ClassNotFound
+
+from cache import MISSING, TTLCache
+from metrics import Counters
+
+# Monaco language ids whose Pygments lexer goes by another name
+LEXER_ALIASES = {
+    'plaintext': 'text',
+    'shell': 'bash'
+}
+
+# Pygments styles matching the viewer's light and dark themes
+THEME_STYLES = {
+    'light': 'default',
+    'dark': 'monokai'
+}
+
+CSS_SCOPE = '.rendered-code'
+
+
+def parse_content(content):
+    """(text, language) from a stored notes content string"""
+    if not content:
+        return '', 'plaintext'
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content, 'plaintext'
+    if not isinstance(data, dict):
+        return content, 'plaintext'
+    return data.get('text', ''), data.get('language') or 'plaintext'
+
+
+def lexer_for(language):
+    try:
+        return get_lexer_by_name(LEXER_ALIASES.get(language, language), stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return TextLexer(stripnl=False, ensurenl=False)
+
+
+def render_html(text, language):
+    """Highlighted HTML table of ``text``, with line numbers; styled by ``theme_css``"""
+    formatter = HtmlFormatter(linenos='table', cssclass=CSS_SCOPE[1:], wrapcode=True)
+    return highlight(text, lexer_for(language), formatter)
+
+
+def theme_css(theme):
+    css = HtmlFormatter(style=THEME_STYLES.get(theme, THEME_STYLES['light'])).get_style_defs(CSS_SCOPE)
+    # Pygments also emits unscoped pre and line-number rules; keep them off the rest of the page
+    return '\n'.join(line for line in css.splitlines() if line.startswith(CSS_SCOPE))
+
+
+class RenderCache:
+    """Server-side highlighting of notes versions for read-only viewers.
+
+    Each distinct (text, language) pair is rendered once, on a small thread
+    pool, and the HTML kept in a bounded LRU cache keyed by a digest of the
+    pair, so every viewer of a version shares one render and unchanged
+    saves cost nothing. Concurrent requests for a version being rendered
+    wait on the same job.
+
+    ``get`` waits up to ``wait`` seconds for a fresh render and returns None
+    if it is still running; the caller can tell the client to retry.
+    """
+
+    def __init__(self, workers=2, cache_size=256, ttl=3600, max_bytes=512 * 1024, logger=None):
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.max_bytes = max_bytes
+        self.logger = logger
+        self.counters = Counters()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text, language):
+        return hashlib.sha1(f'{language}\0{text}'.encode('utf-8')).hexdigest()
+
+    def get(self, content, wait=0.5):
+        """(key, html) for a stored content string; html is None while the render is still running"""
+        text, language = parse_content(content)
+        key = self.key(text, language)
+        html = self.cache.get(key)
+        if html is not MISSING:
+            self.counters.incr('hits')
+            return key, html
+
+        if len(text.encode('utf-8')) > self.max_bytes:
+            # Large documents are escaped only; highlighting them would hold a render thread for too long
+            language = 'plaintext'
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                self.counters.incr('misses')
+                future = self._executor.submit(self._render, key, text, language)
+                self._pending[key] = future
+        try:
+            return key, future.result(timeout=wait)
+        except TimeoutError:
+            self.counters.incr('pending')
+            return key, None
+
+    def _render(self, key, text, language):
+        try:
+            html = render_html(text, language)
+            self.cache.set(key, html)
+            self.counters.incr('rendered')
+            return html
+        except Exception as e:
+            self.counters.incr('errors')
+            if self.logger:
+                self.logger.error(f"Failed to render {language} document: {str(e)}")
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def stop(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            rendering = len(self._pending)
+        return {
+            'cached': len(self.cache),
+            'rendering': rendering,
+            'counters': self.counters.snapshot()
+        }
@@ -0,0 +1,242 @@
+import json
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from difflib import SequenceMatcher
+
+from boto3.dynamodb.conditions import Key
+
+from storage import projection_kwargs
+
+# Notes content is a JSON string, so line breaks inside the text are the
+# two characters "\n". Splitting after either form gives line-sized tokens;
+# the split is lossless, so it does not matter if a split lands mid-escape.
+TOKEN_PATTERN = re.compile(r'(?<=\\n)|(?<=\n)')
+
+
+def tokenize(content):
+    return TOKEN_PATTERN.split(content) if content else []
+
+
+def make_delta(old, new):
+    """Line-level edit script turning ``old`` into ``new``"""
+    old_tokens = tokenize(old)
+    new_tokens = tokenize(new)
+    # A save usually changes a few lines: only match what lies between the unchanged
+    # head and tail, since matching repeated lines across a whole document is slow
+    head = 0
+    shortest = min(len(old_tokens), len(new_tokens))
+    while head < shortest and old_tokens[head] == new_tokens[head]:
+        head += 1
+    tail = 0
+    while tail < shortest - head and old_tokens[-1 - tail] == new_tokens[-1 - tail]:
+        tail += 1
+    
+    ops = [['=', head]] if head else []
+    new_middle = new_tokens[head:len(new_tokens) - tail]
+    matcher = SequenceMatcher(None, old_tokens[head:len(old_tokens) - tail], new_middle, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(['=', i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append(['-', i2 - i1])
+        if j2 > j1:
+            ops.append(['+', ''.join(new_middle[j1:j2])])
+    if tail:
+        ops.append(['=', tail])
+    return ops
+
+
+def apply_delta(content, ops):
+    tokens = tokenize(content)
+    parts = []
+    position = 0
+    for op, value in ops:
+        if op == '=':
+            parts.extend(tokens[position:position + value])
+            position += value
+        elif op == '-':
+            position += value
+        else:
+            parts.append(value)
+    return ''.join(parts)
+
+
+# Characters of a snapshot encoded and compressed at a time
+PACK_SLICE = 64 * 1024
+
+
+def pack(value):
+    if not isinstance(value, str):
+        return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+    # A snapshot is a whole document: JSON-escaping is per character, so slices
+    # can be escaped and compressed one at a time without a full encoded copy
+    compressor = zlib.compressobj()
+    parts = [compressor.compress(b'"')]
+    for start in range(0, len(value), PACK_SLICE):
+        parts.append(compressor.compress(json.dumps(value[start:start + PACK_SLICE])[1:-1].encode('utf-8')))
+    parts.append(compressor.compress(b'"'))
+    parts.append(compressor.flush())
+    return b''.join(parts)
+
+
+def unpack(data):
+    # boto3 hands Binary attributes back wrapped in a Binary object
+    return json.loads(zlib.decompress(getattr(data, 'value', data)).decode('utf-8'))
+
+
+class RevisionNotFound(Exception):
+    pass
+
+
+class RevisionLog:
+    """Append-only revision history per classroom, stored as snapshots plus deltas.
+
+    Every ``snapshot_interval``-th revision stores the whole document; the
+    revisions in between store a compressed line diff against the previous
+    revision. Reading any revision therefore touches one snapshot and at most
+    ``snapshot_interval - 1`` deltas, fetched with a single Query.
+
+    Compaction runs in the background whenever a snapshot is written: deltas
+    older than ``retain`` revisions are dropped (older history stays readable
+    at snapshot granularity) and at most ``max_snapshots`` snapshots are kept.
+    """
+
+    def __init__(self, table, snapshot_interval=50, retain=500, max_snapshots=100, logger=None):
+        self.table = table
+        self.snapshot_interval = snapshot_interval
+        self.retain = retain
+        self.max_snapshots = max_snapshots
+        self.logger = logger
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='revision-compaction')
+
+    def is_snapshot(self, revision):
+        return (revision - 1) % self.snapshot_interval == 0
+
+    def snapshot_for(self, revision):
+        return revision - (revision - 1) % self.snapshot_interval
+
+    def append(self, classroom_id, revision, previous_content, content, user_email):
+        """Record ``revision``, given the content of ``revision - 1`` it replaces.
+
+        ``previous_content`` may only be None at a snapshot revision: a snapshot
+        anywhere else would sit outside every chain, and compaction would never
+        remove it.
+        """
+        if previous_content is None and not self.is_snapshot(revision):
+            raise ValueError(f'Revision {revision} of {classroom_id} needs the content of revision {revision - 1}')
+        item = {
+            'classroom_id': classroom_id,
+            'revision': revision,
+            'user_email': user_email,
+            'created_at': datetime.now().isoformat(),
+            'content_length': len(content)
+        }
+        if self.is_snapshot(revision):
+            item['kind'] = 'snapshot'
+            item['data'] = pack(content)
+        else:
+            item['kind'] = 'delta'
+            item['data'] = pack(make_delta(previous_content, content))
+
+        self.table.put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(#revision)',
+            ExpressionAttributeNames={'#revision': 'revision'}
+        )
+
+        if item['kind'] == 'snapshot' and revision > 1:
+            self.executor.submit(self._compact_safely, classroom_id, revision)
+
+    def stop(self):
+        """Wait for queued compactions to finish"""
+        self.executor.shutdown(wait=True)
+
+    def _query_range(self, classroom_id, start, end, projection=None):
+        kwargs = {
+            'KeyConditionExpression': Key('classroom_id').eq(classroom_id) & Key('revision').between(start, end)
+        }
+        if projection:
+            kwargs.update(projection_kwargs(projection))
+        while True:
+            response = self.table.query(**kwargs)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _load_chain(self, classroom_id, start, end):
+        """Items from the snapshot at or below ``start`` through ``end``, in order"""
+        items = list(self._query_range(classroom_id, self.snapshot_for(start), end))
+        if not items or int(items[0]['revision']) != self.snapshot_for(start) or items[0]['kind'] != 'snapshot':
+            raise RevisionNotFound(f'Revision {start} is no longer available')
+        return items
+
+    def replay(self, classroom_id, start, end):
+        """Yield (item, content) for every revision from ``start`` to ``end``"""
+        content = None
+        expected = None
+        for item in self._load_chain(classroom_id, start, end):
+            revision = int(item['revision'])
+            if expected is not None and revision != expected:
+                raise RevisionNotFound(f'Revision {expected} is no longer available')
+            if item['kind'] == 'snapshot':
+                content = unpack(item['data'])
+            else:
+                content = apply_delta(content, unpack(item['data']))
+            expected = revision + 1
+            if revision >= start:
+                yield item, content
+        if expected is None or expected <= end:
+            raise RevisionNotFound(f'Revision {end} does not exist')
+
+    def get(self, classroom_id, revision):
+        """Content and metadata of a single revision"""
+        for item, content in self.replay(classroom_id, revision, revision):
+            return item, content
+
+    def history(self, classroom_id, limit=50, before=None):
+        """Revision metadata, newest first"""
+        condition = Key('classroom_id').eq(classroom_id)
+        if before is not None:
+            condition = condition & Key('revision').lt(before)
+        response = self.table.query(
+            KeyConditionExpression=condition,
+            ScanIndexForward=False,
+            Limit=limit,
+            **projection_kwargs(['revision', 'kind', 'user_email', 'created_at', 'content_length'])
+        )
+        return response.get('Items', [])
+
+    def delete_all(self, classroom_id):
+        with self.table.batch_writer() as batch:
+            for item in self._query_range(classroom_id, 0, 2 ** 53, projection=['revision']):
+                batch.delete_item(Key={'classroom_id': classroom_id, 'revision': item['revision']})
+
+    def _compact_safely(self, classroom_id, revision):
+        try:
+            self.compact(classroom_id, revision)
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Revision compaction failed for {classroom_id}: {str(e)}")
+
+    def compact(self, classroom_id, latest_snapshot):
+        """Bounded clean-up after ``latest_snapshot`` is written.
+
+        Only the deltas that have just aged out of the retention window and
+        the single oldest snapshot past the cap are touched, so each run
+        costs O(snapshot_interval) regardless of history length.
+        """
+        # Aligned to a snapshot so every revision after the cutoff keeps its full chain
+        cutoff = self.snapshot_for(max(1, latest_snapshot - self.retain))
+        stale_snapshot = latest_snapshot - self.snapshot_interval * self.max_snapshots
+        with self.table.batch_writer() as batch:
+            if cutoff > 1:
+                start = max(1, cutoff - self.snapshot_interval)
+                for item in self._query_range(classroom_id, start, cutoff, projection=['revision', 'kind']):
+                    if item['kind'] == 'delta':
+                        batch.delete_item(Key={'classroom_id': classroom_id, 'revision': item['revision']})
+            if stale_snapshot >= 1:
+                batch.delete_item(Key={'classroom_id': classroom_id, 'revision': stale_snapshot})
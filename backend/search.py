@@ -0,0 +1,419 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from collab import extract_text
+from metrics import Counters
+
+# Identifiers and words; code punctuation never makes a useful search term
+TERM_PATTERN = re.compile(r'[0-9A-Za-z_]+')
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+
+SNIPPETS_PER_RESULT = 3
+SNIPPET_WIDTH = 160
+
+
+def term_counts(text):
+    counts = Counter()
+    for match in TERM_PATTERN.finditer(text or ''):
+        term = match.group().lower()
+        if MIN_TERM_LENGTH <= len(term) <= MAX_TERM_LENGTH:
+            counts[term] += 1
+    return counts
+
+
+def query_terms(query):
+    """Distinct terms of ``query`` in the order typed"""
+    return list(OrderedDict.fromkeys(term_counts(query)))
+
+
+def _prefix_end(prefix):
+    # Smallest string greater than every string starting with ``prefix``
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def snippets(text, terms, limit=SNIPPETS_PER_RESULT, width=SNIPPET_WIDTH):
+    """Up to ``limit`` lines of ``text`` containing one of ``terms``, clipped to ``width`` around the match"""
+    found = []
+    for number, line in enumerate(text.split('\n'), 1):
+        lowered = line.lower()
+        positions = [position for position in (lowered.find(term) for term in terms) if position >= 0]
+        if not positions:
+            continue
+        start = max(0, min(positions) - width // 4)
+        clipped = line[start:start + width].strip()
+        if start > 0:
+            clipped = '…' + clipped
+        if start + width < len(line):
+            clipped += '…'
+        found.append({'line': number, 'text': clipped})
+        if len(found) == limit:
+            break
+    return found
+
+
+class SearchIndex:
+    """Inverted index over classroom notes, kept in a SQLite file.
+
+    The file is shared by every worker process on the host, like the SQLite
+    rate limiter. ``postings`` maps each term to the classrooms containing it,
+    with occurrence counts. ``documents`` holds each classroom's owner, name,
+    version and editor text, so queries are answered, and snippets cut,
+    without touching DynamoDB.
+
+    Re-indexing a document only rewrites the postings whose counts changed,
+    and is skipped altogether unless the item is newer than the indexed row,
+    so a slow worker or a rebuild page cannot put back an older version.
+    """
+
+    # A claimed build not finished within this many seconds is taken over
+    BUILD_CLAIM_TTL = 3600
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS documents ('
+            'classroom_id TEXT PRIMARY KEY, owner TEXT, class_name TEXT, version TEXT, text TEXT NOT NULL)'
+        )
+        if 'revision' not in {row[1] for row in conn.execute('PRAGMA table_info(documents)')}:
+            # Index files from before revisions were tracked
+            conn.execute('ALTER TABLE documents ADD COLUMN revision INTEGER')
+        conn.execute('CREATE INDEX IF NOT EXISTS documents_owner ON documents (owner)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS postings ('
+            'term TEXT NOT NULL, classroom_id TEXT NOT NULL, count INTEGER NOT NULL, '
+            'PRIMARY KEY (term, classroom_id)) WITHOUT ROWID'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS postings_classroom ON postings (classroom_id)')
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def index(self, classroom_id, owner, class_name, text, version=None, revision=None):
+        """Add or update one classroom; returns False if the indexed row is as new or newer"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT version, revision FROM documents WHERE classroom_id = ?', (classroom_id,)
+            ).fetchone()
+            if row and not is_newer(version, revision, *row):
+                conn.execute('COMMIT')
+                return False
+
+            old = dict(conn.execute('SELECT term, count FROM postings WHERE classroom_id = ?', (classroom_id,)))
+            new = term_counts(f'{class_name or ""}\n{text}')
+            conn.executemany(
+                'DELETE FROM postings WHERE term = ? AND classroom_id = ?',
+                [(term, classroom_id) for term in old if term not in new]
+            )
+            conn.executemany(
+                'INSERT OR REPLACE INTO postings (term, classroom_id, count) VALUES (?, ?, ?)',
+                [(term, classroom_id, count) for term, count in new.items() if old.get(term) != count]
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO documents (classroom_id, owner, class_name, version, revision, text) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (classroom_id, owner, class_name, version, revision, text)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return True
+
+    def remove(self, classroom_id):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM postings WHERE classroom_id = ?', (classroom_id,))
+            conn.execute('DELETE FROM documents WHERE classroom_id = ?', (classroom_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def classroom_ids(self):
+        return {row[0] for row in self._connect().execute('SELECT classroom_id FROM documents')}
+
+    def search(self, owner, query, limit=20):
+        """Classrooms of ``owner`` containing every term of ``query``, best first.
+
+        The last term also matches as a prefix, so results follow the user
+        while typing. Scores are tf-idf over the owner's own classrooms.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        conn = self._connect()
+        total = conn.execute('SELECT COUNT(*) FROM documents WHERE owner = ?', (owner,)).fetchone()[0]
+        scores = None
+        for position, term in enumerate(terms):
+            if position == len(terms) - 1:
+                condition, params = 'p.term >= ? AND p.term < ?', (term, _prefix_end(term))
+            else:
+                condition, params = 'p.term = ?', (term,)
+            matches = dict(conn.execute(
+                'SELECT p.classroom_id, SUM(p.count) FROM postings p '
+                'JOIN documents d ON d.classroom_id = p.classroom_id '
+                f'WHERE {condition} AND d.owner = ? GROUP BY p.classroom_id',
+                params + (owner,)
+            ))
+            idf = math.log(1 + total / max(1, len(matches)))
+            term_scores = {classroom_id: (1 + math.log(count)) * idf for classroom_id, count in matches.items()}
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {classroom_id: score + term_scores[classroom_id]
+                          for classroom_id, score in scores.items() if classroom_id in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda entry: entry[1], reverse=True)[:limit]
+        results = []
+        for classroom_id, score in ranked:
+            class_name, version, text = conn.execute(
+                'SELECT class_name, version, text FROM documents WHERE classroom_id = ?', (classroom_id,)
+            ).fetchone()
+            results.append({
+                'classroom_id': classroom_id,
+                'class_name': class_name,
+                'last_updated': version,
+                'score': round(score, 3),
+                'snippets': snippets(text, terms)
+            })
+        return results
+
+    def claim_build(self):
+        """True for the one process that should build the index.
+
+        That is the first to ask about a new index file, or the first after a
+        build was released or claimed more than ``BUILD_CLAIM_TTL`` seconds ago
+        without finishing.
+        """
+        conn = self._connect()
+        now = time.time()
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'built_at'").fetchone():
+            return False
+        cursor = conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('build_claimed_at', ?)", (str(now),))
+        if cursor.rowcount == 1:
+            return True
+        cursor = conn.execute(
+            "UPDATE meta SET value = ? WHERE key = 'build_claimed_at' AND CAST(value AS REAL) < ?",
+            (str(now), now - self.BUILD_CLAIM_TTL)
+        )
+        return cursor.rowcount == 1
+
+    def finish_build(self):
+        self._connect().execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built_at', ?)", (str(time.time()),))
+
+    def release_build(self):
+        """Let the next process to start claim the build again"""
+        self._connect().execute("DELETE FROM meta WHERE key = 'build_claimed_at'")
+
+    def stats(self):
+        conn = self._connect()
+        return {
+            'path': self.path,
+            'documents': conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0],
+            'postings': conn.execute('SELECT COUNT(*) FROM postings').fetchone()[0]
+        }
+
+
+def is_newer(version, revision, indexed_version, indexed_revision):
+    """Whether an item at ``version``/``revision`` replaces the indexed row.
+
+    Revisions decide when both sides have one, then ``last_updated``
+    timestamps; anything that cannot be ordered is re-indexed unless the
+    versions are equal.
+    """
+    if revision is not None and indexed_revision is not None:
+        return revision > indexed_revision
+    if version and indexed_version:
+        # Legacy items carry a numeric timestamp, current ones an ISO last_updated
+        for parse in (float, datetime.fromisoformat):
+            try:
+                return parse(version) > parse(indexed_version)
+            except ValueError:
+                continue
+    return not (version and version == indexed_version)
+
+
+def item_version(item):
+    # Legacy /api/update_notes items carry a timestamp instead of last_updated
+    version = item.get('last_updated') or item.get('timestamp')
+    return str(version) if version is not None else None
+
+
+class SearchIndexer:
+    """Applies notes changes to a SearchIndex on a background thread.
+
+    Saves pass the stored item along; changes known only by key (from the
+    change feed or another node) are read back through ``load`` when their
+    turn comes. Several changes to one classroom waiting in the queue
+    collapse into the latest, so bursts of saves cost one re-index.
+
+    ``scan`` yields pages of every notes item and is used to build the index
+    from scratch: on start-up when the index file is new, or on request.
+    """
+
+    REMOVE = object()
+
+    def __init__(self, index, load, scan, logger=None):
+        self.index = index
+        self.load = load
+        self.scan = scan
+        self.logger = logger
+        self.counters = Counters()
+        # classroom id -> item to index, None to re-read it, or REMOVE
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._rebuild = False
+        # Whether this process claimed the first build of the index file
+        self._claimed = False
+        self._thread = None
+
+    def update(self, item):
+        self._submit(item['classroom_id'], item)
+
+    def refresh(self, classroom_id):
+        self._submit(classroom_id, None)
+
+    def remove(self, classroom_id):
+        self._submit(classroom_id, self.REMOVE)
+
+    def request_rebuild(self):
+        with self._lock:
+            self._rebuild = True
+        self._wake.set()
+
+    def _submit(self, classroom_id, entry):
+        with self._lock:
+            self._pending.pop(classroom_id, None)
+            self._pending[classroom_id] = entry
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='search-index', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the background thread, then apply what is still queued so no change is lost"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.drain()
+
+    def _run(self):
+        try:
+            self._claimed = self.index.claim_build()
+            if self._claimed:
+                self.request_rebuild()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Search index unavailable: {str(e)}")
+            return
+
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            with self._lock:
+                rebuild, self._rebuild = self._rebuild, False
+            if rebuild:
+                self._run_rebuild()
+            self.drain()
+
+    def drain(self):
+        """Apply every queued change; returns the classroom ids handled"""
+        handled = set()
+        while True:
+            with self._lock:
+                if not self._pending:
+                    return handled
+                classroom_id, entry = self._pending.popitem(last=False)
+            handled.add(classroom_id)
+            try:
+                if entry is None:
+                    entry = self.load(classroom_id) or self.REMOVE
+                if entry is self.REMOVE:
+                    self.index.remove(classroom_id)
+                    self.counters.incr('removed')
+                else:
+                    self._index_item(entry)
+            except Exception as e:
+                self.counters.incr('errors')
+                if self.logger:
+                    self.logger.error(f"Failed to index {classroom_id}: {str(e)}")
+
+    def _index_item(self, item):
+        indexed = self.index.index(
+            item['classroom_id'],
+            item.get('user_email'),
+            item.get('class_name'),
+            extract_text(item.get('content')),
+            item_version(item),
+            int(item['revision']) if item.get('revision') is not None else None
+        )
+        self.counters.incr('indexed' if indexed else 'unchanged')
+
+    def _run_rebuild(self):
+        started = time.monotonic()
+        seen = set()
+        try:
+            for items in self.scan():
+                for item in items:
+                    self._index_item(item)
+                    seen.add(item['classroom_id'])
+                # Changes queued meanwhile are newer than the page just indexed
+                seen |= self.drain()
+            for classroom_id in self.index.classroom_ids() - seen:
+                self.index.remove(classroom_id)
+        except Exception as e:
+            self.counters.incr('errors')
+            if self.logger:
+                self.logger.error(f"Search index rebuild failed: {str(e)}")
+            if self._claimed:
+                # Leave the first build to the next process that starts, instead of never
+                self._release_claim()
+            return
+        self.index.finish_build()
+        self._claimed = False
+        self.counters.incr('rebuilds')
+        if self.logger:
+            self.logger.info(f"Search index rebuilt: {len(seen)} classrooms in {time.monotonic() - started:.1f}s")
+
+    def _release_claim(self):
+        self._claimed = False
+        try:
+            self.index.release_build()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Could not release the search index build: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return dict(self.index.stats(), pending=pending, counters=self.counters.snapshot())
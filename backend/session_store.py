@@ -0,0 +1,314 @@
+import secrets
+import threading
+import time
+
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface, SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+from cache import MISSING, TTLCache
+
+
+class SessionTimer:
+    """Accumulates how long session decoding takes so the per-request auth cost is visible"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.count += 1
+            self.total += elapsed
+
+    def stats(self):
+        return {
+            'opened': self.count,
+            'avg_open_ms': round(self.total * 1000 / self.count, 4) if self.count else 0.0
+        }
+
+
+class CachedCookieSession(SecureCookieSession):
+    # Time the cookie was signed; None for sessions that have never been issued
+    issued_at = None
+
+
+class CachedCookieSessionInterface(SecureCookieSessionInterface):
+    """Signed-cookie sessions that remember already-verified cookies.
+
+    A verified cookie value maps to its decoded payload in a small TTL cache,
+    so polling requests skip the HMAC check and JSON decode. Cookies are only
+    re-signed when the session changes or is older than ``refresh_interval``.
+    """
+
+    session_class = CachedCookieSession
+
+    def __init__(self, maxsize=4096, ttl=60, refresh_interval=300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.refresh_interval = refresh_interval
+        self.timer = SessionTimer()
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        try:
+            return self._open_session(app, request)
+        finally:
+            self.timer.record(started)
+
+    def _open_session(self, app, request):
+        val = request.cookies.get(self.get_cookie_name(app))
+        if not val:
+            return self.session_class()
+
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        cached = self.cache.get(val)
+        if cached is not MISSING:
+            data, issued_at = cached
+            if time.time() - issued_at <= max_age:
+                return self._make_session(data, issued_at)
+            self.cache.delete(val)
+
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        try:
+            data, issued_at = s.loads(val, max_age=max_age, return_timestamp=True)
+        except BadSignature:
+            return self.session_class()
+
+        issued_at = issued_at.timestamp()
+        self._remember(val, data, issued_at, max_age)
+        return self._make_session(data, issued_at)
+
+    def _make_session(self, data, issued_at):
+        session = self.session_class(data)
+        session.issued_at = issued_at
+        return session
+
+    def _remember(self, val, data, issued_at, max_age):
+        remaining = issued_at + max_age - time.time()
+        if remaining > 0:
+            self.cache.set(val, (dict(data), issued_at), ttl=min(self.cache.ttl, remaining))
+
+    def should_set_cookie(self, app, session):
+        if session.modified or session.issued_at is None:
+            return True
+        if not (session.permanent and app.config['SESSION_REFRESH_EACH_REQUEST']):
+            return False
+        # Re-signing on every poll defeats the cache, so only refresh stale cookies
+        return time.time() - session.issued_at >= self.refresh_interval
+
+    def save_session(self, app, session, response):
+        if not session or not self.should_set_cookie(app, session):
+            return super().save_session(app, session, response)
+
+        name = self.get_cookie_name(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        issued_at = time.time()
+        val = self.get_signing_serializer(app).dumps(dict(session))
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        # The next request presents this exact value, so prime the cache with it
+        self._remember(val, session, issued_at, max_age)
+        response.set_cookie(
+            name,
+            val,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=self.get_cookie_domain(app),
+            path=self.get_cookie_path(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def revoke_user(self, email):
+        """Signed cookies cannot be recalled; this only forgets cached copies and returns None"""
+        self.cache.delete_where(lambda entry: entry[0].get('user') == email)
+        return None
+
+    def stats(self):
+        return {'backend': 'cookie', 'cache': self.cache.stats(), **self.timer.stats()}
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, refreshed_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.refreshed_at = refreshed_at
+        self.modified = False
+        self.accessed = False
+
+
+class LocalSessionBackend:
+    """In-process session store.
+
+    Each gunicorn worker would hold its own copy, so ``create_session_interface``
+    refuses it with more than one worker process; anything exposing the same
+    ``get``/``set``/``delete``/``delete_user`` methods can replace it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at <= time.time():
+                del self._sessions[sid]
+                return None
+            return dict(data)
+
+    def set(self, sid, data, lifetime):
+        with self._lock:
+            self._sessions[sid] = (time.time() + lifetime, dict(data))
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def delete_user(self, email):
+        with self._lock:
+            revoked = [sid for sid, (_, data) in self._sessions.items() if data.get('user') == email]
+            for sid in revoked:
+                del self._sessions[sid]
+        return revoked
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Sessions kept in a backend store; the cookie only carries a signed session id.
+
+    Verified ids and their payloads are cached for ``ttl`` seconds, so a
+    revocation takes effect within that window on every worker sharing the
+    backend, without a DynamoDB read per request.
+    """
+
+    salt = 'server-session'
+
+    def __init__(self, backend=None, maxsize=4096, ttl=60, refresh_interval=300):
+        self.backend = backend or LocalSessionBackend()
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.refresh_interval = refresh_interval
+        self.timer = SessionTimer()
+
+    def get_signer(self, app):
+        if not app.secret_key:
+            return None
+        return Signer(app.secret_key, salt=self.salt, key_derivation='hmac')
+
+    def open_session(self, app, request):
+        started = time.perf_counter()
+        try:
+            return self._open_session(app, request)
+        finally:
+            self.timer.record(started)
+
+    def _open_session(self, app, request):
+        signer = self.get_signer(app)
+        if signer is None:
+            return None
+
+        val = request.cookies.get(self.get_cookie_name(app))
+        if val:
+            cached = self.cache.get(val)
+            if cached is not MISSING:
+                sid, data, refreshed_at = cached
+                return ServerSideSession(data, sid=sid, refreshed_at=refreshed_at)
+            try:
+                sid = signer.unsign(val).decode('utf-8')
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.backend.get(sid)
+                if data is not None:
+                    self.cache.set(val, (sid, data, None))
+                    return ServerSideSession(data, sid=sid)
+
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        val = self.get_signer(app).sign(session.sid).decode('utf-8')
+
+        if not session:
+            if session.modified:
+                self.revoke(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite)
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if not (session.modified or session.new or self.should_set_cookie(app, session)):
+            return
+        # Either the payload changed or the expiry is being pushed forward
+        self.backend.set(session.sid, dict(session), lifetime)
+        self.cache.set(val, (session.sid, dict(session), time.time()))
+
+        response.set_cookie(
+            name,
+            val,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite
+        )
+
+    def should_set_cookie(self, app, session):
+        if not super().should_set_cookie(app, session):
+            return False
+        if session.modified or session.refreshed_at is None:
+            return True
+        return time.time() - session.refreshed_at >= self.refresh_interval
+
+    def revoke(self, sid):
+        self.backend.delete(sid)
+        self.cache.delete_where(lambda entry: entry[0] == sid)
+
+    def revoke_user(self, email):
+        """End every session of ``email``; returns how many there were"""
+        revoked = self.backend.delete_user(email)
+        for sid in revoked:
+            self.cache.delete_where(lambda entry, sid=sid: entry[0] == sid)
+        return len(revoked)
+
+    def stats(self):
+        return {'backend': 'server', 'cache': self.cache.stats(), **self.timer.stats()}
+
+
+def create_session_interface(config):
+    """Build the session interface selected by ``SESSION_BACKEND``"""
+    if config.get('SESSION_BACKEND') == 'server':
+        if config.get('WORKER_PROCESSES', 1) > 1:
+            raise RuntimeError(
+                f"SESSION_BACKEND=server keeps sessions in process memory and cannot serve "
+                f"{config['WORKER_PROCESSES']} worker processes; use one worker or SESSION_BACKEND=cookie"
+            )
+        return ServerSideSessionInterface(
+            maxsize=config['SESSION_CACHE_SIZE'],
+            ttl=config['SESSION_CACHE_TTL'],
+            refresh_interval=config['SESSION_REFRESH_INTERVAL']
+        )
+    return CachedCookieSessionInterface(
+        maxsize=config['SESSION_CACHE_SIZE'],
+        ttl=config['SESSION_CACHE_TTL'],
+        refresh_interval=config['SESSION_REFRESH_INTERVAL']
+    )
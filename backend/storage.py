@@ -0,0 +1,170 @@
+import random
+import time
+
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+
+from metrics import Counters
+
+# DynamoDB rejects BatchGetItem requests with more than 100 keys
+BATCH_GET_LIMIT = 100
+
+
+def backoff_delay(attempt, base=0.05, cap=2.0):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class UnprocessedKeys(RuntimeError):
+    """Keys BatchGetItem still had not processed after every retry.
+
+    ``results`` holds what was read, as batch_get_items would have
+    returned it, without the ``pending`` key values.
+    """
+
+    def __init__(self, results, pending, max_retries):
+        super().__init__(f"BatchGetItem left {len(pending)} keys unprocessed after {max_retries} retries")
+        self.results = results
+        self.pending = pending
+
+
+def batch_get_items(dynamodb, table_name, key_name, key_values, max_retries=5):
+    """Fetch many items by partition key, retrying any UnprocessedKeys.
+
+    Returns a dict mapping each requested key value to its item, or None
+    when the item does not exist. Raises UnprocessedKeys, carrying the
+    items that were read, if some keys stay unprocessed.
+    """
+    results = {value: None for value in key_values}
+    unique = list(results)
+    pending = []
+
+    for start in range(0, len(unique), BATCH_GET_LIMIT):
+        request_items = {
+            table_name: {
+                'Keys': [{key_name: value} for value in unique[start:start + BATCH_GET_LIMIT]]
+            }
+        }
+        attempt = 0
+        while request_items:
+            response = dynamodb.batch_get_item(RequestItems=request_items)
+            for item in response.get('Responses', {}).get(table_name, []):
+                results[item[key_name]] = item
+
+            request_items = response.get('UnprocessedKeys') or {}
+            if request_items:
+                if attempt >= max_retries:
+                    # Give up on these keys, but still read the remaining chunks
+                    pending.extend(key[key_name] for key in request_items[table_name]['Keys'])
+                    break
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    if pending:
+        for value in pending:
+            results.pop(value, None)
+        raise UnprocessedKeys(results, pending, max_retries)
+    return results
+
+
+def projection_kwargs(attributes):
+    """ProjectionExpression with every name aliased, sidestepping DynamoDB reserved words"""
+    names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+    return {'ProjectionExpression': ', '.join(names), 'ExpressionAttributeNames': names}
+
+
+def scan_pages(table, page_size=100, projection=None, start_key=None):
+    """Yield (items, last_evaluated_key) one Scan page at a time.
+
+    Only one page is held in memory; the key is None after the last page.
+    """
+    kwargs = {'Limit': page_size}
+    if projection:
+        kwargs.update(projection_kwargs(projection))
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    while True:
+        response = table.scan(**kwargs)
+        last_key = response.get('LastEvaluatedKey')
+        yield response.get('Items', []), last_key
+        if not last_key:
+            return
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+# Error codes DynamoDB returns when a table or account is over its throughput
+THROTTLE_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded'
+}
+
+
+def is_throttle_error(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+
+
+def client_config(retry_mode='adaptive', max_attempts=5):
+    """Botocore config for the DynamoDB client.
+
+    The 'adaptive' retry mode adds a client-side token bucket that slows
+    requests down as soon as DynamoDB starts throttling, on top of backoff.
+    """
+    return BotoConfig(retries={'mode': retry_mode, 'max_attempts': max_attempts})
+
+
+def capacity_settings(billing_mode, read_capacity=5, write_capacity=5):
+    """Keyword arguments for create_table, and for each GSI, in the chosen billing mode"""
+    if billing_mode == 'PAY_PER_REQUEST':
+        return {'BillingMode': 'PAY_PER_REQUEST'}, {}
+    throughput = {
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': read_capacity,
+            'WriteCapacityUnits': write_capacity
+        }
+    }
+    return {'BillingMode': 'PROVISIONED', **throughput}, throughput
+
+
+class CapacityTelemetry:
+    """Consumed capacity and throttling per DynamoDB operation, collected from botocore events.
+
+    Hooks into the client itself, so every call made through the resource is
+    counted without changes at the call sites.
+    """
+
+    def __init__(self):
+        self.counters = Counters()
+
+    def install(self, client):
+        events = client.meta.events
+        events.register('provide-client-params.dynamodb.*', self._request_capacity)
+        events.register('after-call.dynamodb.*', self._record_call)
+        events.register('needs-retry.dynamodb.*', self._record_attempt)
+
+    def _request_capacity(self, params, model, **kwargs):
+        if 'ReturnConsumedCapacity' in model.input_shape.members:
+            params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+    def _record_call(self, parsed, model, **kwargs):
+        operation = model.name
+        self.counters.incr(f'{operation}.calls')
+
+        consumed = parsed.get('ConsumedCapacity') or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+        for entry in consumed:
+            units = entry.get('CapacityUnits', 0)
+            self.counters.incr(f'{operation}.capacity_units', units)
+            self.counters.incr(f"table.{entry.get('TableName')}.capacity_units", units)
+
+        if parsed.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            self.counters.incr(f'{operation}.throttled')
+
+    def _record_attempt(self, response, operation, **kwargs):
+        # Called for every attempt, including the ones botocore retries internally
+        if response and response[1].get('Error', {}).get('Code') in THROTTLE_ERROR_CODES:
+            self.counters.incr(f'{operation.name}.throttled_attempts')
+
+    def stats(self):
+        return self.counters.snapshot()
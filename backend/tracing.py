@@ -0,0 +1,310 @@
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from metrics import Counters
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class Trace:
+    """Timings of one request: total time plus the time spent in each named span"""
+
+    __slots__ = ('method', 'path', 'started', 'spans', 'status')
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        # name -> [count, seconds]
+        self.spans = {}
+        self.status = None
+
+    def add(self, name, seconds):
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+    def breakdown(self, total):
+        spans = {name: {'count': count, 'ms': round(seconds * 1000, 2)} for name, (count, seconds) in self.spans.items()}
+        # Whatever no span covered: routing, view code, response building
+        accounted = sum(seconds for _, seconds in self.spans.values())
+        spans['other'] = {'count': 1, 'ms': round(max(0.0, total - accounted) * 1000, 2)}
+        return spans
+
+
+class Tracer:
+    """Opt-in per-request timing spans with a slow-request log.
+
+    ``wrap_wsgi`` starts a trace for a ``sample_rate`` fraction of requests.
+    Code inside the request marks spans with ``with tracer.span('storage'):``;
+    outside a traced request ``span`` returns a shared no-op, so disabled
+    tracing costs one thread-local lookup per span. Spans should not nest,
+    since the breakdown adds their times up.
+
+    Requests slower than ``slow_ms`` are logged with their breakdown and the
+    last ``history`` of them kept for inspection. Traced responses carry a
+    Server-Timing header, which browser dev tools display per request.
+    """
+
+    def __init__(self, enabled=False, sample_rate=1.0, slow_ms=500, history=100, logger=None):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.logger = logger
+        self.counters = Counters()
+        self.slow = deque(maxlen=history)
+        self._local = threading.local()
+
+    def current(self):
+        return getattr(self._local, 'trace', None)
+
+    def span(self, name):
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return _NO_SPAN
+        return _Span(trace, name)
+
+    def install_storage_spans(self, client):
+        """Time every DynamoDB call made by ``client`` as a ``storage.<Operation>`` span"""
+        events = client.meta.events
+        events.register('before-call.dynamodb.*', self._storage_started)
+        events.register('after-call.dynamodb.*', self._storage_finished)
+        events.register('after-call-error.dynamodb.*', self._storage_finished)
+
+    def _storage_started(self, context, **kwargs):
+        if self.current() is not None:
+            context['trace_started'] = time.perf_counter()
+
+    def _storage_finished(self, context, event_name, **kwargs):
+        trace = self.current()
+        started = context.get('trace_started')
+        if trace is not None and started is not None:
+            # after-call and after-call-error both end in the operation name
+            trace.add(f"storage.{event_name.rsplit('.', 1)[-1]}", time.perf_counter() - started)
+
+    def install_session_spans(self, interface):
+        """Time session loading (cookie verification or store lookup) as ``auth``"""
+        open_session = interface.open_session
+        save_session = interface.save_session
+
+        def traced_open_session(app, request):
+            with self.span('auth'):
+                return open_session(app, request)
+
+        def traced_save_session(app, session, response):
+            with self.span('auth.save'):
+                return save_session(app, session, response)
+
+        interface.open_session = traced_open_session
+        interface.save_session = traced_save_session
+
+    def json_encoder(self, base):
+        """Subclass of the JSON encoder ``base`` timing each encode as ``serialize``"""
+        tracer = self
+
+        class TracedJSONEncoder(base):
+            def encode(self, o):
+                with tracer.span('serialize'):
+                    return super().encode(o)
+
+        return TracedJSONEncoder
+
+    def wrap_wsgi(self, wsgi_app):
+        """WSGI middleware opening and closing a trace around each sampled request"""
+        def traced_app(environ, start_response):
+            if not self.enabled or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+                return wsgi_app(environ, start_response)
+
+            trace = Trace(environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'))
+            self._local.trace = trace
+
+            def traced_start_response(status, headers, exc_info=None):
+                trace.status = int(status.split(' ', 1)[0])
+                headers.append(('Server-Timing', self._server_timing(trace)))
+                return start_response(status, headers, exc_info)
+
+            try:
+                return wsgi_app(environ, traced_start_response)
+            finally:
+                # Streamed bodies keep running after this point and are not part of the trace
+                self._local.trace = None
+                self._finish(trace)
+        return traced_app
+
+    def _server_timing(self, trace):
+        total = time.perf_counter() - trace.started
+        parts = [f'{name.replace(".", "-")};dur={seconds * 1000:.2f}' for name, (_, seconds) in trace.spans.items()]
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+    def _finish(self, trace):
+        total = time.perf_counter() - trace.started
+        self.counters.incr('traced')
+        if total * 1000 < self.slow_ms:
+            return
+
+        self.counters.incr('slow')
+        record = {
+            'method': trace.method,
+            'path': trace.path,
+            'status': trace.status,
+            'total_ms': round(total * 1000, 2),
+            'spans': trace.breakdown(total),
+            'at': time.time()
+        }
+        self.slow.append(record)
+        if self.logger:
+            self.logger.warning(f"Slow request: {json.dumps(record)}")
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'sample_rate': self.sample_rate,
+            'slow_ms': self.slow_ms,
+            'counters': self.counters.snapshot(),
+            'slow': list(self.slow)
+        }
+
+
+# Leaf frames of threads parked waiting for work; left out unless asked for
+IDLE_FRAMES = {
+    ('wait', 'threading.py'),
+    ('select', 'selectors.py'),
+    ('accept', 'socket.py'),
+    ('readinto', 'socket.py'),
+    ('get', 'queue.py'),
+    ('_worker', 'thread.py')
+}
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling the stacks of every thread in this process.
+
+    A profile runs on its own thread, so with synchronous gunicorn workers
+    the request that starts it returns at once and the worker goes on
+    serving the traffic being profiled. Results are written as JSON to
+    ``directory`` (one file per profile, shared by the workers) with
+    collapsed stacks ("outer;inner;leaf count", the input format of
+    flamegraph tools) and the frames most often on top of a stack.
+    """
+
+    def __init__(self, directory, keep=20, logger=None):
+        self.directory = directory
+        self.keep = keep
+        self.logger = logger
+        self._lock = threading.Lock()
+        self._running = None
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, seconds, interval=0.005, include_idle=False):
+        """Start profiling this process; returns the result file name, or None if one is running"""
+        with self._lock:
+            if self._running:
+                return None
+            name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.json"
+            self._running = name
+        threading.Thread(
+            target=self._run, args=(name, seconds, interval, include_idle), name='profiler', daemon=True
+        ).start()
+        return name
+
+    def _run(self, name, seconds, interval, include_idle):
+        try:
+            result = self._sample(seconds, interval, include_idle)
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, name)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(result, f)
+            os.replace(path + '.tmp', path)
+            for old in self.profiles()[self.keep:]:
+                os.remove(os.path.join(self.directory, old))
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Profile {name} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._running = None
+
+    def _sample(self, seconds, interval, include_idle):
+        stacks = Counter()
+        leaves = Counter()
+        own_thread = threading.get_ident()
+        samples = 0
+        started = time.time()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                leaf = (frame.f_code.co_name, os.path.basename(frame.f_code.co_filename))
+                if not include_idle and leaf in IDLE_FRAMES:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                leaves[names[0]] += 1
+                stacks[';'.join(reversed(names))] += 1
+            samples += 1
+            time.sleep(interval)
+
+        return {
+            'pid': os.getpid(),
+            'started_at': started,
+            'seconds': seconds,
+            'interval': interval,
+            'samples': samples,
+            'top': [{'frame': name, 'samples': count} for name, count in leaves.most_common(25)],
+            'collapsed': '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
+        }
+
+    def profiles(self):
+        """Names of the finished profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory) if name.startswith('profile-') and name.endswith('.json')]
+        return sorted(names, reverse=True)
+
+    def load(self, name):
+        """A finished profile by file name, or None"""
+        if name not in self.profiles():
+            return None
+        with open(os.path.join(self.directory, name)) as f:
+            return json.load(f)
@@ -0,0 +1,406 @@
+// Collaborative editing client for /api/collab. Operations use the same format
+// as the server: positive numbers retain, negative numbers delete and strings
+// insert. Lengths are UTF-16 code units, which is what JavaScript and Monaco use.
+const CollabOT = {
+    isRetain: (c) => typeof c === 'number' && c > 0,
+    isDelete: (c) => typeof c === 'number' && c < 0,
+    isInsert: (c) => typeof c === 'string',
+
+    append(op, c) {
+        if (c === 0 || c === '') return op;
+        const last = op[op.length - 1];
+        if (this.isInsert(c)) {
+            if (this.isInsert(last)) {
+                op[op.length - 1] = last + c;
+                return op;
+            }
+            if (this.isDelete(last)) {
+                // Keep inserts before deletes so equivalent operations look the same
+                if (op.length > 1 && this.isInsert(op[op.length - 2])) {
+                    op[op.length - 2] += c;
+                } else {
+                    op.splice(op.length - 1, 0, c);
+                }
+                return op;
+            }
+        } else if (last !== undefined && !this.isInsert(last) && (last > 0) === (c > 0)) {
+            op[op.length - 1] = last + c;
+            return op;
+        }
+        op.push(c);
+        return op;
+    },
+
+    // Split a retain or delete, returning what is left after consuming `length`
+    consume(c, length) {
+        const remaining = Math.abs(c) - length;
+        if (!remaining) return undefined;
+        return c > 0 ? remaining : -remaining;
+    },
+
+    transform(a, b) {
+        const aPrime = [];
+        const bPrime = [];
+        let i = 0, j = 0;
+        let op1 = a[i++], op2 = b[j++];
+        while (op1 !== undefined || op2 !== undefined) {
+            if (this.isInsert(op1)) {
+                this.append(aPrime, op1);
+                this.append(bPrime, op1.length);
+                op1 = a[i++];
+                continue;
+            }
+            if (this.isInsert(op2)) {
+                this.append(aPrime, op2.length);
+                this.append(bPrime, op2);
+                op2 = b[j++];
+                continue;
+            }
+            if (op1 === undefined || op2 === undefined) {
+                throw new Error('Operations are not compatible');
+            }
+            let length;
+            if (this.isRetain(op1) && this.isRetain(op2)) {
+                length = Math.min(op1, op2);
+                this.append(aPrime, length);
+                this.append(bPrime, length);
+            } else if (this.isDelete(op1) && this.isDelete(op2)) {
+                length = Math.min(-op1, -op2);
+            } else if (this.isDelete(op1)) {
+                length = Math.min(-op1, op2);
+                this.append(aPrime, -length);
+            } else {
+                length = Math.min(op1, -op2);
+                this.append(bPrime, -length);
+            }
+            op1 = this.consume(op1, length);
+            if (op1 === undefined) op1 = a[i++];
+            op2 = this.consume(op2, length);
+            if (op2 === undefined) op2 = b[j++];
+        }
+        return [aPrime, bPrime];
+    },
+
+    apply(text, op) {
+        let result = '';
+        let index = 0;
+        op.forEach((c) => {
+            if (this.isRetain(c)) {
+                result += text.slice(index, index + c);
+                index += c;
+            } else if (this.isInsert(c)) {
+                result += c;
+            } else {
+                index -= c;
+            }
+        });
+        return result;
+    },
+
+    // Single-region operation turning oldText into newText (common prefix and suffix kept)
+    diff(oldText, newText) {
+        let prefix = 0;
+        const limit = Math.min(oldText.length, newText.length);
+        while (prefix < limit && oldText[prefix] === newText[prefix]) prefix++;
+        let suffix = 0;
+        while (suffix < limit - prefix && oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]) suffix++;
+
+        const op = [];
+        this.append(op, prefix);
+        this.append(op, newText.slice(prefix, newText.length - suffix));
+        this.append(op, -(oldText.length - suffix - prefix));
+        this.append(op, suffix);
+        return op;
+    },
+
+    compose(a, b) {
+        const result = [];
+        let i = 0, j = 0;
+        let op1 = a[i++], op2 = b[j++];
+        while (op1 !== undefined || op2 !== undefined) {
+            if (this.isDelete(op1)) {
+                this.append(result, op1);
+                op1 = a[i++];
+                continue;
+            }
+            if (this.isInsert(op2)) {
+                this.append(result, op2);
+                op2 = b[j++];
+                continue;
+            }
+            if (op1 === undefined || op2 === undefined) {
+                throw new Error('Operations cannot be composed');
+            }
+            if (this.isRetain(op1) && this.isRetain(op2)) {
+                const length = Math.min(op1, op2);
+                this.append(result, length);
+                op1 = this.consume(op1, length);
+                op2 = this.consume(op2, length);
+            } else if (this.isInsert(op1) && this.isDelete(op2)) {
+                const length = Math.min(op1.length, -op2);
+                op1 = op1.length > length ? op1.slice(length) : undefined;
+                op2 = this.consume(op2, length);
+            } else if (this.isInsert(op1)) {
+                const length = Math.min(op1.length, op2);
+                this.append(result, op1.slice(0, length));
+                op1 = op1.length > length ? op1.slice(length) : undefined;
+                op2 = this.consume(op2, length);
+            } else {
+                const length = Math.min(op1, -op2);
+                this.append(result, -length);
+                op1 = this.consume(op1, length);
+                op2 = this.consume(op2, length);
+            }
+            if (op1 === undefined) op1 = a[i++];
+            if (op2 === undefined) op2 = b[j++];
+        }
+        return result;
+    }
+};
+
+class CollabSession {
+    constructor(editor, classId, { query = '', readOnly = false, pollInterval = 1000, onRemoteChange = null } = {}) {
+        this.editor = editor;
+        this.classId = classId;
+        this.query = query;
+        this.readOnly = readOnly;
+        this.pollInterval = pollInterval;
+        this.onRemoteChange = onRemoteChange;
+        this.revision = 0;
+        // Revisions are only meaningful within the epoch of the server's copy we joined
+        this.epoch = null;
+        // The server's text at this.revision, to rebase local edits on after a resync
+        this.serverText = '';
+        this.clientId = null;
+        // Sent and waiting for the server's acknowledgement
+        this.outstanding = null;
+        // Local edits made while waiting, sent after the acknowledgement
+        this.buffer = null;
+        this.applyingRemote = false;
+        this.stopped = false;
+        this.timer = null;
+        this.changeListener = null;
+    }
+
+    url(path) {
+        return `/api/collab/${this.classId}/${path}${this.query}`;
+    }
+
+    async start() {
+        const response = await fetch(this.url('join'), { method: 'POST', credentials: 'include' });
+        if (!response.ok) {
+            throw new Error('Failed to join collaborative session');
+        }
+        const data = await response.json();
+        this.clientId = data.client_id;
+        this.resync(data.revision, data.text, data.epoch);
+
+        if (!this.readOnly) {
+            this.changeListener = this.editor.onDidChangeModelContent((e) => this.onLocalChange(e));
+        }
+        this.schedule(0);
+    }
+
+    stop() {
+        this.stopped = true;
+        if (this.timer) clearTimeout(this.timer);
+        if (this.changeListener) this.changeListener.dispose();
+    }
+
+    pending() {
+        if (this.outstanding === null) return null;
+        if (this.buffer === null) return this.outstanding;
+        return CollabOT.compose(this.outstanding, this.buffer);
+    }
+
+    resync(revision, text, epoch) {
+        const pending = this.pending();
+        this.revision = revision;
+        this.epoch = epoch;
+        this.outstanding = null;
+        this.buffer = null;
+        const model = this.editor.getModel();
+        model.setEOL(monaco.editor.EndOfLineSequence.LF);
+        if (pending !== null) {
+            // E.g. the server was reloaded: rebase the edits it never acknowledged instead of dropping them
+            const [rebased, remote] = CollabOT.transform(pending, CollabOT.diff(this.serverText, text));
+            this.serverText = text;
+            this.applyToModel(remote);
+            this.outstanding = rebased;
+            return;
+        }
+        this.serverText = text;
+        if (model.getValue() !== text) {
+            this.applyingRemote = true;
+            try {
+                model.setValue(text);
+            } finally {
+                this.applyingRemote = false;
+            }
+        }
+    }
+
+    onLocalChange(e) {
+        if (this.applyingRemote) return;
+
+        const model = this.editor.getModel();
+        const changes = [...e.changes].sort((a, b) => a.rangeOffset - b.rangeOffset);
+        let lengthBefore = model.getValueLength();
+        changes.forEach((change) => {
+            lengthBefore += change.rangeLength - change.text.length;
+        });
+
+        const op = [];
+        let position = 0;
+        changes.forEach((change) => {
+            CollabOT.append(op, change.rangeOffset - position);
+            CollabOT.append(op, change.text);
+            CollabOT.append(op, -change.rangeLength);
+            position = change.rangeOffset + change.rangeLength;
+        });
+        CollabOT.append(op, lengthBefore - position);
+
+        if (this.outstanding === null) {
+            this.outstanding = op;
+            this.schedule(0);
+        } else if (this.buffer === null) {
+            this.buffer = op;
+        } else {
+            this.buffer = CollabOT.compose(this.buffer, op);
+        }
+    }
+
+    applyRemote(op) {
+        this.serverText = CollabOT.apply(this.serverText, op);
+        if (this.outstanding !== null) {
+            [this.outstanding, op] = CollabOT.transform(this.outstanding, op);
+        }
+        if (this.buffer !== null) {
+            [this.buffer, op] = CollabOT.transform(this.buffer, op);
+        }
+        this.applyToModel(op);
+        this.revision += 1;
+    }
+
+    applyToModel(op) {
+        const model = this.editor.getModel();
+        const edits = [];
+        let index = 0;
+        let pendingInsert = null;
+        const rangeAt = (start, end) => {
+            const from = model.getPositionAt(start);
+            const to = model.getPositionAt(end);
+            return new monaco.Range(from.lineNumber, from.column, to.lineNumber, to.column);
+        };
+        const flushInsert = () => {
+            if (pendingInsert !== null) {
+                edits.push({ range: rangeAt(index, index), text: pendingInsert });
+                pendingInsert = null;
+            }
+        };
+        op.forEach((c) => {
+            if (CollabOT.isRetain(c)) {
+                flushInsert();
+                index += c;
+            } else if (CollabOT.isInsert(c)) {
+                pendingInsert = (pendingInsert || '') + c;
+            } else {
+                // An insert followed by a delete at the same spot becomes one replacement
+                edits.push({ range: rangeAt(index, index - c), text: pendingInsert || '' });
+                pendingInsert = null;
+                index -= c;
+            }
+        });
+        flushInsert();
+
+        if (edits.length) {
+            this.applyingRemote = true;
+            try {
+                model.applyEdits(edits);
+            } finally {
+                this.applyingRemote = false;
+            }
+            if (this.onRemoteChange) this.onRemoteChange();
+        }
+    }
+
+    schedule(delay) {
+        if (this.stopped) return;
+        if (this.timer) clearTimeout(this.timer);
+        this.timer = setTimeout(() => this.tick(), delay);
+    }
+
+    async tick() {
+        this.timer = null;
+        let delay = this.pollInterval;
+        try {
+            if (this.outstanding !== null) {
+                await this.send();
+                if (this.outstanding !== null) delay = 0;
+            } else {
+                await this.poll();
+            }
+        } catch (error) {
+            console.error('Collaborative sync failed:', error);
+        }
+        this.schedule(delay);
+    }
+
+    async send() {
+        const response = await fetch(this.url('ops'), {
+            method: 'POST',
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                client_id: this.clientId,
+                revision: this.revision,
+                epoch: this.epoch,
+                ops: this.outstanding
+            })
+        });
+
+        if (response.status === 409) {
+            await this.poll();
+            return;
+        }
+        // Rate limited, busy or restarting: keep the operation and send it again next tick
+        if (response.status === 429 || response.status === 503) {
+            return;
+        }
+        if (!response.ok) {
+            throw new Error('Failed to send operation');
+        }
+
+        const data = await response.json();
+        // Operations other editors made first, then the acknowledgement of ours
+        data.operations.forEach((entry) => this.applyRemote(entry.ops));
+        this.revision = data.revision;
+        this.serverText = CollabOT.apply(this.serverText, this.outstanding);
+        this.outstanding = this.buffer;
+        this.buffer = null;
+    }
+
+    async poll() {
+        const since = `since=${this.revision}&epoch=${encodeURIComponent(this.epoch || '')}`;
+        const response = await fetch(`${this.url('ops')}${this.query ? '&' : '?'}${since}`, {
+            credentials: 'include'
+        });
+        if (response.status === 429 || response.status === 503) {
+            return;
+        }
+        if (!response.ok) {
+            throw new Error('Failed to fetch operations');
+        }
+
+        const data = await response.json();
+        if (data.resync) {
+            this.resync(data.revision, data.text, data.epoch);
+            return;
+        }
+        data.operations.forEach((entry) => {
+            if (entry.revision > this.revision) {
+                this.applyRemote(entry.ops);
+            }
+        });
+    }
+}
@@ -282,10 +282,19 @@ function initializeEditor() {
             // Set language-specific settings
             const settings = getLanguageSettings(language);
             editor.updateOptions(settings);
+
+            // Text edits go through the collaborative session, so save the language change here;
+            // updateNotes sends only the settings while the session is live
+            if (collabSession && currentClassId) {
+                updateNotes();
+            }
         });
 
         // Auto-save on content change
         editor.onDidChangeModelContent(() => {
+            // The collaborative session sends edits as operations instead
+            if (collabSession) return;
+
             if (saveTimeout) clearTimeout(saveTimeout);
             document.getElementById('save-status').textContent = 'Saving...';
             
@@ -591,6 +600,8 @@ async function createNewClass() {
 // Select class
 async function selectClass(classId) {
     try {
+        stopCollabSession();
+        stopPresence();
         currentClassId = classId;
         const classData = classesMap.get(classId);
 
@@ -649,8 +660,16 @@ async function selectClass(classId) {
             // Update last accessed time
             classData.last_accessed = new Date().toISOString();
             
-            // Set up polling for updates from viewers
-            setupRealtimeUpdates();
+            if (data.presence) {
+                startPresence(classId);
+            }
+
+            if (data.collab) {
+                startCollabSession(classId);
+            } else {
+                // Set up polling for updates from viewers
+                setupRealtimeUpdates();
+            }
         } catch (error) {
             console.error('Failed to load notes:', error);
             showToast('Failed to load notes', 'error');
@@ -669,17 +688,82 @@ async function selectClass(classId) {
     }
 }
 
+// Collaborative editing session for the current class, when the server has it enabled
+let collabSession = null;
+
+async function startCollabSession(classId) {
+    if (updatePoller) {
+        updatePoller.stop();
+        updatePoller = null;
+    }
+
+    collabSession = new CollabSession(editor, classId, {
+        onRemoteChange: () => {
+            document.getElementById('save-status').textContent = 'Updated by collaborator';
+        }
+    });
+    try {
+        await collabSession.start();
+    } catch (error) {
+        console.error('Failed to start collaborative session:', error);
+        collabSession = null;
+        setupRealtimeUpdates();
+    }
+}
+
+function stopCollabSession() {
+    if (collabSession) {
+        collabSession.stop();
+        collabSession = null;
+    }
+}
+
+// Viewers of the current class and their cursors
+let presenceClient = null;
+
+async function startPresence(classId) {
+    presenceClient = new PresenceClient(editor, classId, {
+        showCursors: true,
+        onChange: (others) => {
+            const viewerCount = document.getElementById('viewer-count');
+            if (viewerCount) {
+                viewerCount.style.display = 'inline-block';
+                viewerCount.innerHTML = `<i class="bi bi-eye"></i> ${others.length}`;
+                viewerCount.title = others.map((member) => member.name).join('\n');
+            }
+        }
+    });
+    try {
+        await presenceClient.start();
+    } catch (error) {
+        console.error('Failed to start presence:', error);
+        presenceClient = null;
+    }
+}
+
+function stopPresence() {
+    if (presenceClient) {
+        presenceClient.stop();
+        presenceClient = null;
+    }
+    const viewerCount = document.getElementById('viewer-count');
+    if (viewerCount) {
+        viewerCount.style.display = 'none';
+    }
+}
+
 // Add this new function to poll for updates when a document is shared
-let updatePollingInterval = null;
+let updatePoller = null;
 
 function setupRealtimeUpdates() {
-    // Clear any existing interval
-    if (updatePollingInterval) {
-        clearInterval(updatePollingInterval);
+    // Stop any existing poller
+    if (updatePoller) {
+        updatePoller.stop();
     }
     
-    // Set a new interval to check for updates every 2 seconds
-    updatePollingInterval = setInterval(checkForUpdates, 2000);
+    // Poll as often as the server advises for the class's activity (2 seconds until it does)
+    updatePoller = new AdaptivePoller(checkForUpdates, { defaultDelay: 2000 });
+    updatePoller.start();
 }
 
 // Function to check for updates to the current document
@@ -691,6 +775,11 @@ async function checkForUpdates() {
         const timestamp = Date.now();
         const response = await fetch(`/api/notes/${currentClassId}?timestamp=${timestamp}`);
         
+        // Rate limited or busy: wait as long as the server asks
+        if (response.status === 429 || response.status === 503) {
+            return parseInt(response.headers.get('Retry-After') || '1', 10) * 1000;
+        }
+        
         if (!response.ok) {
             throw new Error('Failed to check for updates');
         }
@@ -737,6 +826,7 @@ async function checkForUpdates() {
                 console.error('Error parsing updated content', e);
             }
         }
+        return data.next_poll_ms;
     } catch (error) {
         console.error('Error checking for updates:', error);
     }
@@ -775,17 +865,43 @@ async function updateNotes() {
             timestamp: Date.now()
         };
 
+        // In a collaborative session the text travels as operations: send only the settings,
+        // which the server merges onto the text it holds, so concurrent edits are not overwritten
+        const body = collabSession
+            ? { language: language, formatOptions: formatOptions }
+            : { content: JSON.stringify(content) };
+
         // Send data to server
         const response = await fetch(`/api/notes/${currentClassId}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
             },
-            body: JSON.stringify({
-                content: JSON.stringify(content)
-            })
+            body: JSON.stringify(body)
         });
 
+        // Rate limited, busy or restarting: retry once the server says we may
+        if (response.status === 429 || response.status === 503) {
+            const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+            if (saveTimeout) clearTimeout(saveTimeout);
+            saveTimeout = setTimeout(updateNotes, retryAfter * 1000);
+            return;
+        }
+
+        // Over the server's size limit: retrying cannot help until the document shrinks
+        if (response.status === 413) {
+            updateSaveStatus('error');
+            showToast('Document is too large to save', 'error');
+            return;
+        }
+
+        // Others are editing live: whole-text saves would overwrite their edits
+        if (response.status === 409) {
+            updateSaveStatus('error');
+            showToast('This class is being edited live; reload the page to join', 'error');
+            return;
+        }
+
         if (!response.ok) {
             throw new Error('Failed to save');
         }
@@ -921,7 +1037,16 @@ function showToast(message, type = 'info') {
 }
 
 // Handle logout
-function handleLogout() {
+async function handleLogout() {
+    try {
+        // End the session server-side so it cannot be reused
+        await fetch('/api/logout', {
+            method: 'POST',
+            credentials: 'include'
+        });
+    } catch (error) {
+        console.error('Logout request failed:', error);
+    }
     window.location.href = '/login';
 }
 
@@ -985,8 +1110,9 @@ async function checkSession() {
     }
 }
 
-// Check session every 5 minutes
-setInterval(checkSession, 300000);
+// Check session every 5 minutes while the tab is visible, less often while the user is idle
+const sessionPoller = new AdaptivePoller(checkSession, { defaultDelay: 300000, minDelay: 300000, maxDelay: 1800000 });
+sessionPoller.start({ immediate: false });
 
 function initializeUI() {
     // Set user email in header
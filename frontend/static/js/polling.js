@@ -0,0 +1,105 @@
+// Identifies this tab to the rate limiter, so anonymous viewers sharing an address (a class
+// behind one NAT) each get their own bucket without the server keeping a session for them
+const POLL_CLIENT_ID = (window.crypto && crypto.randomUUID) ? crypto.randomUUID() : Math.random().toString(36).slice(2);
+
+function pollHeaders(headers = {}) {
+    return Object.assign({ 'X-Client-Id': POLL_CLIENT_ID }, headers);
+}
+
+// Runs a polling task with the delay the server advises (the task returns it in
+// milliseconds), backing off while the user is idle and pausing while the tab is
+// hidden. A hidden tab polls again as soon as it becomes visible.
+class AdaptivePoller {
+    constructor(task, { defaultDelay = 2000, minDelay = 1000, maxDelay = 60000, idleAfter = 120000, idleFactor = 2 } = {}) {
+        this.task = task;
+        this.defaultDelay = defaultDelay;
+        this.minDelay = minDelay;
+        this.maxDelay = maxDelay;
+        this.idleAfter = idleAfter;
+        this.idleFactor = idleFactor;
+        this.timer = null;
+        this.running = false;
+        this.stopped = true;
+        this.lastRun = 0;
+        this.lastAdvice = null;
+        this.lastActivity = Date.now();
+        this.visibilityHandler = () => this.onVisibilityChange();
+        this.activityHandler = () => this.onActivity();
+    }
+
+    start({ immediate = true } = {}) {
+        this.stopped = false;
+        document.addEventListener('visibilitychange', this.visibilityHandler);
+        ['mousemove', 'keydown', 'scroll', 'touchstart'].forEach((event) => {
+            window.addEventListener(event, this.activityHandler, { passive: true });
+        });
+        if (immediate) {
+            this.run();
+        } else {
+            this.lastRun = Date.now();
+            this.schedule();
+        }
+    }
+
+    stop() {
+        this.stopped = true;
+        clearTimeout(this.timer);
+        this.timer = null;
+        document.removeEventListener('visibilitychange', this.visibilityHandler);
+        ['mousemove', 'keydown', 'scroll', 'touchstart'].forEach((event) => {
+            window.removeEventListener(event, this.activityHandler);
+        });
+    }
+
+    async run() {
+        clearTimeout(this.timer);
+        this.timer = null;
+        if (this.running) return;
+        this.running = true;
+        this.lastRun = Date.now();
+        try {
+            this.lastAdvice = await this.task();
+        } catch (error) {
+            console.error('Polling task failed:', error);
+            this.lastAdvice = null;
+        }
+        this.running = false;
+        this.schedule();
+    }
+
+    delay() {
+        let delay = Number.isFinite(this.lastAdvice) && this.lastAdvice > 0 ? this.lastAdvice : this.defaultDelay;
+        // Double the delay for every idleAfter period without user input
+        const idlePeriods = Math.floor((Date.now() - this.lastActivity) / this.idleAfter);
+        if (idlePeriods > 0) {
+            delay *= Math.pow(this.idleFactor, Math.min(idlePeriods, 10));
+        }
+        return Math.min(this.maxDelay, Math.max(this.minDelay, delay));
+    }
+
+    schedule(delay = this.delay()) {
+        if (this.stopped || document.hidden) return;
+        clearTimeout(this.timer);
+        const wait = Math.max(0, this.lastRun + delay - Date.now());
+        this.timer = setTimeout(() => this.run(), wait);
+    }
+
+    onVisibilityChange() {
+        if (this.stopped) return;
+        if (document.hidden) {
+            clearTimeout(this.timer);
+            this.timer = null;
+        } else {
+            // Catch up straight away, but never poll more often than minDelay
+            this.lastActivity = Date.now();
+            if (!this.running) this.schedule(this.minDelay);
+        }
+    }
+
+    onActivity() {
+        const wasIdle = Date.now() - this.lastActivity >= this.idleAfter;
+        this.lastActivity = Date.now();
+        // Coming back from idle: shorten the backed-off wait
+        if (wasIdle && !this.running) this.schedule();
+    }
+}
@@ -0,0 +1,139 @@
+// Presence client for /api/presence: announces this page, sends the cursor with
+// each heartbeat and applies the frames the server publishes for the classroom.
+class PresenceClient {
+    constructor(editor, classId, { query = '', interval = 2000, showCursors = false, onChange = null } = {}) {
+        this.editor = editor;
+        this.classId = classId;
+        this.query = query;
+        this.interval = interval;
+        this.showCursors = showCursors;
+        this.onChange = onChange;
+        this.clientId = null;
+        this.seq = 0;
+        this.members = new Map();
+        this.decorations = [];
+        this.timer = null;
+        this.stopped = false;
+        this.unloadHandler = () => this.leave();
+    }
+
+    url(path) {
+        return `/api/presence/${this.classId}/${path}${this.query}`;
+    }
+
+    cursor() {
+        // Only report a cursor while the user is actually in the editor
+        if (!this.editor || !this.editor.hasTextFocus()) return null;
+        const position = this.editor.getPosition();
+        return position ? { lineNumber: position.lineNumber, column: position.column } : null;
+    }
+
+    async start() {
+        await this.join();
+        window.addEventListener('pagehide', this.unloadHandler);
+        this.schedule();
+    }
+
+    stop() {
+        this.stopped = true;
+        if (this.timer) clearTimeout(this.timer);
+        window.removeEventListener('pagehide', this.unloadHandler);
+        this.leave();
+        this.members.clear();
+        this.render();
+    }
+
+    async join() {
+        const response = await fetch(this.url('join'), {
+            method: 'POST',
+            credentials: 'include',
+            headers: pollHeaders({ 'Content-Type': 'application/json' }),
+            body: JSON.stringify({ cursor: this.cursor() })
+        });
+        if (!response.ok) {
+            throw new Error('Failed to join presence');
+        }
+        const data = await response.json();
+        this.clientId = data.client_id;
+        this.reset(data);
+    }
+
+    leave() {
+        if (!this.clientId) return;
+        navigator.sendBeacon(`/api/presence/${this.classId}/leave`, JSON.stringify({ client_id: this.clientId }));
+        this.clientId = null;
+    }
+
+    schedule() {
+        if (this.stopped) return;
+        this.timer = setTimeout(() => this.heartbeat(), this.interval);
+    }
+
+    async heartbeat() {
+        try {
+            const response = await fetch(this.url('heartbeat'), {
+                method: 'POST',
+                credentials: 'include',
+                headers: pollHeaders({ 'Content-Type': 'application/json' }),
+                body: JSON.stringify({ client_id: this.clientId, seq: this.seq, cursor: this.cursor() })
+            });
+
+            if (response.status === 410) {
+                // Expired or the server restarted; announce ourselves again
+                await this.join();
+            } else if (response.ok) {
+                const data = await response.json();
+                if (data.resync) {
+                    this.reset(data);
+                } else {
+                    data.frames.forEach((frame) => this.applyFrame(frame));
+                }
+            }
+        } catch (error) {
+            console.error('Presence heartbeat failed:', error);
+        }
+        this.schedule();
+    }
+
+    reset(data) {
+        this.seq = data.seq;
+        this.members = new Map(data.members.map((member) => [member.client_id, member]));
+        this.render();
+    }
+
+    applyFrame(frame) {
+        if (frame.seq <= this.seq) return;
+        frame.changes.forEach((change) => {
+            if (change.member) {
+                this.members.set(change.client_id, change.member);
+            } else {
+                this.members.delete(change.client_id);
+            }
+        });
+        this.seq = frame.seq;
+        this.render();
+    }
+
+    render() {
+        const others = [...this.members.values()].filter((member) => member.client_id !== this.clientId);
+
+        if (this.showCursors && this.editor) {
+            const decorations = others
+                .filter((member) => member.cursor)
+                .map((member) => ({
+                    range: new monaco.Range(
+                        member.cursor.lineNumber, member.cursor.column,
+                        member.cursor.lineNumber, member.cursor.column
+                    ),
+                    options: {
+                        beforeContentClassName: 'presence-cursor',
+                        hoverMessage: { value: member.name },
+                        stickiness: monaco.editor.TrackedRangeStickiness.NeverGrowsWhenTypingAtEdges
+                    }
+                }));
+            this.decorations = this.editor.deltaDecorations(this.decorations, decorations);
+        }
+
+        if (this.onChange) this.onChange(others);
+    }
+}
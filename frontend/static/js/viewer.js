@@ -1,9 +1,11 @@
 let editor = null;
-let pollInterval = null;
+let poller = null;
 let lastContent = null;
 let isEditMode = false;
 let recentlySaved = false;
 let recentlySavedTimeout = null;
+let renderedVersion = null;
+let renderedKey = null;
 
 document.addEventListener('DOMContentLoaded', function() {
     // Check URL parameters for edit mode
@@ -19,9 +21,92 @@ document.addEventListener('DOMContentLoaded', function() {
     }
     
     initializeTheme();
-    initializeEditor();
+    
+    // Read-only viewers get server-rendered HTML and skip loading the editor
+    if (document.getElementById('viewer').dataset.rendered === 'true') {
+        startRenderedView();
+    } else {
+        initializeEditor();
+    }
 });
 
+function startRenderedView() {
+    const viewerElement = document.getElementById('viewer');
+    const container = document.createElement('div');
+    container.className = 'rendered-view';
+    viewerElement.appendChild(container);
+    setRenderedTheme(localStorage.getItem('theme') || 'light');
+    setupEventListeners();
+    
+    poller = new AdaptivePoller(loadRendered, { defaultDelay: 2000 });
+    poller.start();
+}
+
+function setRenderedTheme(theme) {
+    let link = document.getElementById('rendered-theme');
+    if (!link) {
+        link = document.createElement('link');
+        link.id = 'rendered-theme';
+        link.rel = 'stylesheet';
+        document.head.appendChild(link);
+    }
+    link.href = `/api/render/theme.css?theme=${theme}`;
+}
+
+async function loadRendered() {
+    try {
+        const classId = document.getElementById('viewer').dataset.classroomId;
+        let url = `/api/notes/${classId}/rendered?view=true`;
+        if (renderedVersion) {
+            url += `&version=${encodeURIComponent(renderedVersion)}`;
+        }
+        
+        const response = await fetch(url, { headers: pollHeaders() });
+        
+        // Still rendering, rate limited or busy; retry when the server says
+        if (response.status === 202 || response.status === 429 || response.status === 503) {
+            return parseInt(response.headers.get('Retry-After') || '1', 10) * 1000;
+        }
+        
+        if (!response.ok) {
+            throw new Error('Failed to fetch rendered notes');
+        }
+        
+        const data = await response.json();
+        if (data.unchanged) return data.next_poll_ms;
+        
+        renderedVersion = data.last_updated;
+        document.getElementById('class-name').textContent =
+            data.class_name || `Class ${classId.split('-')[1]}`;
+        
+        // Identical text and language render to the same key; no need to touch the DOM
+        if (data.key !== renderedKey) {
+            renderedKey = data.key;
+            document.querySelector('#viewer .rendered-view').innerHTML = data.html;
+        }
+        
+        if (data.last_updated) {
+            const lastUpdated = new Date(data.last_updated).toLocaleString();
+            document.getElementById('last-updated').textContent =
+                `Last updated: ${lastUpdated}`;
+        }
+        
+        const loadingOverlay = document.querySelector('.loading-overlay');
+        if (loadingOverlay) {
+            loadingOverlay.style.display = 'none';
+        }
+        return data.next_poll_ms;
+    } catch (error) {
+        console.error('Failed to load rendered notes:', error);
+    }
+}
+
+function currentText() {
+    if (editor) return editor.getValue();
+    const code = document.querySelector('#viewer .rendered-code td.code');
+    return code ? code.textContent : '';
+}
+
 function initializeEditor() {
     require(['vs/editor/editor.main'], function() {
         // Define custom themes
@@ -63,17 +148,59 @@ function initializeEditor() {
             bracketPairColorization: { enabled: true }
         });
 
-        loadNotes();
         setupEventListeners();
-        
-        // Setup real-time updates
-        startPolling(); // Always poll for updates, regardless of mode
-        
-        // If in edit mode, also setup autosave
+
+        loadNotes().then((data) => {
+            if (data && data.presence) {
+                startPresence();
+            }
+
+            // Shared edits are exchanged as operations when the server supports it
+            if (data && data.collab) {
+                startCollabSession();
+                return;
+            }
+
+            // Setup real-time updates
+            startPolling(); // Always poll for updates, regardless of mode
+            
+            // If in edit mode, also setup autosave
+            if (isEditMode) {
+                setupAutoSave();
+            }
+        });
+    });
+}
+
+let collabSession = null;
+
+function startPresence() {
+    const classId = document.getElementById('viewer').dataset.classroomId;
+    const presenceClient = new PresenceClient(editor, classId, {
+        query: isEditMode ? '?view=true&edit=true' : '?view=true'
+    });
+    presenceClient.start().catch((error) => {
+        console.error('Failed to start presence:', error);
+    });
+}
+
+async function startCollabSession() {
+    const classId = document.getElementById('viewer').dataset.classroomId;
+    collabSession = new CollabSession(editor, classId, {
+        query: isEditMode ? '?view=true&edit=true' : '?view=true',
+        readOnly: !isEditMode,
+        pollInterval: isEditMode ? 1000 : 2000
+    });
+    try {
+        await collabSession.start();
+    } catch (error) {
+        console.error('Failed to start collaborative session:', error);
+        collabSession = null;
+        startPolling();
         if (isEditMode) {
             setupAutoSave();
         }
-    });
+    }
 }
 
 async function loadNotes() {
@@ -89,7 +216,12 @@ async function loadNotes() {
         // Add a cache-busting parameter to ensure fresh content
         url += `&timestamp=${Date.now()}`;
         
-        const response = await fetch(url);
+        const response = await fetch(url, { headers: pollHeaders() });
+        
+        // Rate limited or busy: keep showing what we have and wait as long as the server asks
+        if (response.status === 429 || response.status === 503) {
+            return { next_poll_ms: parseInt(response.headers.get('Retry-After') || '1', 10) * 1000 };
+        }
         
         if (!response.ok) {
             throw new Error('Failed to fetch notes');
@@ -151,6 +283,7 @@ async function loadNotes() {
                 loadingOverlay.style.display = 'none';
             }
         }
+        return data;
     } catch (error) {
         console.error('Failed to load notes:', error);
         editor.setValue('Failed to load notes. Please try refreshing the page.');
@@ -165,9 +298,13 @@ function setupEventListeners() {
             const theme = e.target.checked ? 'dark' : 'light';
             document.documentElement.setAttribute('data-theme', theme);
             localStorage.setItem('theme', theme);
-            editor.updateOptions({ 
-                theme: theme === 'dark' ? 'custom-dark' : 'vs'
-            });
+            if (editor) {
+                editor.updateOptions({ 
+                    theme: theme === 'dark' ? 'custom-dark' : 'vs'
+                });
+            } else {
+                setRenderedTheme(theme);
+            }
         });
     }
 
@@ -275,14 +412,46 @@ async function saveNotes() {
         // Save to API with edit permission
         const response = await fetch(`/api/notes/${classId}?view=true&edit=true`, {
             method: 'POST',
-            headers: {
+            headers: pollHeaders({
                 'Content-Type': 'application/json'
-            },
+            }),
             body: JSON.stringify({
                 content: JSON.stringify(content)
             })
         });
         
+        // Rate limited, busy or restarting: retry once the server says we may
+        if (response.status === 429 || response.status === 503) {
+            const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+            recentlySaved = false;
+            setTimeout(saveNotes, retryAfter * 1000);
+            return;
+        }
+        
+        // Over the server's size limit: retrying cannot help until the document shrinks
+        if (response.status === 413) {
+            showToast('Document is too large to save', 'error');
+            if (statusElement) {
+                statusElement.textContent = 'Save failed';
+                statusElement.classList.remove('saving');
+                statusElement.classList.add('error');
+            }
+            recentlySaved = false;
+            return;
+        }
+        
+        // Others are editing live: whole-text saves would overwrite their edits
+        if (response.status === 409) {
+            showToast('This class is being edited live; reload the page to join', 'error');
+            if (statusElement) {
+                statusElement.textContent = 'Save failed';
+                statusElement.classList.remove('saving');
+                statusElement.classList.add('error');
+            }
+            recentlySaved = false;
+            return;
+        }
+        
         if (!response.ok) {
             throw new Error('Failed to save changes');
         }
@@ -335,18 +504,21 @@ function initializeTheme() {
 }
 
 function startPolling() {
-    // Clear any existing polling interval first
-    if (pollInterval) {
-        clearInterval(pollInterval);
-        pollInterval = null;
+    // Stop any existing poller first
+    if (poller) {
+        poller.stop();
+        poller = null;
     }
     
-    // Set polling interval based on mode
-    // For edit mode, check more frequently
+    // Poll as often as the server advises; until it does, check more frequently in edit mode
     const interval = isEditMode ? 1000 : 2000; // 1 second in edit mode, 2 seconds in view mode
     
-    // Start polling at the specified interval
-    pollInterval = setInterval(loadNotes, interval);
+    // The notes were just loaded, so wait for the first interval
+    poller = new AdaptivePoller(async () => {
+        const data = await loadNotes();
+        return data && data.next_poll_ms;
+    }, { defaultDelay: interval });
+    poller.start({ immediate: false });
     
     console.log(`Started polling at ${interval}ms intervals (${isEditMode ? 'edit' : 'view'} mode)`);
 }
@@ -360,8 +532,8 @@ async function generatePDF() {
         
         showToast('Generating PDF...', 'info');
         
-        // Get content from editor
-        const content = editor.getValue();
+        // Get content from the editor or the rendered view
+        const content = currentText();
         const classTitle = document.getElementById('class-name').textContent;
         const lastUpdated = document.getElementById('last-updated').textContent;
         
@@ -459,7 +631,7 @@ function showToast(message, type = 'info', autoHide = true) {
 
 // Cleanup on page unload
 window.addEventListener('beforeunload', () => {
-    if (pollInterval) {
-        clearInterval(pollInterval);
+    if (poller) {
+        poller.stop();
     }
 }); 
\ No newline at end of file
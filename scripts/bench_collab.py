@@ -0,0 +1,98 @@
+"""Merge throughput of the collaborative editing engine under concurrent editors.
+
+Each simulated editor keeps its own copy of the document, sends operations
+based on a possibly stale revision and catches up with the operations the
+server returns, the way the browser client does. Run from the repo root:
+
+    python scripts/bench_collab.py --editors 40 --ops 200
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import ot  # noqa: E402
+from collab import CollabDocument  # noqa: E402
+
+
+def random_edit(text, rng):
+    position = rng.randint(0, len(text))
+    op = []
+    ot._append(op, position)
+    if rng.random() < 0.7 or position == len(text):
+        ot._append(op, rng.choice(['a', 'bc', 'def', '\n']))
+        ot._append(op, len(text) - position)
+    else:
+        length = rng.randint(1, min(3, len(text) - position))
+        ot._append(op, -length)
+        ot._append(op, len(text) - position - length)
+    return op
+
+
+def editor(document, client_id, count, lag, seed, results):
+    rng = random.Random(seed)
+    revision, text = document.snapshot()
+    latencies = []
+    for _ in range(count):
+        op = random_edit(text, rng)
+        started = time.perf_counter()
+        new_revision, concurrent = document.receive(client_id, revision, op)
+        latencies.append(time.perf_counter() - started)
+        # Same transform the server applied, so our copy matches its result
+        for entry in concurrent:
+            op, _ = ot.transform(op, entry['ops'])
+            text = ot.apply(text, entry['ops'])
+        text = ot.apply(text, op)
+        revision = new_revision
+        if lag:
+            time.sleep(rng.uniform(0, lag))
+    results[client_id] = (revision, text, latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--editors', type=int, default=40)
+    parser.add_argument('--ops', type=int, default=200, help='operations per editor')
+    parser.add_argument('--size', type=int, default=5000, help='initial document length')
+    parser.add_argument('--lag', type=float, default=0.001, help='max think time between edits, seconds')
+    args = parser.parse_args()
+
+    total = args.editors * args.ops
+    document = CollabDocument('bench', 'x' * args.size, history_limit=total + 1)
+    results = {}
+    threads = [
+        threading.Thread(target=editor, args=(document, f'client-{i}', args.ops, args.lag, i, results))
+        for i in range(args.editors)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    _, final = document.snapshot()
+    converged = True
+    for revision, text, _ in results.values():
+        # Catch up with everything other editors sent after our last operation
+        _, missed = document.operations_since(revision)
+        for entry in missed:
+            text = ot.apply(text, entry['ops'])
+        converged = converged and text == final
+    latencies = sorted(latency for _, _, samples in results.values() for latency in samples)
+
+    print(f"editors={args.editors} operations={total} revision={document.revision}")
+    print(f"elapsed={elapsed:.2f}s throughput={total / elapsed:.0f} ops/s")
+    print(f"merge p50={latencies[len(latencies) // 2] * 1000:.3f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms")
+    print(f"converged={converged} final_length={len(final)}")
+    return 0 if converged else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
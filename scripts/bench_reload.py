@@ -0,0 +1,279 @@
+"""Lost writes and reconnect latency while the app is reloaded under load.
+
+Simulated shared-link editors keep saving whole documents, and typists
+type into one classroom through the collaborative session, while the
+script reloads the server halfway through: SIGHUP to the gunicorn master
+(--pid) or any command (--reload-cmd "sudo systemctl reload livecode").
+Run from the repo root against a server started with backend/gunicorn.conf.py:
+
+    python scripts/bench_reload.py --url http://127.0.0.1:5000 --pid $(pgrep -o gunicorn)
+
+A write is lost when the server acknowledged it but the stored document
+does not contain it at the end. Reconnect latency is the time from a
+client's first failed or refused request to its next successful one;
+requests queued while workers restart show up in the latency figures.
+Typing needs COLLAB_ENABLED=true and, since collaborative documents live
+in one worker, a single worker; pass --typists 0 otherwise.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+import ot  # noqa: E402
+
+SHARED_EDIT = '?view=true&edit=true'
+
+
+class Client:
+    """JSON over HTTP, recording request latencies and how long each outage lasted"""
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.statuses = Counter()
+        self.latencies = []
+        self.outage_started = None
+        self.reconnects = []
+
+    def request(self, method, path, body=None):
+        """(status, data, headers); status is None when the connection failed"""
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            request.add_header('Content-Type', 'application/json')
+        started = time.monotonic()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, payload, headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as e:
+            status, payload, headers = e.code, e.read(), e.headers
+        except (urllib.error.URLError, OSError):
+            status, payload, headers = None, b'', {}
+
+        self.statuses[status] += 1
+        now = time.monotonic()
+        self.latencies.append(now - started)
+        if status is None or status >= 500:
+            if self.outage_started is None:
+                self.outage_started = now
+        elif self.outage_started is not None:
+            self.reconnects.append(now - self.outage_started)
+            self.outage_started = None
+
+        try:
+            return status, json.loads(payload) if payload else None, headers
+        except ValueError:
+            return status, None, headers
+
+
+def retry_after(headers):
+    try:
+        return float(headers.get('Retry-After') or 1)
+    except ValueError:
+        return 1.0
+
+
+def stored_text(client, classroom_id):
+    status, data, _ = client.request('GET', f'/api/notes/{classroom_id}?view=true')
+    if status != 200 or not data:
+        return None
+    return json.loads(data['content'])['text']
+
+
+def saver(client, classroom_id, stop, interval, results):
+    """Save 'save <n>' over and over; remember the last acknowledged n"""
+    n = acked = 0
+    while not stop.is_set():
+        n += 1
+        content = json.dumps({'text': f'save {n}', 'language': 'plaintext'})
+        status, _, headers = client.request('POST', f'/api/notes/{classroom_id}{SHARED_EDIT}', {'content': content})
+        if status == 200:
+            acked = n
+        elif status in (429, 503):
+            time.sleep(retry_after(headers))
+        time.sleep(interval)
+    results[classroom_id] = acked
+
+
+class Typist:
+    """The browser client's protocol: one operation in flight, rebased on resync"""
+
+    def __init__(self, client, classroom_id, name):
+        self.client = client
+        self.classroom_id = classroom_id
+        self.name = name
+        self.acked = []
+
+    def url(self, path):
+        return f'/api/collab/{self.classroom_id}/{path}{SHARED_EDIT}'
+
+    def join(self):
+        while True:
+            status, data, headers = self.client.request('POST', self.url('join'))
+            if status == 200:
+                break
+            time.sleep(retry_after(headers))
+        self.client_id = data['client_id']
+        self.revision, self.epoch = data['revision'], data.get('epoch')
+        self.server_text = self.local = data['text']
+
+    def apply_remote(self, op, outstanding):
+        self.server_text = ot.apply(self.server_text, op)
+        outstanding, op = ot.transform(outstanding, op)
+        self.local = ot.apply(self.local, op)
+        return outstanding
+
+    def resync(self, data, outstanding):
+        outstanding, remote = ot.transform(outstanding, ot.diff(self.server_text, data['text']))
+        self.local = ot.apply(self.local, remote)
+        self.server_text = data['text']
+        self.revision, self.epoch = data['revision'], data.get('epoch')
+        return outstanding
+
+    def poll(self, outstanding):
+        since = f"&since={self.revision}&epoch={self.epoch or ''}"
+        status, data, headers = self.client.request('GET', self.url('ops') + since)
+        if status != 200:
+            time.sleep(retry_after(headers))
+            return outstanding
+        if data.get('resync'):
+            return self.resync(data, outstanding)
+        for entry in data['operations']:
+            if entry['revision'] > self.revision:
+                outstanding = self.apply_remote(entry['ops'], outstanding)
+                self.revision += 1
+        return outstanding
+
+    def run(self, stop, interval):
+        self.join()
+        count = 0
+        while not stop.is_set():
+            count += 1
+            token = f'<{self.name}:{count}>'
+            outstanding = []
+            ot._append(outstanding, ot.u16len(self.local))
+            ot._append(outstanding, token)
+            self.local += token
+            while True:
+                status, data, headers = self.client.request('POST', self.url('ops'), {
+                    'client_id': self.client_id, 'revision': self.revision, 'epoch': self.epoch, 'ops': outstanding
+                })
+                if status == 200:
+                    for entry in data['operations']:
+                        outstanding = self.apply_remote(entry['ops'], outstanding)
+                    self.revision = data['revision']
+                    self.server_text = ot.apply(self.server_text, outstanding)
+                    self.acked.append(token)
+                    break
+                if status == 409:
+                    outstanding = self.poll(outstanding)
+                else:
+                    time.sleep(retry_after(headers) if status else interval)
+            time.sleep(interval)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--pid', type=int, help='gunicorn master pid to send SIGHUP')
+    parser.add_argument('--reload-cmd', help='command that reloads the server, instead of --pid')
+    parser.add_argument('--savers', type=int, default=20)
+    parser.add_argument('--typists', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load; the reload is at the midpoint')
+    parser.add_argument('--interval', type=float, default=0.05, help='pause between requests per client, seconds')
+    parser.add_argument('--settle', type=float, default=8, help='seconds to wait for collaborative flushes at the end')
+    args = parser.parse_args()
+    if not args.pid and not args.reload_cmd:
+        parser.error('pass --pid or --reload-cmd')
+
+    run = int(time.time()) % 100000
+    stop = threading.Event()
+    save_results = {}
+    clients = []
+    threads = []
+    for i in range(args.savers):
+        client = Client(args.url)
+        clients.append(client)
+        threads.append(threading.Thread(
+            target=saver, args=(client, f'reload-{run * 1000 + i}', stop, args.interval, save_results)
+        ))
+
+    typists = []
+    collab_classroom = f'reload-{run * 1000 + 999}'
+    if args.typists:
+        Client(args.url).request('POST', f'/api/notes/{collab_classroom}{SHARED_EDIT}', {
+            'content': json.dumps({'text': '', 'language': 'plaintext'})
+        })
+        for i in range(args.typists):
+            client = Client(args.url)
+            clients.append(client)
+            typist = Typist(client, collab_classroom, f't{i}')
+            typists.append(typist)
+            threads.append(threading.Thread(target=typist.run, args=(stop, args.interval)))
+
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration / 2)
+    reloaded_at = time.monotonic()
+    if args.pid:
+        os.kill(args.pid, signal.SIGHUP)
+    else:
+        subprocess.run(args.reload_cmd, shell=True, check=True)
+    time.sleep(args.duration / 2)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    checker = Client(args.url)
+    lost_saves = 0
+    for classroom_id, acked in save_results.items():
+        text = stored_text(checker, classroom_id)
+        stored = int(text.split()[1]) if text else 0
+        if stored < acked:
+            lost_saves += 1
+    acked_saves = sum(1 for acked in save_results.values() if acked)
+
+    lost_tokens = acked_tokens = 0
+    if typists:
+        time.sleep(args.settle)
+        text = stored_text(checker, collab_classroom) or ''
+        for typist in typists:
+            acked_tokens += len(typist.acked)
+            lost_tokens += sum(1 for token in typist.acked if token not in text)
+
+    latencies = [latency for client in clients for latency in client.latencies]
+    reconnects = [latency for client in clients for latency in client.reconnects]
+    statuses = sum((client.statuses for client in clients), Counter())
+    print(f"reload after {args.duration / 2:.0f}s of load ({time.monotonic() - reloaded_at:.0f}s ago)")
+    print(f"requests={sum(statuses.values())} " + ' '.join(
+        f"{status or 'conn_error'}={count}" for status, count in sorted(statuses.items(), key=lambda item: str(item[0]))
+    ))
+    print(f"saves: classrooms={len(save_results)} acknowledged={acked_saves} lost={lost_saves}")
+    if typists:
+        print(f"typing: acknowledged={acked_tokens} lost={lost_tokens}")
+    print(f"latency p50={percentile(latencies, 0.5) * 1000:.0f}ms p99={percentile(latencies, 0.99) * 1000:.0f}ms "
+          f"max={max(latencies, default=0) * 1000:.0f}ms")
+    print(f"reconnects={len(reconnects)} p50={percentile(reconnects, 0.5) * 1000:.0f}ms "
+          f"max={max(reconnects, default=0) * 1000:.0f}ms")
+    return 0 if not lost_saves and not lost_tokens else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
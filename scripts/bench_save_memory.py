@@ -0,0 +1,162 @@
+"""Peak server memory while large documents are saved concurrently.
+
+Sends rounds of simultaneous saves of a --size KiB document, one line
+changed per round, through shared edit links (no login needed) and
+samples the resident set of every server process meanwhile. Point --pid
+at the gunicorn master, or at a single development server; the script
+reads /proc, so run it on the server host:
+
+    python scripts/bench_save_memory.py --url http://127.0.0.1:5000 --pid $(pgrep -o gunicorn) --concurrency 1,4,16
+
+Growth is each process's peak over its resident set just before the
+level, summed over processes; per save divides it by the saves in flight.
+Python keeps freed memory for reuse, so later levels can read low after
+an earlier level grew the heap: for exact figures, restart the server
+between levels or pass one level at a time.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+MIB = 1024 * 1024
+
+
+def rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def server_pids(pid):
+    """``pid`` and its children: the gunicorn master and its workers"""
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the parent pid follows its closing parenthesis
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    pids.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return pids
+
+
+class Sampler(threading.Thread):
+    """Highest resident set of each process, sampled every ``interval`` seconds"""
+
+    def __init__(self, pids, interval=0.002):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.baseline = {pid: rss(pid) for pid in pids}
+        self.peaks = dict(self.baseline)
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            for pid in self.pids:
+                self.peaks[pid] = max(self.peaks[pid], rss(pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return sum(max(0, self.peaks[pid] - self.baseline[pid]) for pid in self.pids)
+
+
+def document(size, edit=0):
+    """About ``size`` bytes of code-like text with quotes and newlines to escape; ``edit`` changes one line"""
+    lines = []
+    length = 0
+    for n in range(size):
+        line = f'def handler_{n}(event):  # "quoted" \\ path\n    return {{"status": event["id_{n}"]}}\n'
+        if n == 10:
+            line = f'# edit {edit}\n' + line
+        lines.append(line)
+        length += len(line)
+        if length >= size:
+            break
+    return ''.join(lines)[:size]
+
+
+def save_body(text):
+    return json.dumps({'content': json.dumps({'text': text, 'language': 'python'})}).encode('utf-8')
+
+
+def save(url, body, results):
+    request = urllib.request.Request(url, data=body, method='POST')
+    request.add_header('Content-Type', 'application/json')
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            status = response.status
+            response.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    results.append((status, time.monotonic() - started))
+
+
+def save_round(urls, body, results):
+    threads = [threading.Thread(target=save, args=(url, body, results)) for url in urls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_level(args, concurrency, pids, run):
+    urls = [f"{args.url.rstrip('/')}/api/notes/bench-{run}{i}?view=true&edit=true" for i in range(concurrency)]
+    # A small save first, so loading code and connecting to DynamoDB are not counted as growth
+    save_round(urls, save_body(document(1024)), [])
+    # Built up front, so the client's own copies are not in flight while the server is sampled
+    bodies = [save_body(document(args.size * 1024, round_number)) for round_number in range(args.rounds)]
+    results = []
+    sampler = Sampler(pids)
+    sampler.start()
+    for body in bodies:
+        save_round(urls, body, results)
+    growth = sampler.stop()
+
+    failed = sum(1 for status, _ in results if status != 200)
+    latencies = sorted(latency for _, latency in results)
+    print(f"concurrency={concurrency:<3} saves={len(results)} failed={failed} "
+          f"p50={latencies[len(latencies) // 2] * 1000:.0f}ms "
+          f"growth={growth / MIB:.1f}MiB per_save={growth / concurrency / MIB:.2f}MiB "
+          f"({growth / concurrency / len(bodies[0]):.1f}x body)")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--pid', type=int, required=True, help='gunicorn master or development server pid')
+    parser.add_argument('--size', type=int, default=300, help='document size, KiB (DynamoDB items stop at 400 KB)')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated numbers of saves in flight')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    pids = server_pids(args.pid)
+    run = int(time.time()) % 100000
+    print(f"body={len(save_body(document(args.size * 1024))) / MIB:.2f}MiB processes={len(pids)} "
+          f"rss={sum(rss(pid) for pid in pids) / MIB:.1f}MiB")
+
+    failed = 0
+    for concurrency in (int(level) for level in args.concurrency.split(',')):
+        failed += run_level(args, concurrency, pids, f'{run}-{concurrency}-')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -25,21 +25,8 @@ export DEBIAN_FRONTEND=noninteractive
 sudo -E apt-get update
 sudo -E apt-get install -y python3-pip python3-venv nginx certbot python3-certbot-nginx
 
-# First, stop services if they exist
-echo "Stopping services if they exist..."
-if systemctl is-active --quiet nginx; then
-    sudo systemctl stop nginx
-    echo "Nginx stopped"
-else
-    echo "Nginx was not running"
-fi
-
-if systemctl is-active --quiet livecode; then
-    sudo systemctl stop livecode
-    echo "Livecode service stopped"
-else
-    echo "Livecode service was not running"
-fi
+# Services keep running while files are replaced; they are reloaded at the end
+# so in-flight saves finish and clients never see the port closed
 
 # Create directories if they don't exist
 sudo mkdir -p $APP_DIR
@@ -131,6 +118,8 @@ http {
     access_log /var/log/nginx/access.log;
     error_log /var/log/nginx/error.log;
     gzip on;
+    # Rendered notes come back as JSON-wrapped HTML; compress more than text/html
+    gzip_types application/json text/css application/javascript;
     include /etc/nginx/conf.d/*.conf;
     include /etc/nginx/sites-enabled/*;
 }
@@ -161,6 +150,26 @@ server {
         # Remove any cookie manipulation
         proxy_set_header Cookie $http_cookie;
         
+        # Keep in step with the app's MAX_CONTENT_LENGTH
+        client_max_body_size 1m;
+        
+        proxy_connect_timeout 300s;
+        proxy_read_timeout 300s;
+    }
+
+    # Restores stream through to the app as they upload: no size limit, no buffering to disk
+    location /api/admin/import {
+        proxy_pass http://127.0.0.1:5000;
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_set_header Cookie $http_cookie;
+        
+        client_max_body_size 0;
+        proxy_request_buffering off;
+        proxy_http_version 1.1;
+        
         proxy_connect_timeout 300s;
         proxy_read_timeout 300s;
     }
@@ -176,6 +185,7 @@ sudo rm -f /etc/nginx/sites-enabled/default
 sudo ln -sf /etc/nginx/sites-available/livecode /etc/nginx/sites-enabled/
 
 # Create systemd service
+UNIT_BEFORE=$(cat /etc/systemd/system/livecode.service 2>/dev/null || true)
 sudo tee /etc/systemd/system/livecode.service << EOF
 [Unit]
 Description=LiveCode Application
@@ -192,8 +202,15 @@ Environment="AWS_ACCESS_KEY_ID=${AWS_ACCESS_KEY_ID}"
 Environment="AWS_SECRET_ACCESS_KEY=${AWS_SECRET_ACCESS_KEY}"
 Environment="AWS_DEFAULT_REGION=${AWS_REGION}"
 Environment="FLASK_SECRET_KEY=your-super-secret-key-that-stays-the-same"
+# In-memory collaborative editing and presence; enabling either runs a single threaded worker
+Environment="COLLAB_ENABLED=false"
+Environment="PRESENCE_ENABLED=false"
 
-ExecStart=$APP_DIR/venv/bin/gunicorn --workers 3 --bind 127.0.0.1:5000 app:app --log-file $APP_DIR/logs/gunicorn.log --log-level debug
+ExecStart=$APP_DIR/venv/bin/gunicorn --config $APP_DIR/backend/gunicorn.conf.py app:app --log-file $APP_DIR/logs/gunicorn.log --log-level debug
+# Rolling reload: new workers start on the new code, old ones drain and flush, the socket stays open
+ExecReload=/bin/kill -s HUP \$MAINPID
+# Longer than gunicorn's graceful_timeout so stopping workers can flush
+TimeoutStopSec=45
 
 Restart=always
 RestartSec=5
@@ -206,11 +223,26 @@ EOF
 echo "Testing Nginx configuration..."
 sudo nginx -t
 
-# Start services
+# Start services, or reload them without dropping connections if already running
 sudo systemctl daemon-reload
 sudo systemctl enable livecode
-sudo systemctl start livecode
-sudo systemctl start nginx
+if systemctl is-active --quiet livecode; then
+    if [ "$UNIT_BEFORE" != "$(cat /etc/systemd/system/livecode.service)" ]; then
+        # A reload keeps the old gunicorn command line; new unit settings need a restart
+        sudo systemctl restart livecode
+        echo "Livecode service restarted"
+    else
+        sudo systemctl reload livecode
+        echo "Livecode workers reloaded"
+    fi
+else
+    sudo systemctl start livecode
+fi
+if systemctl is-active --quiet nginx; then
+    sudo systemctl reload nginx
+else
+    sudo systemctl start nginx
+fi
 
 # Debug information
 echo "Checking service statuses..."
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import boto3
+import pytest
+from moto import mock_aws
+
+# The backend modules import each other by bare name, as they do under gunicorn
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend'))
+
+REGION = 'us-east-1'
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """Mocked AWS for the duration of a test, with throwaway credentials"""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', REGION)
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def dynamodb(aws):
+    return boto3.resource('dynamodb', region_name=REGION)
+
+
+@pytest.fixture
+def app(aws, tmp_path_factory):
+    """The Flask app module on mocked AWS, with its tables created afresh and its caches empty"""
+    # Read once, when the module is first imported
+    os.environ.setdefault('OTP_BACKEND', 'memory')
+    os.environ.setdefault('SEARCH_ENABLED', 'false')
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    os.environ.setdefault('SHUTDOWN_DRAIN_TIMEOUT', '0')
+    os.environ.setdefault('PROFILE_DIR', str(tmp_path_factory.mktemp('profiles')))
+    import app as app_module
+
+    # Each test gets empty mocked tables, so create them again
+    app_module.create_users_table()
+    app_module.create_table_if_not_exists()
+    app_module.create_revisions_table()
+    for cache in (app_module.notes_cache, app_module.stale_notes_cache, app_module.users_cache):
+        cache.clear()
+    app_module.app.config['ADMIN_EMAILS'] = []
+    yield app_module
+    # Dispatch the test's queued change records before the next test's tables exist
+    app_module.change_feed.stop()
+    app_module.change_feed.start()
+
+
+def create_table(dynamodb, name, hash_key, range_key=None):
+    """A pay-per-request table keyed by a string hash key and an optional number range key"""
+    key_schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
+    attributes = [{'AttributeName': hash_key, 'AttributeType': 'S'}]
+    if range_key:
+        key_schema.append({'AttributeName': range_key, 'KeyType': 'RANGE'})
+        attributes.append({'AttributeName': range_key, 'AttributeType': 'N'})
+    return dynamodb.create_table(
+        TableName=name,
+        KeySchema=key_schema,
+        AttributeDefinitions=attributes,
+        BillingMode='PAY_PER_REQUEST'
+    )
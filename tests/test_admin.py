@@ -0,0 +1,53 @@
+import pytest
+from werkzeug.security import generate_password_hash
+
+ADMIN_ENDPOINTS = ['/api/debug/dynamodb', '/api/admin/export', '/api/admin/traces', '/api/admin/profile']
+
+
+@pytest.fixture
+def users(app):
+    table = app.dynamodb.Table('users')
+    for email, verified in (('admin@example.com', True), ('pending@example.com', False)):
+        table.put_item(Item={'email': email, 'password_hash': generate_password_hash('secret'), 'verified': verified})
+    app.app.config['ADMIN_EMAILS'] = ['admin@example.com', 'pending@example.com']
+    return app
+
+
+def test_api_login_checks_the_password_and_verification(users):
+    client = users.app.test_client()
+    assert client.post('/api/login', json={'email': 'admin@example.com', 'password': 'wrong'}).status_code == 401
+    assert client.post('/api/login', json={'email': 'pending@example.com', 'password': 'secret'}).status_code == 401
+    assert client.post('/api/login', json={'email': 'nobody@example.com', 'password': 'secret'}).status_code == 401
+    with client.session_transaction() as session:
+        assert 'user' not in session
+    assert client.post('/api/login', json={'email': 'admin@example.com', 'password': 'secret'}).status_code == 200
+
+
+@pytest.mark.parametrize('path', ADMIN_ENDPOINTS)
+def test_admin_endpoints_need_a_password_login_by_an_admin(users, path):
+    client = users.app.test_client()
+    assert client.get(path).status_code == 403
+    # A session naming an admin is not enough without a checked password
+    with client.session_transaction() as session:
+        session['user'] = 'admin@example.com'
+        session['authenticated'] = True
+    assert client.get(path).status_code == 403
+    client.post('/api/login', json={'email': 'admin@example.com', 'password': 'secret'})
+    assert client.get(path).status_code == 200
+
+
+def test_import_is_closed_without_admins(users):
+    users.app.config['ADMIN_EMAILS'] = []
+    client = users.app.test_client()
+    client.post('/api/login', json={'email': 'admin@example.com', 'password': 'secret'})
+    assert client.get('/api/admin/traces').status_code == 403
+    assert client.post('/api/admin/import', data=b'').status_code == 403
+
+
+def test_revoking_sessions_needs_a_backend_that_can_recall_them(users):
+    client = users.app.test_client()
+    assert client.post('/api/admin/sessions/revoke', json={'email': 'pending@example.com'}).status_code == 403
+    client.post('/api/login', json={'email': 'admin@example.com', 'password': 'secret'})
+    assert client.post('/api/admin/sessions/revoke', json={}).status_code == 400
+    # The default signed-cookie sessions cannot be recalled once issued
+    assert client.post('/api/admin/sessions/revoke', json={'email': 'pending@example.com'}).status_code == 409
@@ -0,0 +1,74 @@
+import gzip
+import json
+from decimal import Decimal
+
+import pytest
+from boto3.dynamodb.types import Binary
+from werkzeug.security import generate_password_hash
+
+from backup import DEFAULT_TABLES
+
+
+@pytest.fixture
+def admin(app):
+    app.dynamodb.Table('users').put_item(Item={
+        'email': 'admin@example.com', 'password_hash': generate_password_hash('secret'), 'verified': True
+    })
+    app.app.config['ADMIN_EMAILS'] = ['admin@example.com']
+    client = app.app.test_client()
+    client.post('/api/login', json={'email': 'admin@example.com', 'password': 'secret'})
+    return client
+
+
+def fill_tables(app):
+    notes = app.dynamodb.Table('live_notes')
+    for n in range(30):
+        notes.put_item(Item={
+            'classroom_id': f'class-{n}',
+            'user_email': 'admin@example.com',
+            'content': json.dumps({'text': f'print({n})\n' * n, 'language': 'python'}),
+            'revision': n,
+            'ratio': Decimal('0.25'),
+            'tags': {'a', 'b'},
+            'thumbnail': Binary(bytes(range(n)) or b'\x00')
+        })
+
+
+def table_items(app):
+    return {
+        name: sorted(app.dynamodb.Table(name).scan()['Items'], key=lambda item: json.dumps(item, default=repr, sort_keys=True))
+        for name in DEFAULT_TABLES
+    }
+
+
+def empty_tables(app):
+    for name in DEFAULT_TABLES:
+        app.dynamodb.Table(name).delete()
+    app.create_users_table()
+    app.create_table_if_not_exists()
+
+
+@pytest.mark.parametrize('compressed', [False, True])
+def test_export_then_import_into_empty_tables_restores_every_item(app, admin, compressed):
+    fill_tables(app)
+    before = table_items(app)
+
+    query = '?gzip=true' if compressed else ''
+    exported = admin.get(f'/api/admin/export{query}')
+    assert exported.status_code == 200
+    body = exported.get_data()
+    lines = (gzip.decompress(body) if compressed else body).decode('utf-8').splitlines()
+    assert len(lines) == sum(len(items) for items in before.values())
+
+    empty_tables(app)
+    assert all(not items for items in table_items(app).values())
+
+    headers = {'Content-Encoding': 'gzip'} if compressed else {}
+    imported = admin.post('/api/admin/import', data=body, headers=headers)
+    assert imported.status_code == 200, imported.get_json()
+    assert table_items(app) == before
+
+
+def test_import_rejects_malformed_lines(app, admin):
+    response = admin.post('/api/admin/import', data=b'{"table": "live_notes"\n')
+    assert response.status_code == 400
@@ -0,0 +1,116 @@
+import pytest
+from botocore.exceptions import ClientError
+
+import storage
+from storage import UnprocessedKeys, batch_get_items
+
+
+class FakeBatchReader:
+    """Answers BatchGetItem from ``items``, leaving ``stuck`` keys unprocessed every time"""
+
+    def __init__(self, items, stuck=(), flaky=()):
+        self.items = items
+        self.stuck = set(stuck)
+        self.flaky = set(flaky)
+        self.calls = []
+        self.requests = {}
+
+    def batch_get_item(self, RequestItems):
+        (table, request), = RequestItems.items()
+        keys = [key['id'] for key in request['Keys']]
+        self.calls.append(keys)
+        for key in keys:
+            self.requests[key] = self.requests.get(key, 0) + 1
+        # Flaky keys go through on their second request
+        unprocessed = [key for key in keys if key in self.stuck or (key in self.flaky and self.requests[key] == 1)]
+        response = {'Responses': {table: [self.items[key] for key in keys if key in self.items and key not in unprocessed]}}
+        if unprocessed:
+            response['UnprocessedKeys'] = {table: {'Keys': [{'id': key} for key in unprocessed]}}
+        return response
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(storage.time, 'sleep', lambda seconds: None)
+
+
+def test_missing_items_map_to_none_and_keys_are_chunked(monkeypatch):
+    monkeypatch.setattr(storage, 'BATCH_GET_LIMIT', 2)
+    reader = FakeBatchReader({'a': {'id': 'a'}, 'c': {'id': 'c'}})
+    assert batch_get_items(reader, 'notes', 'id', ['a', 'b', 'c', 'a']) == {'a': {'id': 'a'}, 'b': None, 'c': {'id': 'c'}}
+    assert reader.calls == [['a', 'b'], ['c']]
+
+
+def test_unprocessed_keys_are_retried():
+    reader = FakeBatchReader({'a': {'id': 'a'}, 'b': {'id': 'b'}}, flaky=['b'])
+    assert batch_get_items(reader, 'notes', 'id', ['a', 'b']) == {'a': {'id': 'a'}, 'b': {'id': 'b'}}
+    assert reader.calls == [['a', 'b'], ['b']]
+
+
+def test_keys_left_unprocessed_raise_with_what_was_read():
+    reader = FakeBatchReader({'a': {'id': 'a'}, 'b': {'id': 'b'}}, stuck=['b'])
+    with pytest.raises(UnprocessedKeys) as raised:
+        batch_get_items(reader, 'notes', 'id', ['a', 'b', 'c'], max_retries=2)
+    assert raised.value.results == {'a': {'id': 'a'}, 'c': None}
+    assert raised.value.pending == ['b']
+    assert len(reader.calls) == 3
+
+
+def throttled(operation='BatchGetItem'):
+    return ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'slow down'}}, operation)
+
+
+@pytest.fixture
+def notes(app):
+    table = app.dynamodb.Table('live_notes')
+    for classroom_id in ('class-1', 'class-2'):
+        table.put_item(Item={'classroom_id': classroom_id, 'content': f'{classroom_id} notes',
+                             'user_email': 'owner@example.com', 'last_updated': 'v1'})
+    client = app.app.test_client()
+    # Warm the stale copies for class-1 only
+    assert client.get('/api/notes/class-1?view=true').status_code == 200
+    app.notes_cache.clear()
+    return client
+
+
+def batch(client, *classroom_ids):
+    return client.post('/api/notes/batch?view=true', json={'classrooms': list(classroom_ids)})
+
+
+def test_batch_reads_every_classroom(app, notes):
+    body = batch(notes, 'class-1', 'class-2', 'nodash').get_json()
+    assert body['changed']['class-1']['content'] == 'class-1 notes'
+    assert body['changed']['class-2']['content'] == 'class-2 notes'
+    assert body['changed']['nodash']['class_name'] == 'Class nodash'
+    known = notes.post('/api/notes/batch?view=true', json={'classrooms': [{'classroom_id': 'class-1', 'version': 'v1'}]})
+    assert known.get_json()['unchanged'] == ['class-1']
+
+
+def test_unprocessed_keys_serve_stale_copies_or_report_them(app, notes, monkeypatch):
+    def partial(dynamodb, table_name, key_name, key_values):
+        raise UnprocessedKeys({'class-3': None}, ['class-1', 'class-2'], 5)
+
+    monkeypatch.setattr(app, 'batch_get_items', partial)
+    response = batch(notes, 'class-1', 'class-2', 'class-3')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['changed']['class-1']['content'] == 'class-1 notes'
+    assert body['changed']['class-3']['content'] == ''
+    assert 'class-2' not in body['changed']
+    assert body['errors'] == {'class-2': 'Temporarily unavailable'}
+
+
+def test_throttled_batches_fall_back_to_stale_copies_or_503(app, notes, monkeypatch):
+    def throttle(*args):
+        raise throttled()
+
+    monkeypatch.setattr(app, 'batch_get_items', throttle)
+    assert batch(notes, 'class-1').get_json()['changed']['class-1']['content'] == 'class-1 notes'
+    response = batch(notes, 'class-1', 'class-2')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_classroom_ids_must_be_strings(app, notes):
+    assert notes.post('/api/notes/batch?view=true', json={'classrooms': [{'classroom_id': 5}]}).status_code == 400
+    assert notes.post('/api/notes/batch?view=true', json={'classrooms': []}).status_code == 400
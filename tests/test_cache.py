@@ -0,0 +1,53 @@
+import pytest
+
+import cache
+from cache import MISSING, TTLCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_falsy_values_are_hits_and_misses_are_missing():
+    entries = TTLCache(maxsize=10, ttl=60)
+    for key, value in (('none', None), ('empty', {}), ('blank', '')):
+        entries.set(key, value)
+        assert entries.get(key) == value
+    assert entries.get('absent') is MISSING
+    assert entries.get('absent', 'fallback') == 'fallback'
+    assert entries.stats()['hits'] == 3 and entries.stats()['misses'] == 2
+
+
+def test_entries_expire_after_their_ttl(clock):
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set('default', 1)
+    entries.set('short', 2, ttl=5)
+    clock[0] += 5
+    assert entries.get('short') is MISSING
+    assert entries.get('default') == 1
+    clock[0] += 55
+    assert entries.get('default') is MISSING
+    assert len(entries) == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set('a', 1)
+    entries.set('b', 2)
+    entries.get('a')
+    entries.set('c', 3)
+    assert entries.get('b') is MISSING
+    assert entries.get('a') == 1 and entries.get('c') == 3
+
+
+def test_delete_where_matches_values():
+    entries = TTLCache(maxsize=10, ttl=60)
+    entries.set('s1', {'user': 'ada'})
+    entries.set('s2', {'user': 'bob'})
+    entries.set('s3', {'user': 'ada'})
+    entries.delete_where(lambda value: value['user'] == 'ada')
+    entries.delete('missing')
+    assert [entries.get(key) for key in ('s1', 's2', 's3')] == [MISSING, {'user': 'bob'}, MISSING]
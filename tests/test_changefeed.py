@@ -0,0 +1,96 @@
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from changefeed import LocalChangeFeed, enable_stream
+from conftest import create_table
+
+
+@pytest.fixture
+def feed(dynamodb):
+    create_table(dynamodb, 'live_notes', 'classroom_id')
+    change_feed = LocalChangeFeed({'live_notes': ['classroom_id']})
+    change_feed.install(dynamodb.meta.client)
+    yield change_feed
+    change_feed.stop()
+
+
+def test_handlers_run_off_the_writing_thread_in_order(dynamodb, feed):
+    seen = []
+    feed.subscribe(lambda record: seen.append((record['keys']['classroom_id'], record['event'], threading.current_thread().name)))
+    table = dynamodb.Table('live_notes')
+    table.put_item(Item={'classroom_id': 'a-1', 'content': 'x'})
+    table.delete_item(Key={'classroom_id': 'a-1'})
+    # Queued until the feed starts; stop dispatches what is queued
+    assert seen == []
+    feed.start()
+    feed.stop()
+    assert seen == [('a-1', 'MODIFY', 'change-feed-dispatch'), ('a-1', 'REMOVE', 'change-feed-dispatch')]
+
+
+def test_handler_errors_are_counted_and_do_not_fail_writes(dynamodb, feed):
+    seen = []
+
+    def failing(record):
+        raise RuntimeError('handler bug')
+
+    feed.subscribe(failing)
+    feed.subscribe(seen.append)
+    feed.start()
+    dynamodb.Table('live_notes').put_item(Item={'classroom_id': 'a-1'})
+    feed.stop()
+    assert len(seen) == 1
+    assert feed.stats()['counters']['handler_errors'] == 1
+
+
+def test_writes_applied_by_their_writer_are_marked(dynamodb, feed):
+    table = dynamodb.Table('live_notes')
+    with feed.applied_by_writer():
+        table.put_item(Item={'classroom_id': 'a-1'})
+    table.put_item(Item={'classroom_id': 'b-2'})
+    assert [(record['keys']['classroom_id'], record['applied']) for record in feed.replay()] == [('a-1', True), ('b-2', False)]
+
+
+def test_failed_writes_are_not_recorded(dynamodb, feed):
+    table = dynamodb.Table('live_notes')
+    table.put_item(Item={'classroom_id': 'a-1'})
+    with pytest.raises(dynamodb.meta.client.exceptions.ConditionalCheckFailedException):
+        table.put_item(Item={'classroom_id': 'a-1'}, ConditionExpression='attribute_not_exists(classroom_id)')
+    assert len(feed.replay()) == 1
+
+
+def test_enable_stream_enables_once(dynamodb, monkeypatch):
+    create_table(dynamodb, 'live_notes', 'classroom_id')
+    arn = enable_stream(dynamodb, 'live_notes')
+    assert arn
+    client = dynamodb.meta.client
+    monkeypatch.setattr(client, 'update_table', lambda **kwargs: pytest.fail('stream already enabled'))
+    assert enable_stream(dynamodb, 'live_notes') == arn
+
+
+@pytest.mark.parametrize('code', ['ResourceInUseException', 'ValidationException'])
+def test_enable_stream_tolerates_another_process_enabling_it(dynamodb, monkeypatch, code):
+    create_table(dynamodb, 'live_notes', 'classroom_id')
+    client = dynamodb.meta.client
+    update_table = client.update_table
+
+    def race(**kwargs):
+        # The other process got there between our check and our update
+        update_table(**kwargs)
+        raise ClientError({'Error': {'Code': code, 'Message': 'busy'}}, 'UpdateTable')
+
+    monkeypatch.setattr(client, 'update_table', race)
+    assert enable_stream(dynamodb, 'live_notes')
+
+
+def test_enable_stream_reports_other_failures(dynamodb, monkeypatch):
+    create_table(dynamodb, 'live_notes', 'classroom_id')
+    client = dynamodb.meta.client
+
+    def denied(**kwargs):
+        raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'no'}}, 'UpdateTable')
+
+    monkeypatch.setattr(client, 'update_table', denied)
+    with pytest.raises(ClientError):
+        enable_stream(dynamodb, 'live_notes')
@@ -0,0 +1,153 @@
+import json
+import random
+
+import pytest
+
+import ot
+from collab import CollabDocument, CollabHub, StaleRevision, extract_text, merge_settings, merge_text
+from test_ot import random_op
+
+
+class Client:
+    """A browser session: its own copy of the text, kept in step with the server's revisions"""
+
+    def __init__(self, name, document):
+        self.name = name
+        self.revision, self.text = document.snapshot()
+        self.epoch = document.epoch
+
+    def edit(self, document, op):
+        self.text = ot.apply(self.text, op)
+        self.revision, missed = document.receive(self.name, self.revision, op, self.epoch)
+        # Bring the operations merged before ours over to our side of the edit
+        for entry in missed:
+            op, theirs = ot.transform(op, entry['ops'])
+            self.text = ot.apply(self.text, theirs)
+
+    def catch_up(self, document):
+        revision, operations = document.operations_since(self.revision, self.epoch)
+        for entry in operations:
+            if entry['client_id'] != self.name:
+                self.text = ot.apply(self.text, entry['ops'])
+        self.revision = revision
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_concurrent_clients_converge(seed):
+    rng = random.Random(seed)
+    document = CollabDocument('class-1', 'shared notes\n')
+    alice, bob = Client('alice', document), Client('bob', document)
+    for _ in range(6):
+        # Both edit the text they last saw, without seeing each other's edit
+        alice_op, bob_op = random_op(rng, alice.text), random_op(rng, bob.text)
+        alice.edit(document, alice_op)
+        bob.edit(document, bob_op)
+        alice.catch_up(document)
+        bob.catch_up(document)
+        assert alice.text == bob.text == document.text
+
+
+def test_stale_and_reloaded_clients_must_resync():
+    document = CollabDocument('class-1', 'abc', history_limit=2)
+    for _ in range(3):
+        document.receive('alice', document.revision, [len(document.text), 'x'])
+    with pytest.raises(StaleRevision):
+        document.operations_since(0)
+    with pytest.raises(StaleRevision):
+        document.operations_since(document.revision, epoch='another-epoch')
+    with pytest.raises(StaleRevision):
+        document.receive('bob', document.revision + 1, [len(document.text)])
+
+
+def test_hub_flushes_dirty_documents_and_ignores_its_own_echo():
+    stored = {'class-1': 'hello'}
+    hub = CollabHub(stored.get, stored.__setitem__)
+    document = hub.document('class-1')
+    document.receive('alice', 0, [5, ' world'])
+    assert document.dirty
+    hub.flush()
+    assert stored['class-1'] == 'hello world' and not document.dirty
+    # The change feed reporting our own write back changes nothing
+    assert hub.external_update('class-1', 'hello world') == 1
+    assert hub.external_update('class-1', 'hi world') == 2
+    assert document.text == 'hi world' and not document.dirty
+    assert hub.document('missing') is None
+
+
+def test_merge_helpers_keep_what_they_do_not_replace():
+    content = json.dumps({'text': 'print(1)', 'language': 'python', 'formatOptions': {'enableMarkdown': True}})
+    merged = json.loads(merge_settings(content, {'language': 'javascript', 'text': 'ignored'}))
+    assert merged['text'] == 'print(1)' and merged['language'] == 'javascript'
+    assert merged['formatOptions'] == {'enableMarkdown': True}
+    assert json.loads(merge_settings('plain text', {'language': 'sql'}))['text'] == 'plain text'
+    assert extract_text(merge_text(content, 'print(2)')) == 'print(2)'
+    assert json.loads(merge_text(content, 'print(2)'))['language'] == 'python'
+
+
+@pytest.fixture
+def collab(app, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'COLLAB_ENABLED', True)
+    app.dynamodb.Table('live_notes').put_item(Item={
+        'classroom_id': 'class-1', 'user_email': 'owner@example.com', 'revision': 1,
+        'content': json.dumps({'text': 'hello', 'language': 'python'})
+    })
+    yield app
+    for classroom_id in app.collab_hub.classroom_ids():
+        app.collab_hub.discard(classroom_id)
+
+
+def join(client, query=''):
+    return client.post(f'/api/collab/class-1/join{query}').get_json()
+
+
+def submit(client, joined, revision, ops, query=''):
+    response = client.post(f'/api/collab/class-1/ops{query}', json={
+        'client_id': joined['client_id'], 'epoch': joined['epoch'], 'revision': revision, 'ops': ops
+    })
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def stored_content(app):
+    item = app.dynamodb.Table('live_notes').get_item(Key={'classroom_id': 'class-1'})['Item']
+    return json.loads(item['content'])
+
+
+def test_language_change_keeps_the_edits_of_both_sessions(collab):
+    owner = collab.app.test_client()
+    with owner.session_transaction() as session:
+        session['user'] = 'owner@example.com'
+    shared = collab.app.test_client()
+    shared_query = '?view=true&edit=true'
+
+    owner_joined = join(owner)
+    shared_joined = join(shared, shared_query)
+    assert owner_joined['text'] == shared_joined['text'] == 'hello'
+    submit(owner, owner_joined, 0, ['> ', 5])
+    submit(shared, shared_joined, 0, [5, '!'], shared_query)
+
+    # The owner switches language while both edits are still only in the live document
+    response = owner.post('/api/notes/class-1', json={'language': 'javascript', 'formatOptions': {'enableHTML': True}})
+    assert response.status_code == 200
+    assert collab.collab_hub.get('class-1').text == '> hello!'
+    content = stored_content(collab)
+    assert content['language'] == 'javascript' and content['formatOptions'] == {'enableHTML': True}
+
+    # A whole-text save from either side is refused rather than overwriting the other's edits
+    stale = {'content': json.dumps({'text': 'hello', 'language': 'python'})}
+    assert owner.post('/api/notes/class-1', json=stale).status_code == 409
+    assert shared.post(f'/api/notes/class-1{shared_query}', json=stale).status_code == 409
+    assert collab.collab_hub.get('class-1').text == '> hello!'
+
+    collab.collab_hub.flush()
+    content = stored_content(collab)
+    assert content['text'] == '> hello!' and content['language'] == 'javascript'
+
+
+def test_whole_text_saves_work_without_a_live_document(collab):
+    owner = collab.app.test_client()
+    with owner.session_transaction() as session:
+        session['user'] = 'owner@example.com'
+    response = owner.post('/api/notes/class-1', json={'content': json.dumps({'text': 'bye', 'language': 'python'})})
+    assert response.status_code == 200
+    assert stored_content(collab)['text'] == 'bye'
@@ -0,0 +1,46 @@
+import pytest
+
+from health import HealthMonitor
+
+
+@pytest.fixture
+def monitor(app, monkeypatch):
+    monitor = HealthMonitor(interval=15)
+    state = {'dynamodb': True}
+    monitor.register('dynamodb', lambda: state['dynamodb'])
+    monitor.register('pubsub', lambda: False, critical=False)
+    monkeypatch.setattr(app, 'health_monitor', monitor)
+    monitor.state = state
+    return monitor
+
+
+def test_health_is_503_while_checks_are_pending(app, monitor):
+    client = app.app.test_client()
+    response = client.get('/health')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'starting'
+    assert client.get('/health/ready').status_code == 503
+    assert client.get('/health/live').status_code == 200
+
+
+def test_health_follows_the_critical_checks(app, monitor):
+    client = app.app.test_client()
+    monitor.run_checks()
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json()['checks']['pubsub']['status'] == 'fail'
+
+    monitor.state['dynamodb'] = False
+    monitor.run_checks()
+    response = client.get('/health')
+    assert response.status_code == 503
+    assert response.get_json()['status'] == 'unhealthy'
+
+
+def test_stale_results_count_as_failed(monitor):
+    monitor.run_checks()
+    with monitor._lock:
+        monitor._results['dynamodb']['_at'] -= monitor.stale_after + 1
+    ready, report = monitor.readiness()
+    assert not ready
+    assert report['checks']['dynamodb']['status'] == 'stale'
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from lifecycle import DRAINING, STOPPED, Lifecycle
+
+
+class SlowApp:
+    """WSGI app whose requests block until ``release`` is set"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, environ, start_response):
+        self.started.set()
+        self.release.wait(5)
+        return Response('done')(environ, start_response)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_shutdown_waits_for_the_request_in_flight_before_running_hooks():
+    lifecycle = Lifecycle(drain_timeout=5)
+    events = []
+    lifecycle.register('flush', lambda: events.append('flush'))
+    app = SlowApp()
+    client = Client(lifecycle.wrap_wsgi(app))
+
+    def request():
+        response = client.get('/')
+        events.append(('response', response.status_code, response.get_data()))
+        response.close()
+
+    requester = threading.Thread(target=request)
+    requester.start()
+    assert app.started.wait(5)
+    shutdown = threading.Thread(target=lifecycle.shutdown)
+    shutdown.start()
+
+    assert wait_for(lambda: lifecycle.state == DRAINING)
+    assert lifecycle.draining and events == []
+    app.release.set()
+    requester.join(5)
+    shutdown.join(5)
+
+    assert events == [('response', 200, b'done'), 'flush']
+    assert lifecycle.state == STOPPED
+    assert lifecycle.stats()['in_flight'] == 0
+
+
+def test_requests_after_shutdown_get_503_with_retry_after():
+    lifecycle = Lifecycle(drain_timeout=1)
+    app = SlowApp()
+    app.release.set()
+    client = Client(lifecycle.wrap_wsgi(app))
+    lifecycle.shutdown()
+    response = client.get('/')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert not app.started.is_set()
+
+
+def test_drain_gives_up_after_the_timeout():
+    lifecycle = Lifecycle(drain_timeout=0.1)
+    app = SlowApp()
+    requester = threading.Thread(target=lambda: Client(lifecycle.wrap_wsgi(app)).get('/').close())
+    requester.start()
+    assert app.started.wait(5)
+    started = time.monotonic()
+    lifecycle.shutdown()
+    assert time.monotonic() - started < 2
+    assert lifecycle.state == STOPPED
+    app.release.set()
+    requester.join(5)
+
+
+def test_hooks_run_in_registration_order_and_errors_are_reported():
+    lifecycle = Lifecycle(drain_timeout=0)
+    calls = []
+
+    def failing():
+        calls.append('collab')
+        raise RuntimeError('flush failed')
+
+    lifecycle.register('collab', failing)
+    lifecycle.register('change feed', lambda: calls.append('change feed'))
+    lifecycle.register('pubsub', lambda: calls.append('pubsub'))
+    report = lifecycle.shutdown()
+
+    assert calls == ['collab', 'change feed', 'pubsub']
+    assert list(report) == ['collab', 'change feed', 'pubsub']
+    assert report['collab']['error'] == 'flush failed'
+    assert report['pubsub']['error'] is None
+    # Shutdown happens once
+    assert lifecycle.shutdown() is report
+    assert calls == ['collab', 'change feed', 'pubsub']
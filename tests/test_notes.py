@@ -0,0 +1,57 @@
+import json
+
+import pytest
+
+
+def login(client, email):
+    with client.session_transaction() as session:
+        session['user'] = email
+
+
+@pytest.fixture
+def owner(app):
+    client = app.app.test_client()
+    login(client, 'owner@example.com')
+    return client
+
+
+def stored(app, classroom_id):
+    return app.dynamodb.Table('live_notes').get_item(Key={'classroom_id': classroom_id}).get('Item')
+
+
+def test_update_notes_needs_a_session_and_a_classroom(app, owner):
+    anonymous = app.app.test_client()
+    assert anonymous.post('/api/update_notes', json={'classroom_id': 'class-1', 'content': 'x'}).status_code == 401
+    assert owner.post('/api/update_notes', json={'content': 'x'}).status_code == 400
+
+
+def test_update_notes_stores_editor_content_with_a_revision(app, owner):
+    response = owner.post('/api/update_notes', json={'classroom_id': 'class-1', 'content': 'print(1)', 'language': 'python'})
+    assert response.get_json() == {'status': 'success', 'revision': 1}
+    item = stored(app, 'class-1')
+    content = json.loads(item['content'])
+    assert content['text'] == 'print(1)' and content['language'] == 'python'
+    assert item['user_email'] == 'owner@example.com'
+
+    # Later saves keep what the editor stored alongside the text
+    app.dynamodb.Table('live_notes').update_item(
+        Key={'classroom_id': 'class-1'},
+        UpdateExpression='SET content = :content',
+        ExpressionAttributeValues={':content': json.dumps(dict(content, formatOptions={'enableMarkdown': True}))}
+    )
+    app.notes_cache.clear()
+    response = owner.post('/api/update_notes', json={'classroom_id': 'class-1', 'content': 'print(2)'})
+    assert response.get_json()['revision'] == 2
+    content = json.loads(stored(app, 'class-1')['content'])
+    assert content['text'] == 'print(2)' and content['language'] == 'plaintext'
+    assert content['formatOptions'] == {'enableMarkdown': True}
+    revisions = owner.get('/api/notes/class-1/revisions').get_json()
+    assert [entry['revision'] for entry in revisions['revisions']] == [2, 1]
+
+
+def test_update_notes_refuses_other_owners(app, owner):
+    owner.post('/api/update_notes', json={'classroom_id': 'class-1', 'content': 'mine'})
+    other = app.app.test_client()
+    login(other, 'other@example.com')
+    assert other.post('/api/update_notes', json={'classroom_id': 'class-1', 'content': 'theirs'}).status_code == 403
+    assert json.loads(stored(app, 'class-1')['content'])['text'] == 'mine'
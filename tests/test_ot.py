@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+import ot
+
+# Includes a character outside the BMP: two UTF-16 code units, as Monaco counts it
+ALPHABET = 'ab\n😀é'
+
+
+def random_text(rng, length):
+    return ''.join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def random_op(rng, text):
+    """A random valid operation on ``text``, in units of UTF-16 code units"""
+    op = []
+    for char in text:
+        choice = rng.random()
+        if choice < 0.2:
+            op.append(random_text(rng, rng.randint(1, 3)))
+        ot._append(op, -ot.u16len(char) if choice > 0.7 else ot.u16len(char))
+    if rng.random() < 0.5:
+        op.append(random_text(rng, rng.randint(1, 3)))
+    return ot.normalize(op)
+
+
+CASES = [random.Random(seed) for seed in range(300)]
+
+
+@pytest.mark.parametrize('rng', CASES)
+def test_transformed_operations_converge(rng):
+    text = random_text(rng, rng.randint(0, 12))
+    a, b = random_op(rng, text), random_op(rng, text)
+    a_prime, b_prime = ot.transform(a, b)
+    assert ot.apply(ot.apply(text, a), b_prime) == ot.apply(ot.apply(text, b), a_prime)
+
+
+@pytest.mark.parametrize('rng', CASES)
+def test_transform_past_a_sequence_matches_transform_past_each(rng):
+    # What CollabDocument.receive does with the operations a client had not seen
+    text = random_text(rng, rng.randint(0, 12))
+    op = random_op(rng, text)
+    server_text, history = text, []
+    for _ in range(3):
+        applied = random_op(rng, server_text)
+        history.append(applied)
+        server_text = ot.apply(server_text, applied)
+    for applied in history:
+        op, _ = ot.transform(op, applied)
+    assert ot.base_length(op) == ot.u16len(server_text)
+    ot.apply(server_text, op)
+
+
+@pytest.mark.parametrize('rng', CASES[:100])
+def test_diff_turns_one_text_into_the_other(rng):
+    old, new = random_text(rng, rng.randint(0, 12)), random_text(rng, rng.randint(0, 12))
+    op = ot.diff(old, new)
+    assert ot.apply(old, op) == new
+    assert ot.base_length(op) == ot.u16len(old)
+    assert ot.target_length(op) == ot.u16len(new)
+
+
+def test_concurrent_inserts_at_one_position_put_the_first_side_first():
+    a_prime, b_prime = ot.transform(['x', 2], ['y', 2])
+    assert ot.apply(ot.apply('ab', ['x', 2]), b_prime) == 'xyab'
+    assert ot.apply(ot.apply('ab', ['y', 2]), a_prime) == 'xyab'
+
+
+def test_normalize_merges_and_orders_components():
+    assert ot.normalize([1, 1, -1, 'a', -1, 'b']) == [2, 'ab', -2]
+    for invalid in ('abc', [1.5], [True], [None]):
+        with pytest.raises(ValueError):
+            ot.normalize(invalid)
+
+
+def test_operations_must_match_the_document():
+    with pytest.raises(ValueError):
+        ot.apply('abc', [2])
+    with pytest.raises(ValueError):
+        ot.transform([2], [3])
@@ -0,0 +1,79 @@
+import io
+import json
+
+import pytest
+
+from payload import PayloadTooLarge, read_json_object
+
+
+def parse(body, limit=None, chunk_size=7):
+    """Parse ``body`` in small chunks, so tokens straddle chunk boundaries"""
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return read_json_object(io.BytesIO(body), limit=limit, chunk_size=chunk_size)
+
+
+@pytest.mark.parametrize('body', [
+    '{}',
+    ' { "content" : "" } ',
+    '{"content": "line\\nnext \\"quoted\\" \\\\ back\\\\slash \\u00e9\\ud83d\\ude00 tab\\t", "class_name": "A"}',
+    '{"content": "' + 'x' * 100 + '", "revision": 12345678901234567890, "ratio": -1.5e-3}',
+    '{"flag": true, "none": null, "off": false}',
+    '{"content": {"text": "nested", "lines": [1, [2, {"deep": "\\u00e9"}]]}, "after": 1}',
+    '{"content": "café 日本 \U0001f600"}',
+])
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64 * 1024])
+def test_matches_json_loads(body, chunk_size):
+    assert parse(body, chunk_size=chunk_size) == json.loads(body)
+
+
+def test_limit_counts_bytes_read():
+    body = json.dumps({'content': 'x' * 100}).encode('utf-8')
+    assert parse(body, limit=len(body)) == {'content': 'x' * 100}
+    with pytest.raises(PayloadTooLarge):
+        parse(body, limit=len(body) - 1)
+
+
+@pytest.mark.parametrize('body', [
+    '',
+    '[]',
+    '"content"',
+    '{"content": "unterminated',
+    '{"content": "cut mid escape \\u00',
+    '{"content": "x"',
+    '{"content": "x",}',
+    '{"content" "x"}',
+    '{content: "x"}',
+    '{"content": "bad \\q escape"}',
+    '{"content": "raw \n newline"}',
+    '{"count": 12',
+    '{"count": 1.}',
+    '{"content": {"text": "x"}',
+    '{"content": "x"} trailing',
+    '{"content": "x"}{}',
+])
+def test_malformed_and_truncated_bodies_are_rejected(body):
+    with pytest.raises(ValueError):
+        parse(body)
+
+
+def test_invalid_utf8_is_rejected():
+    with pytest.raises(ValueError):
+        parse(b'{"content": "\xff\xfe"}')
+
+
+def test_save_returns_413_past_the_limit_and_400_for_bad_json(app, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = 'owner@example.com'
+        session['authenticated'] = True
+
+    content = 'x' * (1024 - len(json.dumps({'content': ''})))
+    body = json.dumps({'content': content})
+    assert len(body) == 1024
+    headers = {'Content-Type': 'application/json'}
+    assert client.post('/api/notes/class-1', data=body, headers=headers).status_code == 200
+    assert client.post('/api/notes/class-1', data=json.dumps({'content': content + 'x'}), headers=headers).status_code == 413
+    assert client.post('/api/notes/class-1', data='{"content": "x"', headers=headers).status_code == 400
+    assert app.dynamodb.Table('live_notes').get_item(Key={'classroom_id': 'class-1'})['Item']['content'] == content
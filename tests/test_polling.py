@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import polling
+from polling import PollAdvisor
+
+
+@pytest.fixture
+def advisor(monkeypatch):
+    # No jitter, so delays can be compared exactly
+    monkeypatch.setattr(polling.random, 'uniform', lambda low, high: 1)
+    return PollAdvisor(min_delay=1, max_delay=30, active_window=30, classroom_budget=25)
+
+
+def idle_for(seconds):
+    return (datetime.now() - timedelta(seconds=seconds)).isoformat()
+
+
+def test_recently_edited_classrooms_poll_at_the_minimum(advisor):
+    assert advisor.delay('class-1') == 1
+    assert advisor.delay('class-1', idle_for(10)) == 1
+    assert advisor.delay('class-1', 'not a timestamp') == 1
+    # A change seen by this node wins over an old last_updated
+    advisor.record_change('class-1')
+    assert advisor.delay('class-1', idle_for(3600)) == 1
+    assert advisor.stats()['active_classrooms'] == 1
+
+
+def test_the_delay_grows_with_idle_time_up_to_the_maximum(advisor):
+    assert advisor.delay('class-1', idle_for(60)) == pytest.approx(2, rel=0.01)
+    assert advisor.delay('class-1', idle_for(300)) == pytest.approx(10, rel=0.01)
+    assert advisor.delay('class-1', idle_for(86400)) == 30
+
+
+def test_viewers_share_the_classroom_budget(advisor):
+    assert advisor.delay('class-1', viewers=25) == 1
+    assert advisor.delay('class-1', viewers=100) == 4
+    assert advisor.delay('class-1', viewers=10000) == 30
+    # An idle classroom keeps whichever delay is longer
+    assert advisor.delay('class-1', idle_for(300), viewers=100) == pytest.approx(10, rel=0.01)
+
+
+def test_pressure_doubles_the_delay_of_that_classroom_only(advisor):
+    advisor.record_pressure('class-1')
+    assert advisor.delay('class-1') == 2
+    assert advisor.delay('class-1', viewers=100) == 8
+    assert advisor.delay('class-1', idle_for(86400)) == 30
+    assert advisor.delay('class-2') == 1
+    assert advisor.stats()['classrooms_under_pressure'] == 1
+
+
+def test_old_activity_and_pressure_expire(advisor, monkeypatch):
+    advisor.record_change('class-1')
+    advisor.record_pressure('class-1')
+    later = polling.time.monotonic() + advisor.window + 1
+    monkeypatch.setattr(polling.time, 'monotonic', lambda: later)
+    assert advisor.delay('class-1', idle_for(300)) == pytest.approx(10, rel=0.01)
+    assert advisor.stats() == {'active_classrooms': 0, 'classrooms_under_pressure': 0}
+
+
+def test_tracked_classrooms_are_bounded(advisor):
+    advisor.max_classrooms = 2
+    for classroom_id in ('class-1', 'class-2', 'class-3'):
+        advisor.record_change(classroom_id)
+        advisor.record_pressure(classroom_id)
+    assert list(advisor._changes) == ['class-2', 'class-3']
+    assert list(advisor._pressure) == ['class-2', 'class-3']
+
+
+def test_delays_are_jittered_by_ten_percent():
+    advisor = PollAdvisor(min_delay=1)
+    delays = {advisor.delay_ms('class-1') for _ in range(200)}
+    assert len(delays) > 1 and min(delays) >= 900 and max(delays) <= 1100
+
+
+def test_notes_responses_carry_the_advice(app, advisor, monkeypatch):
+    # Earlier tests' saves are still recent changes to the app's own advisor
+    monkeypatch.setattr(app, 'poll_advisor', advisor)
+    client = app.app.test_client()
+    assert client.get('/api/notes/class-1?view=true').get_json()['next_poll_ms'] == 1000
+    advisor.record_pressure('class-1')
+    assert client.get('/api/notes/class-1?view=true').get_json()['next_poll_ms'] == 2000
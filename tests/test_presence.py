@@ -0,0 +1,74 @@
+import pytest
+
+from presence import PresenceHub, UnknownMember
+
+
+@pytest.fixture
+def hub():
+    return PresenceHub(member_ttl=30, frame_history=3, max_members=3)
+
+
+def age(hub, classroom_id, client_id, seconds):
+    """Pretend ``client_id`` last sent a heartbeat ``seconds`` earlier than it did"""
+    hub._room(classroom_id).last_seen[client_id] -= seconds
+
+
+def test_members_missing_heartbeats_are_expired(hub):
+    hub.join('class-1', 'a', 'Alice', 'owner')
+    hub.join('class-1', 'b', 'Bob', 'viewer')
+    hub.tick()
+    age(hub, 'class-1', 'a', 31)
+    age(hub, 'class-1', 'b', 29)
+    hub.tick()
+    assert hub.count('class-1') == 1
+    with pytest.raises(UnknownMember):
+        hub.heartbeat('class-1', 'a', 0)
+    # The survivor sees the expiry as a removal
+    update = hub.heartbeat('class-1', 'b', 1)
+    assert update['frames'][-1]['changes'] == [{'client_id': 'a', 'member': None}]
+
+
+def test_heartbeats_keep_members_alive(hub):
+    hub.join('class-1', 'a', 'Alice', 'owner')
+    age(hub, 'class-1', 'a', 31)
+    hub.heartbeat('class-1', 'a', 0)
+    hub.tick()
+    assert hub.count('class-1') == 1
+
+
+def test_empty_rooms_are_dropped(hub):
+    hub.join('class-1', 'a', 'Alice', 'owner')
+    hub.leave('class-1', 'a')
+    hub.tick()
+    assert hub.stats() == {'rooms': 0, 'members': 0}
+    with pytest.raises(UnknownMember):
+        hub.heartbeat('class-1', 'a', 0)
+
+
+def test_changes_between_ticks_are_coalesced(hub):
+    hub.join('class-1', 'a', 'Alice', 'owner')
+    for line in range(5):
+        hub.heartbeat('class-1', 'a', 0, cursor={'line': line})
+    assert hub.tick() == 1
+    frames = hub.heartbeat('class-1', 'a', 0)['frames']
+    assert len(frames) == 1
+    assert frames[0]['changes'][0]['member']['cursor'] == {'line': 4}
+
+
+def test_members_behind_the_frame_history_get_the_full_state(hub):
+    hub.join('class-1', 'a', 'Alice', 'owner')
+    for line in range(5):
+        hub.heartbeat('class-1', 'a', 0, cursor={'line': line})
+        hub.tick()
+    update = hub.heartbeat('class-1', 'a', 0)
+    assert update['resync'] and update['seq'] == 5
+    assert [member['client_id'] for member in update['members']] == ['a']
+
+
+def test_rooms_are_capped(hub):
+    for client_id in 'abc':
+        hub.join('class-1', client_id, client_id, 'viewer')
+    with pytest.raises(OverflowError):
+        hub.join('class-1', 'd', 'd', 'viewer')
+    # Members already in the room may join again
+    hub.join('class-1', 'a', 'a', 'viewer')
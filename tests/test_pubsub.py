@@ -0,0 +1,113 @@
+import logging
+import os
+import queue
+import socket
+import time
+
+import pytest
+
+from pubsub import Broker, LocalBroker, LocalBus, SocketBus, create_bus
+
+
+@pytest.fixture
+def broker():
+    broker = Broker(port=0).start()
+    yield broker
+    broker.stop()
+
+
+class Node:
+    """A SocketBus with its deliveries and resyncs collected in queues"""
+
+    def __init__(self, broker, node_id):
+        host, port = broker.address
+        self.bus = SocketBus(host, port, node_id=node_id)
+        self.messages = queue.Queue()
+        self.resyncs = queue.Queue()
+        self.bus.subscribe(self.messages.put)
+        self.bus.on_resync(self.resyncs.put)
+        self.bus.start()
+        assert self.bus.wait_connected(5)
+
+    def next_message(self):
+        return self.messages.get(timeout=5)
+
+
+def wait_for_peers(broker, count):
+    # A connection is accepted before the broker's handler registers it
+    for _ in range(500):
+        with broker._lock:
+            if len(broker._clients) >= count:
+                return
+        time.sleep(0.01)
+    raise AssertionError('Clients did not reach the broker')
+
+
+@pytest.fixture
+def nodes(broker):
+    first, second = Node(broker, 'node-a'), Node(broker, 'node-b')
+    wait_for_peers(broker, 2)
+    yield first, second
+    first.bus.stop()
+    second.bus.stop()
+
+
+def test_messages_reach_the_other_node_but_not_the_sender(nodes):
+    first, second = nodes
+    first.bus.publish('notes.changed', {'classroom_id': 'class-1'})
+    message = second.next_message()
+    assert message['origin'] == 'node-a' and message['seq'] == 1
+    assert message['data'] == {'classroom_id': 'class-1'}
+    second.bus.publish('notes.changed', {'classroom_id': 'class-2'})
+    assert first.next_message()['data'] == {'classroom_id': 'class-2'}
+    assert first.messages.empty() and second.messages.empty()
+    assert second.bus.stats()['peers'] == {'node-a': 1}
+
+
+def test_a_gap_in_sequence_numbers_triggers_a_resync(nodes):
+    first, second = nodes
+    first.bus.publish('notes.changed', {'classroom_id': 'class-1'})
+    second.next_message()
+    # Messages 2 and 3 are lost on the way
+    first.bus._seq += 2
+    first.bus.publish('notes.changed', {'classroom_id': 'class-4'})
+    assert second.next_message()['seq'] == 4
+    assert 'missed 2 messages from node-a' in second.resyncs.get(timeout=5)
+    counters = second.bus.stats()['counters']
+    assert counters['gaps'] == 1 and counters['missed'] == 2
+
+
+def test_reconnecting_resyncs_the_node_itself(broker):
+    node = Node(broker, 'node-a')
+    try:
+        wait_for_peers(broker, 1)
+        with broker._lock:
+            (client,) = broker._clients
+        # The broker dropping the connection: the node reconnects and may have missed messages
+        client.shutdown(socket.SHUT_RDWR)
+        assert node.resyncs.get(timeout=15) == 'reconnected to broker'
+        assert node.bus.wait_connected(5)
+        assert node.bus.stats()['counters']['reconnects'] == 1
+    finally:
+        node.bus.stop()
+
+
+def test_duplicates_and_own_echoes_are_dropped():
+    broker = LocalBroker()
+    first, second = LocalBus(broker, node_id='node-a'), LocalBus(broker, node_id='node-b')
+    received = []
+    first.subscribe(received.append)
+    second.subscribe(received.append)
+    message = first.publish('notes.changed', {})
+    second._receive(message)
+    assert [m['origin'] for m in received] == ['node-a']
+    assert second.stats()['counters']['duplicates'] == 1
+
+
+def test_workers_sharing_a_node_id_stay_distinct_nodes(caplog):
+    config = {'PUBSUB_BACKEND': 'local', 'PUBSUB_BROKER': '', 'NODE_ID': 'web-1', 'WORKER_PROCESSES': 1}
+    assert create_bus(config).node_id == f'web-1-{os.getpid()}'
+    logger = logging.getLogger('test_pubsub')
+    with caplog.at_level(logging.WARNING, logger='test_pubsub'):
+        create_bus(dict(config, WORKER_PROCESSES=3), logger=logger)
+    assert "PUBSUB_BACKEND is 'local' with 3 worker processes" in caplog.text
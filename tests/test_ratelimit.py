@@ -0,0 +1,105 @@
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from metrics import Counters
+from polling import PollAdvisor
+from ratelimit import MemoryRateLimitBackend, SQLiteRateLimitBackend
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteRateLimitBackend(str(tmp_path / 'ratelimit.db'))
+    return MemoryRateLimitBackend()
+
+
+def test_take_all_spends_from_every_bucket_or_none(backend):
+    assert backend.take_all([('a', 1, 2), ('b', 1, 1)]) == (0, None)
+    wait, index = backend.take_all([('a', 1, 2), ('b', 1, 1)])
+    assert wait > 0 and index == 1
+    # The refused request left a's last token in place
+    assert backend.take('a', 0.001, 2) == 0
+    assert backend.take('a', 0.001, 2) > 0
+
+
+@pytest.fixture
+def limited(app, monkeypatch):
+    """Rate limiting on, with a fresh backend and a tight 'poll' rule"""
+    monkeypatch.setattr(app.rate_limiter, 'enabled', True)
+    monkeypatch.setattr(app.rate_limiter, 'backend', MemoryRateLimitBackend())
+    monkeypatch.setattr(app.rate_limiter, 'counters', Counters())
+    monkeypatch.setitem(app.rate_limiter.rules, 'poll', {'classroom': (0.001, 4), 'network': (0.001, 3), 'client': (0.001, 2)})
+    monkeypatch.setattr(app, 'poll_advisor', PollAdvisor())
+    app.dynamodb.Table('live_notes').put_item(Item={
+        'classroom_id': 'class-1', 'content': 'notes', 'user_email': 'owner@example.com', 'last_updated': 'v1'
+    })
+    return app
+
+
+def poll(client, classroom_id='class-1', tab=None, addr='10.0.0.1'):
+    headers = {'X-Client-Id': tab} if tab else {}
+    return client.get(f'/api/notes/{classroom_id}?view=true', headers=headers, environ_base={'REMOTE_ADDR': addr})
+
+
+def test_anonymous_viewers_get_no_session(limited):
+    client = limited.app.test_client()
+    response = poll(client, tab='tab-1')
+    assert response.status_code == 200
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_tabs_behind_one_address_get_a_bucket_each(limited):
+    client = limited.app.test_client()
+    assert [poll(client, tab='tab-1').status_code for _ in range(3)] == [200, 200, 429]
+    assert poll(client, tab='tab-2').status_code == 200
+    # The address as a whole is still capped, whatever ids it invents
+    assert poll(client, tab='tab-3').status_code == 429
+    assert limited.rate_limiter.stats()['poll.shed.network'] == 1
+    assert poll(client, tab='tab-3', addr='10.0.0.2').status_code == 200
+
+
+def test_malformed_client_ids_fall_back_to_the_address(limited):
+    client = limited.app.test_client()
+    assert poll(client, tab='a b').status_code == 200
+    assert poll(client, tab='c d').status_code == 200
+    assert poll(client, tab='e f').status_code == 429
+    assert limited.rate_limiter.stats()['poll.shed.client'] == 1
+
+
+def test_only_classroom_shedding_raises_the_poll_delay(limited):
+    client = limited.app.test_client()
+    advisor = limited.poll_advisor
+    poll(client, tab='tab-1')
+    poll(client, tab='tab-1')
+    assert poll(client, tab='tab-1').status_code == 429
+    assert advisor.stats()['classrooms_under_pressure'] == 0
+
+    assert poll(client, tab='tab-2', addr='10.0.0.2').status_code == 200
+    assert poll(client, tab='tab-3', addr='10.0.0.3').status_code == 200
+    assert poll(client, tab='tab-4', addr='10.0.0.4').status_code == 429
+    assert limited.rate_limiter.stats()['poll.shed.classroom'] == 1
+    assert advisor._under_pressure('class-1', time.monotonic())
+    assert not advisor._under_pressure('class-2', time.monotonic())
+
+
+def test_dynamodb_throttling_raises_the_poll_delay_for_that_classroom(app, monkeypatch):
+    monkeypatch.setattr(app, 'poll_advisor', PollAdvisor())
+
+    def throttled(classroom_id):
+        raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'slow down'}}, 'GetItem')
+
+    monkeypatch.setattr(app, 'get_cached_notes', throttled)
+    response = app.app.test_client().get('/api/notes/class-1?view=true')
+    assert response.status_code == 503
+    assert app.poll_advisor.stats()['classrooms_under_pressure'] == 1
+    assert app.poll_advisor._under_pressure('class-1', time.monotonic())
+
+
+def test_pressure_doubles_the_delay_for_its_classroom_only(monkeypatch):
+    monkeypatch.setattr('polling.random.uniform', lambda low, high: 1)
+    advisor = PollAdvisor(min_delay=1, max_delay=30)
+    advisor.record_pressure('class-1')
+    assert advisor.delay('class-1') == 2
+    assert advisor.delay('class-2') == 1
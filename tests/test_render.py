@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from render import RenderCache, parse_content, render_html, theme_css
+
+MONACO_LOADER = 'monaco-editor/0.36.1/min/vs/loader.min.js'
+
+
+def content(text, language='python'):
+    return json.dumps({'text': text, 'language': language})
+
+
+@pytest.fixture
+def cache():
+    cache = RenderCache(workers=1, max_bytes=64)
+    yield cache
+    cache.stop()
+
+
+def test_text_is_escaped():
+    html = render_html('<script>alert("x")</script> & more', 'html')
+    assert '<script>' not in html
+    assert '&lt;' in html and '&amp;' in html
+
+
+def test_unknown_languages_and_plain_content_render_as_text():
+    assert parse_content('not json') == ('not json', 'plaintext')
+    assert parse_content(json.dumps({'text': 'x'})) == ('x', 'plaintext')
+    assert parse_content(None) == ('', 'plaintext')
+    # Text lexer output has no token spans, only the escaped text
+    assert 'class="k"' not in render_html('def f(): pass', 'no-such-language')
+    assert 'class="k"' in render_html('def f(): pass', 'python')
+
+
+def test_theme_css_is_scoped():
+    css = theme_css('dark')
+    assert css and all(line.startswith('.rendered-code') for line in css.splitlines())
+
+
+def test_versions_render_once_and_new_ones_miss(cache):
+    key, html = cache.get(content('def f(): pass'), wait=5)
+    assert 'class="k"' in html
+    assert cache.get(content('def f(): pass'), wait=5) == (key, html)
+    new_key, new_html = cache.get(content('def g(): pass'), wait=5)
+    assert new_key != key and 'g' in new_html
+    assert cache.stats()['counters'] == {'misses': 2, 'rendered': 2, 'hits': 1}
+
+
+def test_large_documents_are_only_escaped(cache):
+    _, html = cache.get(content('def f(): pass\n' * 10), wait=5)
+    assert 'class="k"' not in html
+
+
+@pytest.fixture
+def rendering(app, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'RENDER_ENABLED', True)
+    app.dynamodb.Table('live_notes').put_item(Item={
+        'classroom_id': 'class-1', 'user_email': 'owner@example.com', 'revision': 1,
+        'last_updated': '2024-05-01T10:00:00', 'content': content('first = 1')
+    })
+    return app
+
+
+def test_rendered_notes_follow_new_revisions(rendering):
+    client = rendering.app.test_client()
+    body = client.get('/api/notes/class-1/rendered?view=true').get_json()
+    assert 'first' in body['html']
+    version = body['last_updated']
+    assert client.get(f'/api/notes/class-1/rendered?view=true&version={version}').get_json()['unchanged']
+
+    owner = rendering.app.test_client()
+    with owner.session_transaction() as session:
+        session['user'] = 'owner@example.com'
+    assert owner.post('/api/notes/class-1', json={'content': content('second = 2')}).status_code == 200
+    body = client.get(f'/api/notes/class-1/rendered?view=true&version={version}').get_json()
+    assert 'second' in body['html'] and body['last_updated'] != version
+
+
+def test_rendered_views_skip_the_editor(rendering):
+    client = rendering.app.test_client()
+    page = client.get('/view/class-1').get_data(as_text=True)
+    assert 'data-rendered="true"' in page and MONACO_LOADER not in page
+    assert MONACO_LOADER in client.get('/view/class-1?editor=true').get_data(as_text=True)
+    rendering.app.config['RENDER_ENABLED'] = False
+    assert MONACO_LOADER in client.get('/view/class-1').get_data(as_text=True)
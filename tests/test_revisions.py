@@ -0,0 +1,106 @@
+import pytest
+
+from conftest import create_table
+from revisions import PACK_SLICE, RevisionLog, RevisionNotFound, apply_delta, make_delta, pack, unpack
+
+
+@pytest.fixture
+def log(dynamodb):
+    table = create_table(dynamodb, 'note_revisions', 'classroom_id', 'revision')
+    revision_log = RevisionLog(table, snapshot_interval=4, retain=8, max_snapshots=3)
+    yield revision_log
+    revision_log.stop()
+
+
+def document(revision):
+    """Notes content as stored: a JSON string whose text breaks lines with escaped newlines"""
+    lines = [f'line {n}\\n' for n in range(20)]
+    lines[revision % 20] = f'edited in {revision}\\n'
+    return '{"text": "' + ''.join(lines) + '", "language": "python"}'
+
+
+def save_revisions(log, classroom_id, count):
+    contents = {}
+    previous = None
+    for revision in range(1, count + 1):
+        contents[revision] = document(revision)
+        log.append(classroom_id, revision, previous, contents[revision], 'owner@example.com')
+        previous = contents[revision]
+    return contents
+
+
+def test_delta_round_trip_keeps_unchanged_and_repeated_lines():
+    old = 'same\\nsame\\nold\\nsame\\nsame\\n'
+    new = 'same\\nsame\\nnew\\nadded\\nsame\\nsame\\n'
+    ops = make_delta(old, new)
+    # Only the changed middle is spelled out
+    assert ops[0] == ['=', 2] and ['-', 1] in ops and ['+', 'new\\nadded\\n'] in ops
+    assert apply_delta(old, ops) == new
+    assert apply_delta('', make_delta('', new)) == new
+    assert apply_delta(old, make_delta(old, '')) == ''
+
+
+def test_pack_spans_slices_and_non_ascii_text():
+    text = ('é"\\ \n\t😀' * PACK_SLICE)[:3 * PACK_SLICE + 7]
+    assert unpack(pack(text)) == text
+    assert unpack(pack([['=', 3], ['+', 'x\n']])) == [['=', 3], ['+', 'x\n']]
+
+
+def test_snapshots_at_interval_and_deltas_between(log):
+    save_revisions(log, 'class-1', 9)
+    kinds = {int(item['revision']): item['kind'] for item in log.history('class-1', limit=20)}
+    assert kinds == {1: 'snapshot', 2: 'delta', 3: 'delta', 4: 'delta',
+                     5: 'snapshot', 6: 'delta', 7: 'delta', 8: 'delta', 9: 'snapshot'}
+
+
+def test_replay_rebuilds_every_revision(log):
+    contents = save_revisions(log, 'class-1', 11)
+    replayed = {int(item['revision']): content for item, content in log.replay('class-1', 2, 11)}
+    assert replayed == {revision: contents[revision] for revision in range(2, 12)}
+    # A delta read starts from the snapshot below it
+    item, content = log.get('class-1', 7)
+    assert item['kind'] == 'delta' and content == contents[7]
+
+
+def test_missing_revisions_are_reported(log):
+    save_revisions(log, 'class-1', 3)
+    with pytest.raises(RevisionNotFound):
+        log.get('class-1', 4)
+    with pytest.raises(RevisionNotFound):
+        list(log.replay('class-1', 1, 5))
+    with pytest.raises(RevisionNotFound):
+        log.get('other-class', 1)
+
+
+def test_compaction_drops_aged_out_deltas_and_old_snapshots(log):
+    contents = save_revisions(log, 'class-1', 17)
+    log.stop()
+    # retain=8 behind the snapshot at 17: deltas below revision 9 are gone, and of the
+    # snapshots 1, 5, 9, 13 and 17 only the last max_snapshots=3 are kept
+    assert log.get('class-1', 9)[1] == contents[9]
+    for revision in (1, 5, 6):
+        with pytest.raises(RevisionNotFound):
+            log.get('class-1', revision)
+    assert {int(item['revision']): content for item, content in log.replay('class-1', 9, 17)} == \
+        {revision: contents[revision] for revision in range(9, 18)}
+
+
+def test_only_aligned_revisions_may_start_without_previous_content(log):
+    save_revisions(log, 'class-1', 2)
+    with pytest.raises(ValueError):
+        log.append('class-1', 3, None, document(3), 'owner@example.com')
+    assert [int(item['revision']) for item in log.history('class-1')] == [2, 1]
+    # A snapshot revision needs nothing before it
+    log.append('class-2', 5, None, document(5), 'owner@example.com')
+    assert log.get('class-2', 5)[1] == document(5)
+
+
+def test_stop_waits_for_queued_compactions(log, monkeypatch):
+    compacted = []
+    compact = log.compact
+    monkeypatch.setattr(log, 'compact', lambda classroom_id, revision: compacted.append(compact(classroom_id, revision) or revision))
+    save_revisions(log, 'class-1', 17)
+    log.stop()
+    assert compacted == [5, 9, 13, 17]
+    with pytest.raises(RuntimeError):
+        log.executor.submit(print)
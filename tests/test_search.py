@@ -0,0 +1,134 @@
+import json
+import sqlite3
+
+import pytest
+
+from search import SearchIndex, SearchIndexer, is_newer, query_terms, snippets, term_counts
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / 'search.db'))
+
+
+def note(classroom_id, text, owner='owner@example.com', revision=1, last_updated='2024-05-01T10:00:00', class_name=None):
+    return {
+        'classroom_id': classroom_id, 'user_email': owner, 'class_name': class_name or classroom_id,
+        'content': json.dumps({'text': text, 'language': 'python'}), 'revision': revision, 'last_updated': last_updated
+    }
+
+
+def indexer_for(index, items=(), scan=None):
+    stored = {item['classroom_id']: item for item in items}
+    return SearchIndexer(index, stored.get, scan or (lambda: iter([list(stored.values())])))
+
+
+def test_terms_ignore_punctuation_case_and_short_words():
+    assert term_counts('def Parse(x): return parse_all(x)') == {'def': 1, 'parse': 1, 'return': 1, 'parse_all': 1}
+    assert query_terms('Loop for LOOP') == ['loop', 'for']
+    assert snippets('first\nthe loop here\nlast', ['loop']) == [{'line': 2, 'text': 'the loop here'}]
+
+
+def test_search_ranks_the_owners_classrooms_containing_every_term(index):
+    index.index('class-1', 'owner@example.com', 'Loops', 'for loop\nwhile loop\nloop again', '1')
+    index.index('class-2', 'owner@example.com', 'Functions', 'def function with a loop', '1')
+    index.index('class-3', 'other@example.com', 'Theirs', 'loop loop loop', '1')
+    results = index.search('owner@example.com', 'loop')
+    assert [result['classroom_id'] for result in results] == ['class-1', 'class-2']
+    assert [result['classroom_id'] for result in index.search('owner@example.com', 'loop func')] == ['class-2']
+    assert index.search('owner@example.com', 'missing') == []
+    index.remove('class-1')
+    assert [result['classroom_id'] for result in index.search('owner@example.com', 'loop')] == ['class-2']
+
+
+def test_only_newer_items_replace_the_indexed_row(index):
+    assert index.index('class-1', 'owner@example.com', 'c', 'current', '2024-05-01T10:00:00', revision=5)
+    # A slower worker or a rebuild page carrying an older copy
+    assert not index.index('class-1', 'owner@example.com', 'c', 'older', '2024-05-01T09:00:00', revision=4)
+    assert not index.index('class-1', 'owner@example.com', 'c', 'same', '2024-05-01T10:00:00', revision=5)
+    assert index.search('owner@example.com', 'current')
+    assert index.index('class-1', 'owner@example.com', 'c', 'newer', '2024-05-01T11:00:00', revision=6)
+    assert index.search('owner@example.com', 'newer') and not index.search('owner@example.com', 'current')
+
+
+def test_is_newer_falls_back_to_timestamps():
+    assert is_newer('2024-05-01T11:00:00', None, '2024-05-01T10:00:00', None)
+    assert not is_newer('2024-05-01T09:00:00', None, '2024-05-01T10:00:00', 3)
+    assert is_newer('1700000000001', None, '1700000000000', None)
+    assert not is_newer('v1', None, 'v1', None)
+    assert is_newer('v2', None, 'v1', None)
+
+
+def test_index_files_without_revisions_are_migrated(tmp_path):
+    path = str(tmp_path / 'search.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE documents (classroom_id TEXT PRIMARY KEY, owner TEXT, class_name TEXT, version TEXT, text TEXT NOT NULL)')
+    conn.execute("INSERT INTO documents VALUES ('class-1', 'owner@example.com', 'c', '2024-05-01T10:00:00', 'old')")
+    conn.commit()
+    conn.close()
+    index = SearchIndex(path)
+    assert index.index('class-1', 'owner@example.com', 'c', 'new', '2024-05-01T11:00:00', revision=2)
+
+
+def test_one_process_claims_the_build_until_it_is_released_or_expires(index):
+    other = SearchIndex(index.path)
+    assert index.claim_build()
+    assert not other.claim_build()
+    index.release_build()
+    assert other.claim_build()
+    # A claim whose builder died is taken over once it is old enough
+    other._connect().execute("UPDATE meta SET value = ? WHERE key = 'build_claimed_at'", (str(0),))
+    assert index.claim_build()
+    index.finish_build()
+    index._connect().execute("UPDATE meta SET value = ? WHERE key = 'build_claimed_at'", (str(0),))
+    assert not other.claim_build()
+
+
+def test_a_failed_first_build_releases_its_claim(index):
+    def broken_scan():
+        raise RuntimeError('table unavailable')
+        yield
+
+    indexer = indexer_for(index, scan=broken_scan)
+    indexer._claimed = index.claim_build()
+    indexer._run_rebuild()
+    assert indexer.stats()['counters']['errors'] == 1
+    assert SearchIndex(index.path).claim_build()
+
+
+def test_rebuild_indexes_every_item_and_drops_deleted_classrooms(index):
+    index.index('gone', 'owner@example.com', 'Gone', 'deleted loop', '1')
+    items = [note('class-1', 'for loop'), note('class-2', 'while loop')]
+    indexer = indexer_for(index, items)
+    indexer._claimed = index.claim_build()
+    indexer._run_rebuild()
+    assert index.classroom_ids() == {'class-1', 'class-2'}
+    assert not SearchIndex(index.path).claim_build()
+
+
+def test_queued_changes_collapse_into_the_latest(index):
+    indexer = indexer_for(index, [note('class-1', 'stored text', revision=3)])
+    indexer.update(note('class-1', 'first save', revision=1))
+    indexer.update(note('class-1', 'second save', revision=2))
+    indexer.refresh('class-1')
+    assert indexer.drain() == {'class-1'}
+    assert indexer.stats()['counters'] == {'indexed': 1}
+    assert index.search('owner@example.com', 'stored')
+    indexer.remove('class-1')
+    indexer.drain()
+    assert index.classroom_ids() == set()
+
+
+def test_search_endpoint(app, index, monkeypatch):
+    indexer = indexer_for(index)
+    indexer.update(note('class-1', 'binary search tree'))
+    indexer.drain()
+    monkeypatch.setattr(app, 'search_indexer', indexer)
+    client = app.app.test_client()
+    assert client.get('/api/search?q=tree').status_code == 401
+    with client.session_transaction() as session:
+        session['user'] = 'owner@example.com'
+    assert client.get('/api/search').status_code == 400
+    results = client.get('/api/search?q=bin').get_json()['results']
+    assert [result['classroom_id'] for result in results] == ['class-1']
+    assert results[0]['snippets'] == [{'line': 1, 'text': 'binary search tree'}]
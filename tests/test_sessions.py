@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+import pytest
+from flask import Flask, jsonify, session
+
+import session_store
+from session_store import (CachedCookieSessionInterface, LocalSessionBackend, ServerSideSessionInterface,
+                           create_session_interface)
+
+
+class Clock:
+    """Stands in for time.time in session_store and cache"""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_store.time, 'time', clock)
+    return clock
+
+
+def make_app(interface):
+    app = Flask(__name__)
+    app.secret_key = 'test-secret'
+    app.permanent_session_lifetime = timedelta(hours=1)
+    app.session_interface = interface
+
+    @app.route('/login/<email>', methods=['POST'])
+    def login(email):
+        session.permanent = True
+        session['user'] = email
+        return jsonify({})
+
+    @app.route('/me')
+    def me():
+        return jsonify({'user': session.get('user')})
+
+    @app.route('/logout', methods=['POST'])
+    def logout():
+        session.clear()
+        return jsonify({})
+
+    return app
+
+
+@pytest.fixture(params=['cookie', 'server'])
+def interface(request):
+    if request.param == 'cookie':
+        return CachedCookieSessionInterface(ttl=60, refresh_interval=300)
+    return ServerSideSessionInterface(backend=LocalSessionBackend(), ttl=60, refresh_interval=300)
+
+
+def test_round_trip_and_logout(interface):
+    client = make_app(interface).test_client()
+    assert client.get('/me').get_json() == {'user': None}
+    client.post('/login/ada@example.com')
+    assert client.get('/me').get_json() == {'user': 'ada@example.com'}
+    # Served from the cache the second time round
+    assert client.get('/me').get_json() == {'user': 'ada@example.com'}
+    assert interface.cache.stats()['hits'] >= 1
+    client.post('/logout')
+    assert client.get('/me').get_json() == {'user': None}
+
+
+def test_tampered_cookies_are_ignored(interface):
+    client = make_app(interface).test_client()
+    client.post('/login/ada@example.com')
+    cookie = client.get_cookie('session') if hasattr(client, 'get_cookie') else next(c for c in client.cookie_jar if c.name == 'session')
+    client.set_cookie('localhost', 'session', cookie.value[:-2] + 'xx')
+    assert client.get('/me').get_json() == {'user': None}
+
+
+def test_sessions_expire_after_their_lifetime(interface, clock):
+    client = make_app(interface).test_client()
+    client.post('/login/ada@example.com')
+    clock.now += 61 * 60
+    interface.cache.clear()
+    assert client.get('/me').get_json() == {'user': None}
+
+
+def test_active_sessions_are_renewed(interface, clock):
+    client = make_app(interface).test_client()
+    client.post('/login/ada@example.com')
+    # Older than refresh_interval, so this request pushes the expiry forward
+    clock.now += 30 * 60
+    assert client.get('/me').get_json() == {'user': 'ada@example.com'}
+    clock.now += 45 * 60
+    interface.cache.clear()
+    assert client.get('/me').get_json() == {'user': 'ada@example.com'}
+
+
+def test_server_sessions_of_a_user_can_be_revoked():
+    interface = ServerSideSessionInterface(backend=LocalSessionBackend())
+    app = make_app(interface)
+    laptop, phone, other = app.test_client(), app.test_client(), app.test_client()
+    laptop.post('/login/ada@example.com')
+    phone.post('/login/ada@example.com')
+    other.post('/login/bob@example.com')
+    for client in (laptop, phone, other):
+        client.get('/me')
+
+    assert interface.revoke_user('ada@example.com') == 2
+    assert laptop.get('/me').get_json() == {'user': None}
+    assert phone.get('/me').get_json() == {'user': None}
+    assert other.get('/me').get_json() == {'user': 'bob@example.com'}
+
+
+def test_cookie_sessions_report_that_they_cannot_be_revoked():
+    assert CachedCookieSessionInterface().revoke_user('ada@example.com') is None
+
+
+def test_server_sessions_refuse_several_workers():
+    config = {'SESSION_BACKEND': 'server', 'SESSION_CACHE_SIZE': 10, 'SESSION_CACHE_TTL': 60,
+              'SESSION_REFRESH_INTERVAL': 300, 'WORKER_PROCESSES': 3}
+    with pytest.raises(RuntimeError):
+        create_session_interface(config)
+    config['WORKER_PROCESSES'] = 1
+    assert isinstance(create_session_interface(config), ServerSideSessionInterface)
@@ -0,0 +1,60 @@
+import pytest
+
+from cache import MISSING
+from conftest import create_table
+from otp import DynamoDbOtpStore, MemoryOtpStore
+
+
+@pytest.fixture
+def mail(app, monkeypatch):
+    """Verification codes sent, by email, instead of sending them"""
+    sent = {}
+
+    def send(email, otp):
+        sent[email] = otp
+        return True
+
+    monkeypatch.setattr(app, 'send_verification_email', send)
+    return sent
+
+
+def test_signup_verify_and_login(app, mail):
+    client = app.app.test_client()
+    account = {'name': 'Ada', 'email': 'ada@example.com', 'password': 'secret'}
+    assert client.post('/api/login', json=account).status_code == 401
+    assert client.post('/api/signup', json=account).get_json()['success']
+    # Neither the unknown email nor the unverified user is cached for other requests to trust
+    assert app.users_cache.get('ada@example.com') is MISSING
+    assert client.post('/api/login', json=account).status_code == 401
+
+    assert client.post('/api/verify', json={'email': 'ada@example.com', 'otp': 'nope'}).status_code == 400
+    assert client.post('/api/verify', json={'email': 'ada@example.com', 'otp': mail['ada@example.com']}).get_json()['success']
+    assert client.post('/api/login', json=account).status_code == 200
+    assert app.users_cache.get('ada@example.com')['verified'] is True
+
+
+def test_unverified_users_are_read_again_after_verification_elsewhere(app):
+    table = app.dynamodb.Table('users')
+    table.put_item(Item={'email': 'ada@example.com', 'password_hash': 'x', 'verified': False})
+    assert app.get_cached_user('ada@example.com')['verified'] is False
+    # Verified by another worker, whose invalidation has not arrived
+    table.update_item(Key={'email': 'ada@example.com'}, UpdateExpression='SET verified = :v', ExpressionAttributeValues={':v': True})
+    assert app.get_cached_user('ada@example.com')['verified'] is True
+
+
+@pytest.mark.parametrize('kind', ['memory', 'dynamodb'])
+def test_otp_stores_keep_the_latest_code_until_it_expires(dynamodb, kind):
+    if kind == 'dynamodb':
+        table = create_table(dynamodb, 'users', 'email')
+        table.put_item(Item={'email': 'ada@example.com'})
+        store = DynamoDbOtpStore(table)
+    else:
+        store = MemoryOtpStore()
+    assert store.get('ada@example.com') is None
+    store.set('ada@example.com', '111111', 600)
+    store.set('ada@example.com', '222222', 600)
+    assert store.get('ada@example.com') == '222222'
+    store.delete('ada@example.com')
+    assert store.get('ada@example.com') is None
+    store.set('ada@example.com', '333333', -1)
+    assert store.get('ada@example.com') is None
@@ -0,0 +1,103 @@
+import json
+
+import boto3
+import pytest
+from botocore.awsrequest import AWSResponse
+from botocore.exceptions import ClientError
+
+from conftest import REGION, create_table
+from storage import CapacityTelemetry, backoff_delay, capacity_settings, client_config, is_throttle_error
+
+
+class RawResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def throttle_first(count):
+    """before-send handler answering the first ``count`` requests with a throttling error"""
+    calls = []
+
+    def handler(request, **kwargs):
+        calls.append(request)
+        if len(calls) <= count:
+            body = json.dumps({'__type': 'com.amazonaws.dynamodb.v20120810#ProvisionedThroughputExceededException',
+                               'message': 'slow down'}).encode()
+            return AWSResponse(request.url, 400, {'x-amzn-requestid': 'test'}, RawResponse(body))
+        return None
+    return handler, calls
+
+
+@pytest.fixture
+def client(dynamodb, monkeypatch):
+    create_table(dynamodb, 'live_notes', 'classroom_id')
+    # botocore sleeps between retries
+    monkeypatch.setattr('botocore.endpoint.time.sleep', lambda seconds: None)
+    return boto3.client('dynamodb', region_name=REGION, config=client_config('standard', max_attempts=3))
+
+
+@pytest.fixture
+def telemetry(client):
+    telemetry = CapacityTelemetry()
+    telemetry.install(client)
+    return telemetry
+
+
+def test_calls_are_counted_with_their_consumed_capacity(client, telemetry):
+    client.put_item(TableName='live_notes', Item={'classroom_id': {'S': 'class-1'}})
+    client.get_item(TableName='live_notes', Key={'classroom_id': {'S': 'class-1'}})
+    stats = telemetry.stats()
+    assert stats['PutItem.calls'] == 1
+    assert stats['GetItem.calls'] == 1
+    assert stats['GetItem.capacity_units'] > 0
+    assert stats['table.live_notes.capacity_units'] == stats['PutItem.capacity_units'] + stats['GetItem.capacity_units']
+
+
+def test_callers_choosing_their_own_consumed_capacity_keep_it(client, telemetry):
+    response = client.get_item(TableName='live_notes', Key={'classroom_id': {'S': 'class-1'}}, ReturnConsumedCapacity='NONE')
+    assert 'ConsumedCapacity' not in response
+    assert 'GetItem.capacity_units' not in telemetry.stats()
+
+
+def test_throttled_attempts_retried_by_botocore_are_counted(client, telemetry):
+    handler, calls = throttle_first(2)
+    client.meta.events.register('before-send.dynamodb.GetItem', handler)
+    client.get_item(TableName='live_notes', Key={'classroom_id': {'S': 'class-1'}})
+    stats = telemetry.stats()
+    assert len(calls) == 3
+    assert stats['GetItem.throttled_attempts'] == 2
+    assert stats['GetItem.calls'] == 1
+    assert 'GetItem.throttled' not in stats
+
+
+def test_calls_still_throttled_after_every_retry_are_counted_and_raised(client, telemetry):
+    handler, calls = throttle_first(10)
+    client.meta.events.register('before-send.dynamodb.GetItem', handler)
+    with pytest.raises(ClientError) as raised:
+        client.get_item(TableName='live_notes', Key={'classroom_id': {'S': 'class-1'}})
+    assert is_throttle_error(raised.value)
+    stats = telemetry.stats()
+    # retries['max_attempts'] counts retries, on top of the first request
+    assert len(calls) == 4
+    assert stats['GetItem.throttled_attempts'] == 4
+    assert stats['GetItem.throttled'] == 1
+
+
+def test_is_throttle_error_ignores_other_errors():
+    assert not is_throttle_error(ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem'))
+    assert not is_throttle_error(ValueError('ProvisionedThroughputExceededException'))
+    assert is_throttle_error(ClientError({'Error': {'Code': 'ThrottlingException'}}, 'Query'))
+
+
+def test_backoff_delay_is_capped():
+    assert all(0 <= backoff_delay(attempt, base=0.05, cap=2.0) <= min(2.0, 0.05 * 2 ** attempt) for attempt in range(12))
+
+
+def test_capacity_settings():
+    assert capacity_settings('PAY_PER_REQUEST') == ({'BillingMode': 'PAY_PER_REQUEST'}, {})
+    table, index = capacity_settings('PROVISIONED', 10, 3)
+    assert table['BillingMode'] == 'PROVISIONED'
+    assert index == {'ProvisionedThroughput': {'ReadCapacityUnits': 10, 'WriteCapacityUnits': 3}}
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from conftest import create_table
+from tracing import SamplingProfiler, Tracer
+
+
+def traced_client(tracer, view):
+    def wsgi_app(environ, start_response):
+        return Response(view())(environ, start_response)
+
+    return Client(tracer.wrap_wsgi(wsgi_app))
+
+
+def test_spans_add_up_per_request_into_server_timing_and_the_slow_log(dynamodb):
+    tracer = Tracer(enabled=True, slow_ms=0, history=1)
+    table = create_table(dynamodb, 'live_notes', 'classroom_id')
+    tracer.install_storage_spans(table.meta.client)
+
+    def view():
+        with tracer.span('cache'):
+            pass
+        with tracer.span('cache'):
+            table.get_item(Key={'classroom_id': 'class-1'})
+        return 'ok'
+
+    response = traced_client(tracer, view).get('/api/notes/class-1')
+    timing = response.headers['Server-Timing']
+    assert timing.startswith('cache;dur=') and 'storage-GetItem;dur=' in timing and 'total;dur=' in timing
+
+    (record,) = tracer.slow
+    assert record['path'] == '/api/notes/class-1' and record['status'] == 200
+    assert record['spans']['cache']['count'] == 2
+    assert set(record['spans']) == {'cache', 'storage.GetItem', 'other'}
+    assert tracer.stats()['counters'] == {'slow': 1, 'traced': 1}
+    # Calls outside a traced request are not timed
+    table.get_item(Key={'classroom_id': 'class-1'})
+    assert tracer.current() is None
+
+
+@pytest.mark.parametrize('settings', [{'enabled': False}, {'enabled': True, 'sample_rate': 0}])
+def test_untraced_requests_pass_straight_through(settings):
+    tracer = Tracer(**settings)
+    spans = []
+
+    def view():
+        spans.append(tracer.span('cache'))
+        return 'ok'
+
+    response = traced_client(tracer, view).get('/')
+    assert 'Server-Timing' not in response.headers
+    assert spans == [tracer.span('cache')]
+    assert tracer.stats()['counters'] == {}
+
+
+def test_fast_requests_are_counted_but_not_logged():
+    tracer = Tracer(enabled=True, slow_ms=60000)
+    traced_client(tracer, lambda: 'ok').get('/')
+    assert tracer.stats()['counters'] == {'traced': 1}
+    assert not tracer.slow
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+def wait_for(profiler):
+    for _ in range(500):
+        if profiler.running is None:
+            return
+        time.sleep(0.01)
+    raise AssertionError('Profile did not finish')
+
+
+def test_profiles_sample_other_threads_one_at_a_time(tmp_path):
+    profiler = SamplingProfiler(str(tmp_path), keep=1)
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,))
+    worker.start()
+    try:
+        name = profiler.start(0.2, interval=0.001)
+        assert profiler.running == name
+        assert profiler.start(0.2) is None
+        wait_for(profiler)
+    finally:
+        stop.set()
+        worker.join()
+
+    result = profiler.load(name)
+    assert result['samples'] > 0
+    assert 'busy_loop (test_tracing.py' in result['collapsed']
+    # The profiler's own thread never shows up
+    assert '_sample (tracing.py' not in result['collapsed']
+    assert profiler.load('../secrets.json') is None
+
+    time.sleep(1)
+    newer = profiler.start(0.01)
+    wait_for(profiler)
+    assert profiler.profiles() == [newer]